@@ -0,0 +1,291 @@
+"""
+ベンチマーク
+
+web_camera.py と同じ経路（StreamDiffusionWrapper の前処理・推論・後処理）を
+ウィンドウなしで繰り返し、設定ごとのスループットと処理時間を比較する。
+入力は録画（app/frame_recorder.py）があればそのフレーム、なければ合成画像を使う。
+
+使い方:
+    python -m app.benchmark batch --sizes 1 2 4 [--frames 64] [--recording capture.sdrec]
+    python -m app.benchmark preprocess [--frames 64] [--camera-size 640 480]
+    python -m app.benchmark blend [--histories 2 4 8] [--frames 64]
+    python -m app.benchmark display [--frames 64]
+    python -m app.benchmark precision [--modes fp32 bf16 int8_dynamic int8_static] [--frames 16]
+"""
+import argparse
+import gc
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from config import config
+
+from .frame_recorder import load_frames
+
+SD_SIDE_LENGTH = config.sd_side_length
+# 計測前に捨てる呼び出し回数
+WARMUP_CALLS = 3
+BENCHMARK_PROMPT = "nature and wildlife, colorful, detailed, artistic"
+
+
+def load_input_frames(count: int, recording_path: Optional[str] = None) -> List[np.ndarray]:
+    """SD 入力サイズの RGB uint8 フレームを count 枚用意する（録画がなければ合成画像）"""
+    return load_frames(count, SD_SIDE_LENGTH, recording_path)
+
+
+def time_calls(fn: Callable, count: int, warmup: int = WARMUP_CALLS) -> np.ndarray:
+    """fn(i) を warmup 回実行してから count 回計測し、1回ごとの秒数を返す"""
+    for i in range(warmup):
+        fn(i)
+    durations = np.empty(count, dtype=np.float64)
+    for i in range(count):
+        started = time.perf_counter()
+        fn(i)
+        durations[i] = time.perf_counter() - started
+    return durations
+
+
+def format_table(rows: Sequence[dict], columns: Sequence[str]) -> str:
+    """辞書のリストを列を揃えた表にする（float は小数1桁）"""
+    cells = [[f"{row[c]:.1f}" if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.rjust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.rjust(w) for v, w in zip(r, widths)) for r in cells]
+    return "\n".join(lines)
+
+
+def load_stream(**kwargs):
+    """web_camera.py と同じ設定の StreamDiffusionWrapper（kwargs は StreamDiffusion に渡す）"""
+    from .stream_diffusion import StreamDiffusion
+
+    return StreamDiffusion(prompt=BENCHMARK_PROMPT, **kwargs).stream
+
+
+def bench_batch(args) -> None:
+    """frame_buffer_size ごとのスループット（推論 + 後処理）"""
+    from PIL import Image
+
+    frames = load_input_frames(args.frames, args.recording)
+    rows = []
+    for size in args.sizes:
+        stream = load_stream(frame_buffer_size=size)
+        tensors = [stream.preprocess_image(Image.fromarray(frame)) for frame in frames]
+        batches = max(1, len(tensors) // size)
+
+        def run(i):
+            start = (i % batches) * size
+            batch = tensors[start:start + size]
+            stream.postprocess_output(stream.infer(batch))
+
+        durations = time_calls(run, batches)
+        per_frame = durations.mean() / size
+        rows.append({
+            "K": size,
+            "fps": 1.0 / per_frame,
+            "call_p50_ms": float(np.percentile(durations, 50) * 1000),
+            "call_p95_ms": float(np.percentile(durations, 95) * 1000),
+            "per_frame_ms": per_frame * 1000,
+            # 最初のフレームはバッチが揃うまで (K-1) フレーム分待つ
+            "added_latency_ms": (size - 1) * per_frame * 1000,
+        })
+        print(f"K={size}: {rows[-1]['fps']:.2f} fps")
+        del stream, tensors
+        gc.collect()
+
+    baseline = rows[0]["fps"]
+    for row in rows:
+        row["speedup"] = f"x{row['fps'] / baseline:.2f}"
+    print(format_table(rows, ["K", "fps", "speedup", "call_p50_ms", "call_p95_ms", "per_frame_ms",
+                              "added_latency_ms"]))
+
+
+def bench_preprocess(args) -> None:
+    """カメラフレームの前処理: PIL の経路と preprocess_array（モデルは読み込まない）"""
+    import cv2
+    import torch
+    from diffusers.image_processor import VaeImageProcessor
+    from PIL import Image
+
+    from .preprocess import ArrayPreprocessor
+
+    # 録画・合成画像を BGR のカメラ解像度に広げる（中央 SD_SIDE_LENGTH*2 を切り抜く経路を通すため）
+    width, height = args.camera_size
+    frames = [
+        cv2.resize(frame[:, :, ::-1], (width, height), interpolation=cv2.INTER_LINEAR)
+        for frame in load_input_frames(args.frames, args.recording)
+    ]
+    crop = SD_SIDE_LENGTH * 2
+    image_processor = VaeImageProcessor(vae_scale_factor=8)
+    preprocessor = ArrayPreprocessor(SD_SIDE_LENGTH, SD_SIDE_LENGTH)
+
+    def pil_path(i):
+        # web_camera.py の従来の前処理（BGR→RGB、PIL で切り抜き・縮小、image_processor）
+        image = Image.fromarray(cv2.cvtColor(frames[i % len(frames)], cv2.COLOR_BGR2RGB))
+        left, top = (image.width - crop) // 2, (image.height - crop) // 2
+        image = image.crop((left, top, left + crop, top + crop)).resize((SD_SIDE_LENGTH, SD_SIDE_LENGTH), Image.NEAREST)
+        image = image.convert("RGB").resize((SD_SIDE_LENGTH, SD_SIDE_LENGTH))
+        return (image_processor.preprocess(image, SD_SIDE_LENGTH, SD_SIDE_LENGTH) + 1.0) / 2.0
+
+    def array_path(i):
+        return preprocessor(frames[i % len(frames)], "bgr", crop_size=crop)
+
+    mismatched = sum(not torch.equal(pil_path(i), array_path(i)) for i in range(len(frames)))
+    rows = []
+    for name, fn in (("pil", pil_path), ("array", array_path)):
+        durations = time_calls(fn, args.frames)
+        rows.append({
+            "path": name,
+            "p50_ms": float(np.percentile(durations, 50) * 1000),
+            "p95_ms": float(np.percentile(durations, 95) * 1000),
+            "fps": 1.0 / durations.mean(),
+        })
+    rows[1]["speedup"] = f"x{rows[0]['p50_ms'] / rows[1]['p50_ms']:.1f}"
+    rows[0]["speedup"] = "x1.0"
+    print(format_table(rows, ["path", "p50_ms", "p95_ms", "fps", "speedup"]))
+    print(f"出力の不一致: {mismatched} / {len(frames)} フレーム")
+
+
+def bench_blend(args) -> None:
+    """フレームブレンド: 従来の履歴リストの平均と FrameBlender の各モード（モデルは読み込まない）"""
+    from .blending import BLEND_MODES, FrameBlender
+
+    frames = [frame.astype(np.float32) / np.float32(255.0) for frame in load_input_frames(args.frames, args.recording)]
+    alpha = config.frame_blend_alpha
+    rows = []
+    for history_size in args.histories:
+        history = []
+
+        def list_mean(i):
+            # web_camera.py の従来のブレンド（履歴をすべて float32 にして毎回平均）
+            output = frames[i % len(frames)]
+            if len(history) >= history_size:
+                history.pop(0)
+            if history:
+                output = np.mean([np.asarray(image, dtype=np.float32) for image in history], axis=0) * (1 - alpha) + (
+                    output * 255.0 * alpha)
+                output = output.astype(np.uint8)
+            else:
+                output = (output * 255.0).astype(np.uint8)
+            history.append(output)
+
+        durations = time_calls(list_mean, args.frames)
+        rows.append({"history": history_size, "mode": "list", "p50_ms": float(np.percentile(durations, 50) * 1000),
+                     "p95_ms": float(np.percentile(durations, 95) * 1000)})
+        for mode in BLEND_MODES:
+            blender = FrameBlender(mode=mode, alpha=alpha, max_history=history_size)
+            durations = time_calls(lambda i: blender.push(frames[i % len(frames)]), args.frames)
+            rows.append({"history": history_size, "mode": mode,
+                         "p50_ms": float(np.percentile(durations, 50) * 1000),
+                         "p95_ms": float(np.percentile(durations, 95) * 1000)})
+    print(format_table(rows, ["history", "mode", "p50_ms", "p95_ms"]))
+
+
+def bench_display(args) -> None:
+    """表示サイズへの拡大方法ごとの処理時間（BGR 化 + 拡大。モデルは読み込まない）"""
+    import torch
+
+    from .display import DISPLAY_SCALERS, DisplayConverter
+
+    frames = [torch.from_numpy(frame).permute(2, 0, 1).float() / 255.0
+              for frame in load_input_frames(args.frames, args.recording)]
+    rows = []
+    for scaler in DISPLAY_SCALERS:
+        converter = DisplayConverter(config.display_width, config.display_height, scaler=scaler)
+        to_bgr = time_calls(lambda i: converter.to_bgr(frames[i % len(frames)]), args.frames)
+        bgr = converter.to_bgr(frames[0])
+        scale = time_calls(lambda i: converter.scale(bgr), args.frames)
+        rows.append({
+            "scaler": scaler,
+            "to_bgr_ms": float(np.percentile(to_bgr, 50) * 1000),
+            "scale_ms": float(np.percentile(scale, 50) * 1000),
+            "scale_p95_ms": float(np.percentile(scale, 95) * 1000),
+        })
+    print(f"{SD_SIDE_LENGTH}px → {config.display_width}x{config.display_height}")
+    print(format_table(rows, ["scaler", "to_bgr_ms", "scale_ms", "scale_p95_ms"]))
+
+
+def bench_precision(args) -> None:
+    """CPU の精度モードごとのスループットと fp32 の出力との差（同じシード・入力で比べる）"""
+    from .cpu_precision import compare_images
+
+    frames = load_input_frames(args.frames, args.recording)
+
+    def to_uint8(image_tensor) -> np.ndarray:
+        image = (image_tensor.float()[0] / 2 + 0.5).clamp(0, 1).permute(1, 2, 0).cpu().numpy()
+        return (image * 255).round().astype(np.uint8)
+
+    references = None
+    rows = []
+    for mode in args.modes:
+        stream = load_stream(device="cpu", cpu_precision=mode, seed=2, calibration_frames=args.calibration_frames)
+        tensors = [stream.preprocess_array(frame, "rgb").clone() for frame in frames]
+        # 出力は前のフレームに依存するため（img2img のバッファ）、時間の計測とは別に先頭から生成する。
+        # int8_static の calibrate で進んだノイズ・潜在バッファは同じシードで初期状態に戻す
+        stream.reset_state()
+        outputs = [to_uint8(stream.infer(tensor)) for tensor in tensors]
+        if references is None:
+            # 最初のモードを fp32 の基準にする
+            references = outputs
+            if mode != "fp32":
+                print(f"⚠️ 基準が fp32 ではなく {mode} です")
+        durations = time_calls(lambda i: stream.infer(tensors[i % len(tensors)]), args.frames)
+        metrics = compare_images(references, outputs)
+        rows.append({
+            "mode": mode,
+            "fps": 1.0 / durations.mean(),
+            "p50_ms": float(np.percentile(durations, 50) * 1000),
+            "p95_ms": float(np.percentile(durations, 95) * 1000),
+            "psnr_db": metrics["psnr_db"],
+            "ssim": f"{metrics['ssim']:.4f}",
+            "lpips": "-" if metrics["lpips"] is None else f"{metrics['lpips']:.4f}",
+        })
+        print(f"{mode}: {rows[-1]['fps']:.2f} fps")
+        del stream, tensors
+        gc.collect()
+
+    baseline = rows[0]["fps"]
+    for row in rows:
+        row["speedup"] = f"x{row['fps'] / baseline:.2f}"
+    print(format_table(rows, ["mode", "fps", "speedup", "p50_ms", "p95_ms", "psnr_db", "ssim", "lpips"]))
+    print("※ int8 のモードは UNet のみ（VAE は float のまま）。int8_dynamic は Linear のみ、"
+          "Conv2d は int8_static で int8 にする")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StreamDiffusion パイプラインのベンチマーク")
+    parser.add_argument("--recording", help="入力に使う録画ファイル（app/frame_recorder.py）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="frame_buffer_size（バッチ推論）ごとのスループット")
+    batch.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4])
+    batch.add_argument("--frames", type=int, default=32, help="計測するフレーム数")
+    batch.set_defaults(run=bench_batch)
+
+    preprocess = commands.add_parser("preprocess", help="カメラフレームの前処理（PIL と preprocess_array）")
+    preprocess.add_argument("--frames", type=int, default=64, help="計測するフレーム数")
+    preprocess.add_argument("--camera-size", type=int, nargs=2, default=[640, 480], metavar=("WIDTH", "HEIGHT"))
+    preprocess.set_defaults(run=bench_preprocess)
+
+    blend = commands.add_parser("blend", help="フレームブレンド（履歴リストと FrameBlender の各モード）")
+    blend.add_argument("--histories", type=int, nargs="+", default=[2, 4, 8], help="履歴数（max_frame_history）")
+    blend.add_argument("--frames", type=int, default=64, help="計測するフレーム数")
+    blend.set_defaults(run=bench_blend)
+
+    display = commands.add_parser("display", help="表示サイズへの拡大方法（display_scaler）ごとの処理時間")
+    display.add_argument("--frames", type=int, default=64, help="計測するフレーム数")
+    display.set_defaults(run=bench_display)
+
+    precision = commands.add_parser("precision", help="CPU の精度モード（cpu_precision）ごとのスループットと fp32 との差")
+    precision.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8_dynamic", "int8_static"],
+                           choices=["fp32", "bf16", "int8_dynamic", "int8_static"])
+    precision.add_argument("--frames", type=int, default=16, help="計測・比較するフレーム数")
+    precision.add_argument("--calibration-frames", type=int, default=16, help="int8_static の量子化に使うフレーム数")
+    precision.set_defaults(run=bench_precision)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
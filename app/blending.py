@@ -0,0 +1,152 @@
+"""
+生成フレームの時間方向のブレンド
+
+web_camera.py は出力をそれまでの出力（フレーム履歴）とブレンドしてちらつきを抑える。
+従来は履歴を PIL 画像のリストで持ち、毎フレームすべてを float32 に変換して平均していたが、
+FrameBlender は履歴を確保済みの uint8 リング (max_frame_history, H, W, 3) に持ち、
+履歴の合計を float のアキュムレータで差分更新する。1フレームの処理量は履歴の長さによらない。
+
+モード（creativity.frame_blend_mode）:
+    "box"    直近の履歴の単純平均を (1 - alpha)、現在フレームを alpha で混ぜる（従来の動作）
+    "decay"  直近の履歴を新しいものほど重く（1 つ古くなるごとに decay 倍）平均して混ぜる
+    "ema"    出力の指数移動平均（alpha で現在フレームを混ぜ、履歴の長さの上限なし）
+    "none"   ブレンドしない（履歴には残す）
+
+従来と同じく、履歴に入るのはブレンド後の出力で、ブレンドに使う履歴は
+リングから最も古い1枚を除いた max_frame_history - 1 枚。
+"""
+from typing import Optional
+
+import numpy as np
+
+from config import config
+
+from .display import ImageLike, to_uint8_rgb
+
+BLEND_MODES = ("none", "box", "decay", "ema")
+FRAME_BLEND_MODE = config.frame_blend_mode
+FRAME_BLEND_ALPHA = config.frame_blend_alpha
+FRAME_BLEND_DECAY = config.frame_blend_decay
+MAX_FRAME_HISTORY = config.max_frame_history
+# decay モードのアキュムレータを履歴から計算し直す間隔（フレーム数。浮動小数点の誤差の蓄積を防ぐ）
+DECAY_RESYNC_INTERVAL = 256
+
+
+class FrameBlender:
+    """履歴を uint8 のリングに持ち、O(1) で更新する時間方向のブレンダー（スレッドセーフではない）"""
+
+    def __init__(self, mode: str = FRAME_BLEND_MODE, alpha: float = FRAME_BLEND_ALPHA,
+                 max_history: int = MAX_FRAME_HISTORY, decay: float = FRAME_BLEND_DECAY):
+        if mode not in BLEND_MODES:
+            raise ValueError(f"mode must be one of {BLEND_MODES}, got {mode}")
+        if max_history < 1:
+            raise ValueError(f"max_history must be at least 1, got {max_history}")
+        self.mode = mode
+        self.alpha = alpha
+        self.max_history = max_history
+        self.decay = decay
+        self._ring: Optional[np.ndarray] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """履歴を空にする（次の push() で解像度に合わせて確保し直す）"""
+        self._ring = None
+        self._accumulator = None
+        self._weight = 0.0
+        self._blended = None
+        self._scaled = None
+        self._next = 0
+        self._count = 0
+        self._pushes = 0
+
+    def _allocate(self, shape) -> None:
+        self._ring = np.zeros((self.max_history, *shape), dtype=np.uint8)
+        self._accumulator = np.zeros(shape, dtype=np.float32)
+        self._blended = np.empty(shape, dtype=np.float32)
+        self._scaled = np.empty(shape, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def latest(self) -> Optional[np.ndarray]:
+        """最後に push() した出力（HWC の RGB uint8。なければ None）"""
+        if self._count == 0:
+            return None
+        return self._ring[(self._next - 1) % self.max_history]
+
+    def _evict(self) -> None:
+        """次に書き込むスロット（最も古い履歴）をアキュムレータから除く"""
+        if self._count < self.max_history:
+            return
+        oldest = self._ring[self._next]
+        if self.mode == "box":
+            np.subtract(self._accumulator, oldest, out=self._accumulator)
+        elif self.mode == "decay":
+            weight = self.decay ** (self.max_history - 1)
+            np.multiply(oldest, np.float32(weight), out=self._scaled)
+            np.subtract(self._accumulator, self._scaled, out=self._accumulator)
+            self._weight -= weight
+        self._count -= 1
+
+    def _admit(self, frame: np.ndarray) -> None:
+        """ブレンド後のフレームをアキュムレータに加える"""
+        if self.mode == "box":
+            np.add(self._accumulator, frame, out=self._accumulator)
+        elif self.mode == "decay":
+            np.multiply(self._accumulator, np.float32(self.decay), out=self._accumulator)
+            np.add(self._accumulator, frame, out=self._accumulator)
+            self._weight = self._weight * self.decay + 1.0
+
+    def _resync(self) -> None:
+        """decay モードのアキュムレータをリングの内容から計算し直す"""
+        self._accumulator.fill(0.0)
+        self._weight = 0.0
+        for age in range(self._count):
+            weight = self.decay ** age
+            np.multiply(self._ring[(self._next - 1 - age) % self.max_history], np.float32(weight), out=self._scaled)
+            np.add(self._accumulator, self._scaled, out=self._accumulator)
+            self._weight += weight
+
+    def push(self, image: ImageLike) -> np.ndarray:
+        """現在フレームを履歴とブレンドして履歴に加え、ブレンド後のフレームを返す
+
+        image は CHW の torch.Tensor、HWC の ndarray（[0,1] の float または uint8）、PIL のいずれか。
+        返す配列はリングのスロットそのもの（HWC の RGB uint8）で、max_history 回後の push() で上書きされる。
+        """
+        current = to_uint8_rgb(image)
+        if self._ring is None or self._ring.shape[1:] != current.shape:
+            self.reset()
+            self._allocate(current.shape)
+
+        self._evict()
+        slot = self._ring[self._next]
+        # EMA は過去の出力すべてを状態に持つので、履歴が空になるのは最初のフレームだけ
+        empty = self._pushes == 0 if self.mode == "ema" else self._count == 0
+        if self.mode == "none" or empty:
+            np.copyto(slot, current)
+            if self.mode == "ema":
+                np.copyto(self._accumulator, current, casting="unsafe")
+        else:
+            if self.mode == "box":
+                history_scale = (1.0 - self.alpha) / self._count
+            elif self.mode == "decay":
+                history_scale = (1.0 - self.alpha) / self._weight
+            else:
+                history_scale = 1.0 - self.alpha
+            # 履歴側 + 現在フレーム側を float で計算し、丸めて uint8 のスロットへ書く
+            np.multiply(self._accumulator, np.float32(history_scale), out=self._blended)
+            np.multiply(current, np.float32(self.alpha), out=self._scaled)
+            np.add(self._blended, self._scaled, out=self._blended)
+            if self.mode == "ema":
+                # EMA の状態は量子化せずに持つ
+                np.copyto(self._accumulator, self._blended)
+            np.rint(self._blended, out=self._blended)
+            np.copyto(slot, self._blended, casting="unsafe")
+
+        self._admit(slot)
+        self._next = (self._next + 1) % self.max_history
+        self._count += 1
+        self._pushes += 1
+        if self.mode == "decay" and self._pushes % DECAY_RESYNC_INTERVAL == 0:
+            self._resync()
+        return slot
@@ -0,0 +1,110 @@
+"""
+入力フレームの変化検出（変化がなければ推論を省く）
+
+月・曼荼羅のビジュアライザや固定カメラでは、連続する入力フレームがほとんど同じことが多い。
+StreamDiffusion の similar_image_filter は VAE エンコードの後で判定するため、
+エンコードの分は毎回かかる。ChangeGate は前処理の前に、間引いた輝度の
+平均絶対差（0〜255）を最後に推論したフレームと比べ、しきい値未満なら推論を省く。
+
+- 比較相手は最後に推論したフレーム（直前のフレームではない）なので、
+  ゆっくりした変化も積み重なればいずれ推論される
+- max_skip 回続けて省いたら、変化がなくても1回推論する（ノイズによる出力の揺らぎを保つ）
+"""
+import threading
+from typing import Optional
+
+import numpy as np
+
+from config import config
+
+# 平均絶対差のしきい値（0 で無効）と、続けて省く最大フレーム数
+CHANGE_THRESHOLD = config.change_threshold
+CHANGE_MAX_SKIP = config.change_max_skip
+# 輝度を比べる格子の一辺（これ以下になるよう等間隔に間引く）
+CHANGE_GRID_SIZE = 64
+# ITU-R BT.601 の輝度の重み（R, G, B）
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def downsampled_luma(frame: np.ndarray, channels: str = "bgr", grid_size: int = CHANGE_GRID_SIZE) -> np.ndarray:
+    """HWC のフレームを等間隔に間引いた輝度（0〜255 の float32、一辺 grid_size 以下）"""
+    step_y = max(1, -(-frame.shape[0] // grid_size))
+    step_x = max(1, -(-frame.shape[1] // grid_size))
+    small = frame[::step_y, ::step_x, :3]
+    weights = LUMA_WEIGHTS if channels == "rgb" else LUMA_WEIGHTS[::-1]
+    luma = small.astype(np.float32) @ weights
+    if frame.dtype != np.uint8:
+        # FrameLayout の float32 は [0,1]
+        luma *= np.float32(255.0)
+    return luma
+
+
+class ChangeGate:
+    """入力の変化が小さいフレームの推論を省くかを判定する（スレッドセーフ）"""
+
+    def __init__(self, threshold: float = CHANGE_THRESHOLD, max_skip: int = CHANGE_MAX_SKIP,
+                 grid_size: int = CHANGE_GRID_SIZE):
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.grid_size = grid_size
+        self._reference: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.consecutive_skips = 0
+        self.last_difference = 0.0
+        self.checked = 0
+        self.skipped = 0
+        self.forced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def difference(self, luma: np.ndarray) -> float:
+        """最後に推論したフレームとの輝度の平均絶対差（比較相手がなければ inf）"""
+        reference = self._reference
+        if reference is None or reference.shape != luma.shape:
+            return float("inf")
+        return float(np.abs(luma - reference).mean())
+
+    def should_process(self, frame: np.ndarray, channels: str = "bgr") -> bool:
+        """frame を推論すべきか（False なら前回の出力を使い回してよい）"""
+        if not self.enabled:
+            return True
+        luma = downsampled_luma(frame, channels, self.grid_size)
+        with self._lock:
+            self.checked += 1
+            difference = self.difference(luma)
+            self.last_difference = difference
+            if difference < self.threshold:
+                if self.consecutive_skips < self.max_skip:
+                    self.consecutive_skips += 1
+                    self.skipped += 1
+                    return False
+                self.forced += 1
+            self._reference = luma
+            self.consecutive_skips = 0
+            return True
+
+    def reset(self) -> None:
+        """比較相手を忘れる（次のフレームは必ず推論する）"""
+        with self._lock:
+            self._reference = None
+            self.consecutive_skips = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "skipped": self.skipped,
+                "forced": self.forced,
+                "skip_rate": self.skipped / self.checked if self.checked else 0.0,
+                "last_difference": self.last_difference,
+            }
+
+    def format_stats(self) -> str:
+        if not self.enabled:
+            return "変化検出: 無効（change_threshold = 0）"
+        stats = self.stats()
+        return (f"変化検出: {stats['checked']}フレーム中 {stats['skipped']} を省略 "
+                f"({stats['skip_rate'] * 100:.0f}%), 上限で推論 {stats['forced']}, "
+                f"直近の差 {stats['last_difference']:.2f} / しきい値 {self.threshold}")
@@ -0,0 +1,210 @@
+"""
+CPU での低精度・int8 推論
+
+CPU では float32 固定だった（half は CPU で未対応）。streamdiffusion.cpu_precision で選ぶ:
+    "fp32"          従来どおり
+    "bf16"          UNet・VAE を torch.autocast（bfloat16）で実行する。重みは float32 のまま
+    "int8_dynamic"  UNet の Linear の重みを int8 にし、活性化は呼び出しごとに量子化する
+                    （Conv2d の dynamic 量子化は torch の実装の誤差が大きいため対象外）
+    "int8_static"   UNet の Linear・Conv2d を int8 にする。活性化の量子化パラメータは
+                    録画フレームでの推論（calibrate）で求めて固定する
+CPU 以外のデバイスでは "fp32" として扱う（MPS / CUDA は dtype で精度を選ぶ）。
+
+int8 は UNet の入出力の畳み込み（conv_in / conv_out）と時刻埋め込みを float のまま残す。
+VAE は int8 の対象外（bf16 の autocast のみ）。
+diffusers の LoRACompatibleLinear / LoRACompatibleConv は forward に LoRA の scale を取るので、
+Int8Layer で包んで通常の Linear / Conv2d に置き換え、余分な引数は捨てる（LoRA は融合済み）。
+
+どのモードを使うかは python -m app.benchmark precision で fp32 との差（PSNR / SSIM、
+lpips パッケージがあれば LPIPS）とスループットを比べて決める。
+"""
+from contextlib import nullcontext
+from typing import Iterable, Optional
+
+import cv2
+import numpy as np
+import torch
+from torch import nn
+
+from config import config
+
+PRECISION_MODES = ("fp32", "bf16", "int8_dynamic", "int8_static")
+CPU_PRECISION = config.cpu_precision
+# int8 にしない UNet の層（名前の先頭）。入出力の畳み込みは精度への影響が大きく、時刻埋め込みは小さい
+FLOAT_LAYER_PREFIXES = ("conv_in", "conv_out", "time_embedding", "time_proj")
+# SSIM のガウス窓（Wang et al. 2004 と同じ 11x11, σ=1.5）と定数
+SSIM_SIGMA = 1.5
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def resolve_mode(mode: str, device: torch.device) -> str:
+    """device で使えるモード（CPU 以外は "fp32"）"""
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"cpu_precision must be one of {PRECISION_MODES}, got {mode}")
+    if mode != "fp32" and device.type != "cpu":
+        print(f"⚠️ cpu_precision={mode} は CPU でのみ有効です（{device.type} では fp32）")
+        return "fp32"
+    return mode
+
+
+def autocast_context(mode: str):
+    """推論を包むコンテキスト（bf16 では autocast、それ以外は何もしない）"""
+    if mode == "bf16":
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def _plain(layer: nn.Module) -> nn.Module:
+    """nn.Linear / nn.Conv2d のサブクラスを、重みを共有する素の nn.Linear / nn.Conv2d にする
+
+    量子化のモジュール対応表は型の完全一致で引くため、サブクラスのままでは置き換わらない。
+    """
+    if type(layer) in (nn.Linear, nn.Conv2d):
+        return layer
+    bias = layer.bias is not None
+    if isinstance(layer, nn.Linear):
+        plain = nn.Linear(layer.in_features, layer.out_features, bias=bias, device="meta")
+    else:
+        plain = nn.Conv2d(layer.in_channels, layer.out_channels, layer.kernel_size, layer.stride, layer.padding,
+                          layer.dilation, layer.groups, bias, layer.padding_mode, device="meta")
+    plain.weight = layer.weight
+    plain.bias = layer.bias
+    return plain
+
+
+class Int8Layer(nn.Module):
+    """int8 にする Linear / Conv2d（static では前後に量子化・逆量子化を挟む）"""
+
+    def __init__(self, layer: nn.Module, static: bool):
+        super().__init__()
+        self.layer = _plain(layer)
+        self.quant = torch.ao.quantization.QuantStub() if static else nn.Identity()
+        self.dequant = torch.ao.quantization.DeQuantStub() if static else nn.Identity()
+
+    def forward(self, x, *args, **kwargs):
+        return self.dequant(self.layer(self.quant(x)))
+
+
+def _eligible(name: str, module: nn.Module, layer_types: tuple) -> bool:
+    if not isinstance(module, layer_types) or name.startswith(FLOAT_LAYER_PREFIXES):
+        return False
+    # 融合していない LoRA が残っている層はそのまま
+    return getattr(module, "lora_layer", None) is None
+
+
+def wrap_layers(model: nn.Module, static: bool, layer_types: tuple = (nn.Linear, nn.Conv2d)) -> int:
+    """対象の層を Int8Layer で包み、包んだ数を返す"""
+    targets = [(name, module) for name, module in model.named_modules() if _eligible(name, module, layer_types)]
+    for name, module in targets:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        setattr(parent, child_name, Int8Layer(module, static))
+    return len(targets)
+
+
+def quantize_dynamic_int8(model: nn.Module) -> int:
+    """Linear の重みを int8 にする（活性化は呼び出しごとに量子化）"""
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+    count = wrap_layers(model, static=False, layer_types=(nn.Linear,))
+    # 型で指定すると FLOAT_LAYER_PREFIXES の Linear も量子化されるので、包んだ層の名前で指定する
+    qconfig_spec = {
+        f"{name}.layer": default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, Int8Layer)
+    }
+    quantize_dynamic(model, qconfig_spec, inplace=True)
+    return count
+
+
+def prepare_static_int8(model: nn.Module) -> int:
+    """活性化の範囲を記録するオブザーバを入れる（calibrate 後に convert_static_int8 で int8 にする）"""
+    from torch.ao.quantization import get_default_qconfig, prepare
+
+    count = wrap_layers(model, static=True)
+    qconfig = get_default_qconfig(torch.backends.quantized.engine)
+    for module in model.modules():
+        if isinstance(module, Int8Layer):
+            module.qconfig = qconfig
+    prepare(model, inplace=True)
+    return count
+
+
+def convert_static_int8(model: nn.Module) -> None:
+    """記録した活性化の範囲で Linear / Conv2d を int8 にする"""
+    from torch.ao.quantization import convert
+
+    convert(model, inplace=True)
+
+
+def apply_precision(unet: nn.Module, mode: str) -> None:
+    """UNet をモードに合わせて書き換える（int8_static は calibrate が終わるまで float のまま記録する）"""
+    if mode == "int8_dynamic":
+        count = quantize_dynamic_int8(unet)
+        print(f"🔢 UNet の {count} 層を int8（dynamic）にしました")
+    elif mode == "int8_static":
+        count = prepare_static_int8(unet)
+        print(f"🔢 UNet の {count} 層を int8（static）にします（calibrate で確定）")
+
+
+def mean_squared_error(reference: np.ndarray, image: np.ndarray) -> float:
+    return float(np.mean((reference.astype(np.float32) - image.astype(np.float32)) ** 2))
+
+
+def psnr(mse: float) -> float:
+    """uint8 画像の平均二乗誤差からの PSNR（dB。同一なら inf）"""
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(reference: np.ndarray, image: np.ndarray) -> float:
+    """RGB uint8 画像の輝度の SSIM（1 で同一）"""
+    a = cv2.cvtColor(reference, cv2.COLOR_RGB2GRAY).astype(np.float32)
+    b = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), SSIM_SIGMA)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    covariance = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + SSIM_C1) * (2 * covariance + SSIM_C2)) / (
+        (mu_a ** 2 + mu_b ** 2 + SSIM_C1) * (var_a + var_b + SSIM_C2)
+    )
+    return float(ssim_map.mean())
+
+
+_lpips_model = None
+
+
+def lpips_distance(reference: np.ndarray, image: np.ndarray) -> Optional[float]:
+    """LPIPS（AlexNet）の距離（0 で同一）。lpips パッケージがなければ None"""
+    global _lpips_model
+    try:
+        import lpips
+    except ImportError:
+        return None
+    if _lpips_model is None:
+        _lpips_model = lpips.LPIPS(net="alex", verbose=False).eval()
+
+    def to_tensor(x):
+        return torch.from_numpy(x).permute(2, 0, 1)[None].float() / 127.5 - 1.0
+
+    with torch.no_grad():
+        return float(_lpips_model(to_tensor(reference), to_tensor(image)).item())
+
+
+def compare_images(references: Iterable[np.ndarray], images: Iterable[np.ndarray]) -> dict:
+    """fp32 の出力との差（psnr_db は全フレームの平均二乗誤差から、ssim / lpips はフレームごとの平均。
+    lpips は計算できなければ None）"""
+    errors, ssims, lpipses = [], [], []
+    for reference, image in zip(references, images):
+        errors.append(mean_squared_error(reference, image))
+        ssims.append(ssim(reference, image))
+        lpipses.append(lpips_distance(reference, image))
+    return {
+        "psnr_db": psnr(float(np.mean(errors))),
+        "ssim": float(np.mean(ssims)),
+        "lpips": None if None in lpipses else float(np.mean(lpipses)),
+    }
@@ -0,0 +1,188 @@
+"""
+生成画像の表示
+
+StreamDiffusion の出力（output_type "pt" / "np" の [0,1] の float、uint8 配列、PIL）を
+表示ウィンドウ用の BGR uint8 配列にする。従来は推論と同じ流れの中で PIL 画像を
+2048x2048 に LANCZOS で拡大し、np.array() と cvtColor でコピーしていたが、
+
+- uint8 化と RGB→BGR の並べ替えは拡大前の小さい画像（SD の解像度）で行い
+  （DisplayConverter.to_bgr()）、
+- 拡大は表示ステージのスレッドで、選んだ方法（display.display_scaler）の cv2.resize が
+  使い回しの表示バッファへ直接書き込む（DisplayConverter.scale()）。"window" では拡大せず
+  ウィンドウ側に任せる。
+- ウィンドウの更新（DisplayWindow.refresh()）はメインスレッドが自分のペース
+  （display.display_fps）で行い、その時点の最新のフレームだけを表示する。
+
+PIL はギャラリー保存（to_pil()）でのみ使う。
+"""
+import itertools
+import time
+from typing import Optional, Union
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from config import config
+
+from .latest_queue import LatestQueue
+
+# 表示サイズへの拡大方法（display.display_scaler）。"window" は CPU で拡大せず、
+# cv2.WINDOW_NORMAL のウィンドウに SD の解像度のまま渡して表示側で拡大させる
+# （cv2 の LANCZOS4 は 512→2048 の拡大に LINEAR の10倍以上かかる）
+DISPLAY_SCALERS = {
+    "linear": cv2.INTER_LINEAR,
+    "area": cv2.INTER_AREA,
+    "cubic": cv2.INTER_CUBIC,
+    "lanczos": cv2.INTER_LANCZOS4,
+    "window": None,
+}
+DISPLAY_SCALER = config.display_scaler
+# 表示ウィンドウを更新する最大のフレームレート（推論より速く届いた出力は最新だけを表示する）
+DISPLAY_FPS = config.display_fps
+
+ImageLike = Union[torch.Tensor, np.ndarray, Image.Image]
+
+
+def to_uint8_rgb(image: ImageLike) -> np.ndarray:
+    """出力画像を HWC の RGB uint8 配列にする
+
+    float の値は numpy_to_pil と同じく (x * 255).round() で uint8 にする。
+    torch.Tensor は CHW、ndarray は HWC とみなす。
+    """
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("RGB"))
+    if isinstance(image, torch.Tensor):
+        if image.dtype != torch.uint8:
+            image = image.float().mul(255.0).round_().clamp_(0, 255).to(torch.uint8)
+        return image.permute(1, 2, 0).numpy()
+    if image.dtype != np.uint8:
+        image = np.clip(np.round(image * np.float32(255.0)), 0, 255).astype(np.uint8)
+    return image
+
+
+def to_pil(image: ImageLike) -> Image.Image:
+    """ギャラリー保存用の PIL 画像"""
+    if isinstance(image, Image.Image):
+        return image
+    return Image.fromarray(np.ascontiguousarray(to_uint8_rgb(image)))
+
+
+class DisplayConverter:
+    """出力画像を表示用の BGR uint8 配列に変換する（出力は使い回すバッファ）
+
+    to_bgr() は SD の解像度のまま BGR にし、scale() は表示サイズに拡大する。
+    スレッドをまたいで渡すため、どちらも buffers 個のバッファを順に使い、
+    返す配列は buffers 回後の呼び出しで上書きされる。表示待ちのキューに
+    同時に残りうる枚数（バッチ推論では frame_buffer_size）より多くしておくこと。
+    """
+
+    def __init__(self, width: int, height: int, buffers: int = 3, scaler: str = DISPLAY_SCALER):
+        if scaler not in DISPLAY_SCALERS:
+            raise ValueError(f"scaler must be one of {tuple(DISPLAY_SCALERS)}, got {scaler}")
+        self.width = width
+        self.height = height
+        self.scaler = scaler
+        self.buffers = buffers
+        self._display = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(buffers)]
+        self._display_slots = itertools.cycle(range(buffers))
+        # 拡大前の作業領域（入力の解像度ごとに float の CHW と、BGR uint8 の HWC のリング）
+        self._scaled = {}
+        self._sources = {}
+        self._source_slots = itertools.cycle(range(buffers))
+
+    def _source_buffer(self, height: int, width: int) -> np.ndarray:
+        sources = self._sources.get((height, width))
+        if sources is None:
+            sources = self._sources[(height, width)] = [
+                np.empty((height, width, 3), dtype=np.uint8) for _ in range(self.buffers)
+            ]
+        return sources[next(self._source_slots)]
+
+    def to_bgr(self, image: ImageLike) -> np.ndarray:
+        """入力の解像度のまま BGR uint8 の HWC 配列にする"""
+        if isinstance(image, torch.Tensor) and image.dtype != torch.uint8:
+            # 丸めと uint8 化は小さい画像のまま行い、BGR の HWC へは cv2.merge で1回に並べる
+            height, width = image.shape[-2:]
+            scaled = self._scaled.get((height, width))
+            if scaled is None:
+                scaled = self._scaled[(height, width)] = torch.empty((3, height, width), dtype=torch.float32)
+            torch.mul(image, 255.0, out=scaled).round_().clamp_(0, 255)
+            channels = scaled.to(torch.uint8).numpy()
+            return cv2.merge((channels[2], channels[1], channels[0]), dst=self._source_buffer(height, width))
+        rgb = np.ascontiguousarray(to_uint8_rgb(image))
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=self._source_buffer(*rgb.shape[:2]))
+
+    def scale(self, bgr: np.ndarray) -> np.ndarray:
+        """to_bgr() の結果を表示サイズにする（"window" ではそのまま返す）"""
+        interpolation = DISPLAY_SCALERS[self.scaler]
+        if interpolation is None:
+            return bgr
+        buffer = self._display[next(self._display_slots)]
+        if bgr.shape[:2] == (self.height, self.width):
+            np.copyto(buffer, bgr)
+        else:
+            cv2.resize(bgr, (self.width, self.height), dst=buffer, interpolation=interpolation)
+        return buffer
+
+    def __call__(self, image: ImageLike) -> np.ndarray:
+        return self.scale(self.to_bgr(image))
+
+
+class DisplayWindow:
+    """cv2 の表示ウィンドウ（推論とは別のペースで、届いた最新のフレームだけを表示する）
+
+    submit() はどのスレッドからでも呼べるが、refresh() はメインスレッドから呼ぶこと
+    （macOS の cv2 HighGUI はメインスレッド以外からウィンドウを扱えない）。
+    表示が間に合わずに次のフレームで置き換えられた数は skipped で確認できる。
+    """
+
+    def __init__(self, name: str, width: int, height: int, fps: float = DISPLAY_FPS):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.shown = 0
+        self._frames = LatestQueue(1)
+        self._next_show = 0.0
+        self._created = False
+
+    @property
+    def skipped(self) -> int:
+        return self._frames.dropped
+
+    def submit(self, frame: np.ndarray, provenance=None) -> None:
+        """次に表示するフレーム（前に渡したものがまだ表示されていなければ置き換える）"""
+        self._frames.put((frame, provenance))
+
+    def refresh(self, timeout: float) -> Optional[tuple]:
+        """表示のタイミングになっていて新しいフレームがあれば表示する
+
+        最大 timeout 秒待ち、表示した場合は (frame, provenance)、しなかった場合は None を返す。
+        """
+        wait = self._next_show - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if wait >= timeout:
+                return None
+            timeout -= wait
+        item = self._frames.get(timeout=timeout)
+        if item is None:
+            return None
+
+        if not self._created:
+            # WINDOW_NORMAL なので、表示サイズより小さいフレームはウィンドウ側で拡大される
+            cv2.namedWindow(self.name, cv2.WINDOW_NORMAL)
+            cv2.resizeWindow(self.name, self.width, self.height)
+            self._created = True
+        cv2.imshow(self.name, item[0])
+        self._next_show = time.monotonic() + self.interval
+        self.shown += 1
+        return item
+
+    def close(self) -> None:
+        self._frames.close()
+        if self._created:
+            cv2.destroyWindow(self.name)
+            self._created = False
@@ -0,0 +1,170 @@
+"""
+フレーム転送用のイベントループ
+
+selectors で全ソケットを1つのスレッドで監視し、タイマー（ハートビート・再接続・
+共有メモリの確認）も同じスレッドで実行する。接続ごとにスレッドを立てないため、
+接続数が増えてもスレッドは増えず、待機中は select でブロックして CPU を使わない。
+
+ソケットの登録・タイマーはループのスレッドから行う。他のスレッドからは
+call_soon / run_sync でループのスレッドに処理を渡す。
+"""
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+EVENT_READ = selectors.EVENT_READ
+EVENT_WRITE = selectors.EVENT_WRITE
+
+
+class Timer:
+    """call_later の戻り値（cancel() で取り消せる）"""
+
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class EventLoop:
+    """ソケットの読み書き可能イベントとタイマーを1スレッドで処理する"""
+
+    def __init__(self, name: str = "frame-transport"):
+        self.name = name
+        self._selector = selectors.DefaultSelector()
+        # 他のスレッドからの call_soon で select を起こすためのソケット対
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, EVENT_READ, self._drain_wakeup)
+        self._ready = deque()
+        self._ready_lock = threading.Lock()
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._thread = None
+        self._running = False
+
+    def start(self) -> None:
+        """ループのスレッドを開始（開始済みなら何もしない）"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def in_loop_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def call_soon(self, callback, *args) -> None:
+        """ループのスレッドで callback(*args) を実行する（どのスレッドからでも呼べる）"""
+        with self._ready_lock:
+            self._ready.append((callback, args))
+        if not self.in_loop_thread():
+            try:
+                self._wakeup_writer.send(b"\0")
+            except (BlockingIOError, InterruptedError):
+                pass  # 既に起こす予定のデータが溜まっている
+
+    def run_sync(self, callback, *args, timeout: float = 5.0):
+        """ループのスレッドで callback(*args) を実行し、終わるまで待って結果を返す"""
+        if self.in_loop_thread() or self._thread is None:
+            return callback(*args)
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                result.append(callback(*args))
+            finally:
+                done.set()
+
+        self.call_soon(run)
+        done.wait(timeout)
+        return result[0] if result else None
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        """delay 秒後に callback(*args) を実行する（ループのスレッドから呼ぶこと）"""
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._timer_ids), timer))
+        return timer
+
+    def register(self, sock, events: int, callback) -> None:
+        """sock が events（EVENT_READ / EVENT_WRITE）になったら callback(mask) を呼ぶ"""
+        self._selector.register(sock, events, callback)
+
+    def modify(self, sock, events: int, callback) -> None:
+        self._selector.modify(sock, events, callback)
+
+    def unregister(self, sock) -> None:
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _drain_wakeup(self, mask):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _next_timeout(self):
+        """次のタイマーまでの時間（実行待ちの処理があれば0、何もなければ None）"""
+        if self._ready:
+            return 0
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0][0] - time.monotonic())
+
+    def _run_callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            # 1つの接続の不具合でループ全体を止めない
+            print(f"❌ イベントループのコールバックでエラー ({getattr(callback, '__qualname__', callback)}): {e}")
+
+    def _run(self):
+        while self._running:
+            for key, mask in self._selector.select(self._next_timeout()):
+                self._run_callback(key.data, mask)
+
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    self._run_callback(timer.callback, *timer.args)
+
+            with self._ready_lock:
+                ready, self._ready = self._ready, deque()
+            for callback, args in ready:
+                self._run_callback(callback, *args)
+
+    def stop(self) -> None:
+        """ループを止める"""
+        self._running = False
+        self.call_soon(lambda: None)
+
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> EventLoop:
+    """プロセス内で共有するイベントループ（FrameSender / FrameReceiver が使う）"""
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = EventLoop()
+            _shared_loop.start()
+        return _shared_loop
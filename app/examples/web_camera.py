@@ -1,12 +1,10 @@
 import time
-from typing import Any, Callable
 import socket
 import threading
 import random
 import os
 import json
 from datetime import datetime
-import pickle
 import sys
 sys.path.append('../..')
 
@@ -15,7 +13,15 @@ import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
 
-from ..stream_diffusion import StreamDiffusion
+from ..stream_diffusion import StreamDiffusion, model_key_for
+from ..frame_transport import FrameReceiver
+from ..latency import FrameProvenance, LatencyTracker
+from ..blending import FrameBlender
+from ..change_gate import ChangeGate
+from ..display import DisplayConverter, DisplayWindow, to_pil
+from ..model_registry import ModelRegistry
+from ..pipeline import PacedQueue, Pipeline
+from ..prompt_controller import PromptController
 from config import config
 
 # Load environment variables
@@ -26,34 +32,46 @@ OUTPUT_IMAGE_FILE = "output.png"
 HOST = config.host
 PORT = config.tcp_port
 
-# フレーム受信設定
-FRAME_HOST = config.host
-FRAME_PORT = config.frame_port
-
 # Themes and modifiers from config
 THEMES = config.themes
 CREATIVE_MODIFIERS = config.creative_modifiers
 
-# Image history for smooth transitions
-FRAME_HISTORY = []
-MAX_FRAME_HISTORY = config.max_frame_history
 
 # History of successful prompts
 PROMPT_HISTORY = []
 MAX_HISTORY = 10
 
-# フレームブレンド設定
-FRAME_BLEND_ALPHA = config.frame_blend_alpha
+# プロンプト変更時のネガティブプロンプト
+NEGATIVE_PROMPT = "low quality, bad quality, blurry, low resolution"
+
+# 画素ブレンドを行うか（プロンプト遷移は埋め込みの補間で滑らかにできる）
+PIXEL_BLEND = config.pixel_blend
+# Image history for smooth transitions（creativity.frame_blend_mode などの設定でブレンドする）
+FRAME_BLENDER = FrameBlender() if PIXEL_BLEND else FrameBlender(mode="none", max_history=1)
+
+# 1回の推論でまとめて処理するフレーム数（StreamDiffusion の frame_buffer_size）
+FRAME_BUFFER_SIZE = config.frame_buffer_size
+
+# 実行中に切り替えるモデル（m キー・TCP の "/model <モデルID>"）
+SWITCH_MODELS = config.switch_models
+# TCP で受け取るモデル切り替えのコマンド
+MODEL_COMMAND = "/model"
 
 # Path for saving gallery images
 GALLERY_DIR = config.gallery_dir
 os.makedirs(GALLERY_DIR, exist_ok=True)
 
+# 送信側からの新しいフレームを待つ時間（秒）。待っている間はキー入力を処理できない
+FRAME_WAIT_TIMEOUT = 0.05
+# この時間フレームが届かなければ、要求が失われたとみなして送信側へ次のフレームを要求し直す（秒）
+FRAME_REQUEST_RETRY = 1.0
+# 送信側が止まったときに最後のフレームで生成を続けるか
+REUSE_STALLED_FRAME = config.reuse_stalled_frame
+
 # ウィンドウ表示設定
 WINDOW_NAME = config.get('display.window_name', 'StreamDiffusion')
 DISPLAY_WIDTH = config.display_width
 DISPLAY_HEIGHT = config.display_height
-window_initialized = False
 
 
 def generate_random_prompt():
@@ -133,7 +151,8 @@ def save_to_gallery(image, prompt):
     """Save the generated image to gallery with timestamp"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{GALLERY_DIR}/img_{timestamp}.png"
-    image.save(filename)
+    # 履歴はテンソル/配列のまま持っているので、保存するときだけ PIL にする
+    to_pil(image).save(filename)
     
     # Save prompt metadata
     with open(f"{GALLERY_DIR}/img_{timestamp}.json", "w") as f:
@@ -141,7 +160,7 @@ def save_to_gallery(image, prompt):
     
     return filename
 
-def run_server(stream, enhance_fn):
+def run_server(prompt_controller, enhance_fn, switch_model):
     """Run TCP server to receive prompts and process them with LLM"""
     global PROMPT_HISTORY, current_prompt, waiting_for_new_image
     
@@ -163,7 +182,11 @@ def run_server(stream, enhance_fn):
                     user_prompt = data.decode("utf-8").strip()
                     print(f"Received user prompt: {user_prompt}")
                     
-                    if user_prompt:
+                    if user_prompt.startswith(MODEL_COMMAND):
+                        # モデルの切り替え（プロンプトとしては扱わない）
+                        model_id = user_prompt[len(MODEL_COMMAND):].strip()
+                        conn.sendall(switch_model(model_id).encode("utf-8"))
+                    elif user_prompt:
                         # Enhance prompt with LLM
                         enhanced_prompt = enhance_fn(user_prompt)
                         print(f"Enhanced prompt: {enhanced_prompt}")
@@ -178,18 +201,12 @@ def run_server(stream, enhance_fn):
                         waiting_for_new_image = True
                         
                         # Update stream with the enhanced prompt
-                        stream.prepare(
-                            prompt=enhanced_prompt,
-                            negative_prompt="low quality, bad quality, blurry, low resolution",
-                            num_inference_steps=config.num_inference_steps,
-                            guidance_scale=config.guidance_scale,
-                            delta=config.delta,
-                        )
+                        prompt_controller.submit(enhanced_prompt)
                         
                         # Send acknowledgment back to client
                         conn.sendall(f"Processing prompt: {enhanced_prompt}".encode("utf-8"))
 
-def run_controls(stream, enhance_fn):
+def run_controls(prompt_controller, enhance_fn):
     """Thread to handle keyboard controls"""
     global PROMPT_HISTORY, current_prompt, waiting_for_new_image, LAST_OUTPUT_IMAGE
     
@@ -222,18 +239,13 @@ def run_controls(stream, enhance_fn):
         PROMPT_HISTORY.append(new_prompt)
         
         # Update stream with new prompt
-        stream.prepare(
-            prompt=new_prompt,
-            negative_prompt="low quality, bad quality, blurry, low resolution",
-            num_inference_steps=config.num_inference_steps,
-            guidance_scale=config.guidance_scale,
-            delta=config.delta,
-        )
+        prompt_controller.submit(new_prompt)
     
     def on_key_s():
         """Save current image to gallery"""
-        if FRAME_HISTORY:
-            filename = save_to_gallery(FRAME_HISTORY[-1], current_prompt)
+        latest_image = FRAME_BLENDER.latest()
+        if latest_image is not None:
+            filename = save_to_gallery(latest_image.copy(), current_prompt)
             print(f"Saved current image to {filename}")
     
     def on_key_p():
@@ -251,138 +263,16 @@ def run_controls(stream, enhance_fn):
     # Keep thread alive
     keyboard.wait("q")
 
-def timeit(func: Callable[..., Any]):
-    def wrapper(*args, **kwargs) -> tuple[Image.Image, str]:
-        start = time.time()
-        result = func(*args, **kwargs)
-        elapsed_time = time.time() - start
-        return result, f"{1 / elapsed_time}"
-
-    return wrapper
-
-
-def crop_center(pil_img: Image.Image, crop_width: int, crop_height: int):
-    img_width, img_height = pil_img.size
-    return pil_img.crop(
-        (
-            (img_width - crop_width) // 2,
-            (img_height - crop_height) // 2,
-            (img_width + crop_width) // 2,
-            (img_height + crop_height) // 2,
-        )
+def is_sd_ready(frame_layout):
+    """受信フレームが送信側で SD 入力の形（SD_SIDE_LENGTH 四方の RGB）に変換済みか"""
+    return (
+        frame_layout is not None
+        and frame_layout.size == SD_SIDE_LENGTH
+        and frame_layout.crop_size == SD_SIDE_LENGTH * 2
+        and frame_layout.channels == "rgb"
     )
 
 
-# フレーム受信クラス（再接続対応）
-class FrameReceiver:
-    def __init__(self, host=FRAME_HOST, port=FRAME_PORT):
-        self.host = host
-        self.port = port
-        self.socket = None
-        self.latest_frame = None
-        self.running = False
-        self.connected = False
-        
-    def connect_to_sender(self):
-        """フレーム送信元に接続（初回のみ）"""
-        return self._try_connect()
-    
-    def _try_connect(self):
-        """接続を試行"""
-        try:
-            if self.socket:
-                try:
-                    self.socket.close()
-                except:
-                    pass
-            
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
-            self.connected = True
-            print(f"✨ main_moon.pyに接続成功: {self.host}:{self.port}")
-            return True
-        except Exception as e:
-            print(f"❌ main_moon.pyへの接続失敗: {e}")
-            self.connected = False
-            return False
-    
-    def start_receiving(self):
-        """フレーム受信開始"""
-        self.running = True
-        self.receive_thread = threading.Thread(target=self._receive_loop_with_reconnect, daemon=True)
-        self.receive_thread.start()
-        return True
-    
-    def _receive_loop_with_reconnect(self):
-        """フレーム受信ループ（再接続対応）"""
-        while self.running:
-            if not self.connected:
-                print("🔄 main_moon.pyへの再接続を試行中...")
-                if self._try_connect():
-                    print("✨ 再接続成功")
-                else:
-                    time.sleep(3)  # 3秒待ってから再試行
-                    continue
-            
-            try:
-                self._receive_frames()
-            except Exception as e:
-                print(f"❌ フレーム受信エラー: {e}")
-                print("🔌 接続が切断されました。再接続を試行します...")
-                self.connected = False
-                time.sleep(2)
-    
-    def _receive_frames(self):
-        """フレーム受信メインループ"""
-        while self.running and self.connected:
-            try:
-                # サイズを受信（4バイト）
-                size_data = self._recv_all(4)
-                if not size_data:
-                    raise ConnectionError("サイズデータの受信に失敗")
-                
-                # キープアライブチェック
-                if size_data == b'\x00\x00\x00\x00':
-                    continue  # キープアライブなのでスキップ
-                    
-                frame_size = int.from_bytes(size_data, byteorder='big')
-                
-                # フレームデータを受信
-                frame_data = self._recv_all(frame_size)
-                if not frame_data:
-                    raise ConnectionError("フレームデータの受信に失敗")
-                
-                # pickleでデシリアライズ
-                frame_array = pickle.loads(frame_data)
-                self.latest_frame = frame_array
-                
-            except Exception as e:
-                raise e
-    
-    def _recv_all(self, size):
-        """指定サイズのデータを全て受信"""
-        data = b''
-        while len(data) < size:
-            chunk = self.socket.recv(size - len(data))
-            if not chunk:
-                return None
-            data += chunk
-        return data
-    
-    def get_latest_frame(self):
-        """最新フレームを取得"""
-        return self.latest_frame
-    
-    def stop_receiving(self):
-        """受信停止"""
-        self.running = False
-        self.connected = False
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-
 def find_available_cameras():
     """利用可能なカメラデバイスを検出する"""
     available_cameras = []
@@ -440,7 +330,7 @@ def select_camera():
             print("❌ 数字を入力してください")
 
 
-def prompt_input_thread(stream, enhance_fn):
+def prompt_input_thread(prompt_controller, enhance_fn):
     """別スレッドでプロンプト入力を受け付ける"""
     global current_prompt, PROMPT_HISTORY
     
@@ -485,13 +375,7 @@ def prompt_input_thread(stream, enhance_fn):
             PROMPT_HISTORY.append(new_prompt)
             
             # ストリームを更新
-            stream.prepare(
-                prompt=new_prompt,
-                negative_prompt="low quality, bad quality, blurry, low resolution",
-                num_inference_steps=config.num_inference_steps,
-                guidance_scale=config.guidance_scale,
-                delta=config.delta,
-            )
+            prompt_controller.submit(new_prompt)
             
             print(f"🔄 プロンプトを更新しました: {new_prompt}")
             
@@ -505,7 +389,7 @@ def prompt_input_thread(stream, enhance_fn):
 
 
 def main():
-    global FRAME_HISTORY, PROMPT_HISTORY, current_prompt
+    global PROMPT_HISTORY, current_prompt
     
     # 1個前の生成画像を保存する変数
     previous_generated_image = None
@@ -516,8 +400,19 @@ def main():
     PROMPT_HISTORY.append(current_prompt)
     print(f"🌱 初期プロンプト: {current_prompt}")
     
-    # StreamDiffusion初期化
-    stream = StreamDiffusion(prompt=current_prompt).stream
+    # StreamDiffusion初期化（切り替えたモデルは resident_models 個まで常駐させる）
+    stream_diffusion = StreamDiffusion(prompt=current_prompt, frame_buffer_size=FRAME_BUFFER_SIZE)
+    stream = stream_diffusion.stream
+    model_registry = ModelRegistry(
+        lambda key: StreamDiffusion(prompt=current_prompt, frame_buffer_size=FRAME_BUFFER_SIZE, model_key=key)
+    )
+    model_registry.add(stream_diffusion.model_key, stream_diffusion)
+    # 切り替え先のキーに必要な値だけ残し、最初のモデルはレジストリが解放できるよう参照を捨てる
+    use_tiny_vae = stream_diffusion.model_key.tiny_vae
+    model_device = stream_diffusion.device
+    del stream_diffusion
+    # プロンプトの変更はすべてこのラッパーの条件付けの更新で反映する（作り直さない）
+    prompt_controller = PromptController(stream, negative_prompt=NEGATIVE_PROMPT)
     
     # 入力ソース選択
     input_source = select_input_source()
@@ -548,14 +443,212 @@ def main():
             print(f"❌ カメラ {camera_id} を開けませんでした")
             return
     
-    frame_count = 0
+    # 音声取得（カメラ入力ならカメラ取得）から表示までのステージごとのレイテンシ
+    latency_tracker = LatencyTracker()
     creativity_update_interval = config.creativity_update_interval  # configから読み込み
     # save_interval = 100  # 自動保存を無効化
+    # ステージ間で共有する状態（フレーム番号・表示数）
+    # owed_frames は受け取ったがまだ送信側へ要求し直していないフレームの数
+    state = {"last_frame_id": 0, "captured_count": 0, "frame_count": 0, "last_output": None,
+             "owed_frames": 0, "last_request": time.monotonic()}
+    credit_lock = threading.Lock()
+    # バッチ推論のために溜めている前処理済みフレーム [(image_tensor, provenance)]
+    pending_batch = []
+    history_lock = threading.Lock()
+    # 表示用の BGR 配列（表示待ちの K 枚 + 拡大中 + ウィンドウの表示待ち・表示中 + 書き込み中の分だけ使い回す）
+    display_converter = DisplayConverter(DISPLAY_WIDTH, DISPLAY_HEIGHT, buffers=FRAME_BUFFER_SIZE + 3)
+    display_window = DisplayWindow(WINDOW_NAME, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+    # 入力がほとんど変わらないフレームの推論を省く
+    change_gate = ChangeGate()
+    # カメラが止まった場合などにメインループを終わらせる
+    stop_requested = threading.Event()
+
+    def on_model_ready(key, stream_diffusion):
+        """モデルの切り替え（以降のフレームは新しいモデルで前処理・推論・後処理する）"""
+        nonlocal stream
+        stream = stream_diffusion.stream
+        prompt_controller.attach(stream)
+        # 変化検出の比較相手は前のモデルの出力に対するものなので、次のフレームは必ず推論する
+        change_gate.reset()
+        print(f"🔀 モデルを切り替えました: {key}")
+
+    def switch_model(model_id):
+        """モデルを切り替え、結果のメッセージを返す（常駐していなければ読み込みの間も現在のモデルで生成を続ける）"""
+        if not model_id:
+            return model_registry.format_stats()
+        key = model_key_for(model_id, use_tiny_vae=use_tiny_vae, use_kohaku_model=False, device=model_device)
+        if key == model_registry.active_key:
+            return f"使用中のモデルです: {key}"
+        if model_registry.activate(key, on_model_ready):
+            return f"常駐モデルに切り替えました: {key}"
+        message = f"⏳ モデルを読み込み中: {key}"
+        print(message)
+        return message
+
+    def request_owed_frames():
+        """受け取ったフレームの分だけ送信側へ次のフレームを要求し、処理レートを伝える
+
+        要求は受け取ったフレームごとに必ず1回行う（要求が失われると送信側はフレームを送らなくなる）。
+        """
+        with credit_lock:
+            count, state["owed_frames"] = state["owed_frames"], 0
+            if count:
+                state["last_request"] = time.monotonic()
+        if count:
+            frame_receiver.request_frames(count, rate=latency_tracker.fps() or None)
+
+    def next_frame():
+        """キャプチャ: 次の入力フレームを (frame, frame_layout, provenance, request_next) で返す（なければ None）"""
+        if input_source == "moon_frames":
+            # main_moon.pyから前回処理したものより新しいフレームを待つ
+            received = frame_receiver.wait_for_frame(state["last_frame_id"], timeout=FRAME_WAIT_TIMEOUT)
+            if received is not None:
+                state["last_frame_id"] = received.frame_id
+                frame, provenance = received.frame, received.provenance
+                # このフレームの推論を始めたら送信側へ次のフレームを要求する
+                request_next = True
+                provenance.mark("pickup")
+                return frame, frame_receiver.layout, provenance, request_next
+            with credit_lock:
+                # 要求してもフレームが届かない（要求が途中で失われた）場合は要求し直す
+                retry = not state["owed_frames"] and time.monotonic() - state["last_request"] >= FRAME_REQUEST_RETRY
+                if retry:
+                    state["owed_frames"] = 1
+            if retry:
+                request_owed_frames()
+            if REUSE_STALLED_FRAME and state["last_frame_id"]:
+                # 送信側が止まっている間も同じフレームから生成を続ける（来歴は取り直す）
+                frame, provenance = frame_receiver.get_latest_frame_with_provenance()
+                provenance = FrameProvenance(provenance.sequence, provenance.capture_time)
+                request_next = False
+            else:
+                return None
+            provenance.mark("pickup")
+            return frame, frame_receiver.layout, provenance, request_next
+
+        # カメラからフレーム取得
+        ret, frame = cap.read()
+        if not ret:
+            print("カメラから映像が取得できませんでした")
+            stop_requested.set()
+            return None
+        state["captured_count"] += 1
+        provenance = FrameProvenance(state["captured_count"], capture_time=time.time())
+        return frame, None, provenance, False
+
+    def preprocess(item):
+        """前処理: フレームを推論用のテンソルにし、FRAME_BUFFER_SIZE 枚揃ったら推論へ渡す"""
+        frame, frame_layout, provenance, request_next = item
+        if request_next:
+            # 次のフレームは推論を始めるときに要求する（推論と次のフレームの描画・転送を重ねる）
+            with credit_lock:
+                state["owed_frames"] += 1
+        batch = None
+        try:
+            batch = prepare_batch(frame, frame_layout, provenance)
+        finally:
+            if batch is None:
+                # バッチが揃うまで・エラーで推論へ渡さない場合は、推論を待たずにここで要求する
+                request_owed_frames()
+        return batch
+
+    def prepare_batch(frame, frame_layout, provenance):
+        """推論へ渡す (image_tensors, provenances)（バッチが揃うまでは None）"""
+        channels = "rgb" if is_sd_ready(frame_layout) else "bgr"
+        if not change_gate.should_process(frame, channels):
+            # 入力がほとんど変わっていなければ推論せず、前回の出力を使い回す
+            provenance.mark("preprocess")
+            return None, [provenance]
+        if is_sd_ready(frame_layout):
+            # 送信側で切り抜き・縮小・RGB化済み（float32 は [0,1] のまま前処理に渡せる）
+            image_tensor = stream.preprocess_array(frame, "rgb")
+        else:
+            # カメラフレームを中央で切り抜いてSDサイズに縮小（PIL を経由せず1回の参照で行う）
+            image_tensor = stream.preprocess_array(frame, "bgr", crop_size=SD_SIDE_LENGTH * 2)
+        provenance.mark("preprocess")
+        pending_batch.append((image_tensor, provenance))
+        if len(pending_batch) < FRAME_BUFFER_SIZE:
+            return None
+        image_tensors = [image_tensor for image_tensor, _ in pending_batch]
+        provenances = [provenance for _, provenance in pending_batch]
+        pending_batch.clear()
+        return image_tensors, provenances
+
+    def infer(item):
+        """推論: UNet / VAE（この間に次のフレームのキャプチャ・前処理と前のフレームの表示が進む）"""
+        image_tensors, provenances = item
+        # 次のフレームの描画・転送・前処理をこのフレームの推論と重ねる
+        # （推論の前に捨てられた入力の分もここでまとめて要求する）
+        request_owed_frames()
+        if image_tensors is None:
+            # 変化検出で省いたフレーム。ブレンドする場合だけ前回の出力をもう一度後処理へ流す
+            # （ブレンドしない場合はウィンドウに前回の出力が残っている）
+            if not PIXEL_BLEND or state["last_output"] is None:
+                return None
+            return state["last_output"], provenances
+        output_tensor = stream.infer(image_tensors, provenances)
+        # 使い回すのはバッチの最後の1枚
+        state["last_output"] = output_tensor[-1:]
+        return output_tensor, provenances
+
+    def postprocess(item):
+        """後処理: フレーム履歴とのブレンド・表示サイズへの変換（PIL は使わない）"""
+        output_tensor, provenances = item
+        output_images = stream.postprocess_output(output_tensor, provenances)
+        # バッチの出力は先頭の次元で分け、表示ステージが等間隔に並べて表示する
+        output_images = list(output_images) if FRAME_BUFFER_SIZE > 1 else [output_images]
+        return [
+            blend(output_image, provenance)
+            for output_image, provenance in zip(output_images, provenances)
+        ] or None
+
+    def blend(output_image, provenance):
+        """1枚の出力をフレーム履歴とブレンドし、SD の解像度の BGR 配列にする"""
+        with history_lock:
+            # 履歴のリングとブレンドし、ブレンド後の出力を履歴に加える
+            output_image = FRAME_BLENDER.push(output_image)
+        provenance.mark("blend")
+
+        # 表示サイズへの拡大は表示ステージで行う
+        return display_converter.to_bgr(output_image), provenance
+
+    def display(item):
+        """表示: 表示サイズに拡大してウィンドウに渡す（ウィンドウの更新はメインスレッドの refresh()）"""
+        output_image_bgr, provenance = item
+        display_window.submit(display_converter.scale(output_image_bgr), provenance)
+        return None
+
+    def on_displayed(provenance):
+        """メインスレッドでフレームをウィンドウに表示した後の処理"""
+        provenance.mark("display")
+        latency_tracker.record(provenance)
+        if latency_tracker.maybe_report():
+            print(pipeline.format_report())
+
+        state["frame_count"] += 1
+
+        # 定期的にクリエイティブ要素を更新
+        if state["frame_count"] % creativity_update_interval == 0:
+            creative_prompt = add_creative_randomness(current_prompt)
+            prompt_controller.submit(creative_prompt)
+
+        # 自動保存を無効化
+        # if state["frame_count"] % save_interval == 0:
+        #     save_to_gallery(output_image, current_prompt)
+        #     print(f"💾 自動保存（{frame_count}フレーム毎）")
+
+    # キャプチャ/前処理 → 推論 → 後処理 → 表示（拡大）。間は最新優先のキュー（1フレーム）でつなぐ。
+    # ウィンドウの更新だけはメインスレッドで display_fps を上限に行い、推論を待たせない
+    pipeline = Pipeline()
+    pipeline.add_stage("preprocess", preprocess, source=next_frame)
+    pipeline.add_stage("inference", infer)
+    pipeline.add_stage("postprocess", postprocess)
+    pipeline.add_stage("display", display, input_queue=PacedQueue())
     
     # プロンプト入力スレッドを開始
     prompt_thread = threading.Thread(
         target=prompt_input_thread, 
-        args=(stream, enhance_prompt),
+        args=(prompt_controller, enhance_prompt),
         daemon=True
     )
     prompt_thread.start()
@@ -563,7 +656,7 @@ def main():
     # TCPサーバースレッドを開始
     server_thread = threading.Thread(
         target=run_server,
-        args=(stream, enhance_prompt),
+        args=(prompt_controller, enhance_prompt, switch_model),
         daemon=True
     )
     server_thread.start()
@@ -576,97 +669,19 @@ def main():
     print("[i] プロンプト入力モード")
     print("[s] 現在の画像を保存")
     print("[p] プロンプト履歴表示")
+    print("[l] レイテンシ・ステージ稼働率表示")
+    print(f"[m] モデル切り替え ({' / '.join(SWITCH_MODELS)})")
     print("[q] 終了")
     print("=======================================\n")
+
+    pipeline.start()
     
-    while True:
+    while not stop_requested.is_set():
         try:
-            frame = None
-            
-            if input_source == "moon_frames":
-                # main_moon.pyからフレーム取得
-                moon_frame = frame_receiver.get_latest_frame()
-                if moon_frame is not None:
-                    frame = moon_frame
-                else:
-                    # フレームがまだない場合はスキップ
-                    time.sleep(0.01)
-                    continue
-            else:
-                # カメラからフレーム取得
-                ret, frame = cap.read()
-                if not ret:
-                    print("カメラから映像が取得できませんでした")
-                    break
-            
-            # カメラフレームをSDサイズにリサイズして初期画像に（任意）
-            init_img = crop_center(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)),
-                                   SD_SIDE_LENGTH * 2, SD_SIDE_LENGTH * 2).resize(
-                (SD_SIDE_LENGTH, SD_SIDE_LENGTH), Image.NEAREST
-            )
-            
-            # 推論用前処理
-            image_tensor = stream.preprocess_image(init_img)
-            
-            try:
-                # 推論実行
-                output_image, fps = timeit(stream)(image=image_tensor)
-                if isinstance(output_image, Image.Image):
-                    # フレーム履歴管理（最大3フレーム）
-                    if len(FRAME_HISTORY) >= MAX_FRAME_HISTORY:
-                        FRAME_HISTORY.pop(0)  # 古いフレームを削除
-                    
-                    # 過去フレームとブレンド（3フレーム平均）
-                    if FRAME_HISTORY:
-                        curr_array = np.array(output_image, dtype=np.float32)
-                        
-                        # 過去フレームの平均を計算
-                        history_arrays = [np.array(img, dtype=np.float32) for img in FRAME_HISTORY]
-                        if history_arrays:
-                            avg_history = np.mean(history_arrays, axis=0)
-                            # 現在フレームと履歴の重み付き平均
-                            blended = avg_history * (1 - FRAME_BLEND_ALPHA) + curr_array * FRAME_BLEND_ALPHA
-                            output_image = Image.fromarray(blended.astype(np.uint8))
-                    
-                    FRAME_HISTORY.append(output_image)
-                    
-                    # 表示用にリサイズ
-                    display_image = output_image.resize((DISPLAY_WIDTH, DISPLAY_HEIGHT), Image.LANCZOS)
-                    output_image_np = cv2.cvtColor(np.array(display_image), cv2.COLOR_RGB2BGR)
-                    
-                    # ウィンドウサイズを初回のみ設定
-                    global window_initialized
-                    if not window_initialized:
-                        cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
-                        cv2.resizeWindow(WINDOW_NAME, DISPLAY_WIDTH, DISPLAY_HEIGHT)
-                        window_initialized = True
-                    
-                    cv2.imshow(WINDOW_NAME, output_image_np)
-
-                    frame_count += 1
-                    
-                    # 定期的にクリエイティブ要素を更新
-                    if frame_count % creativity_update_interval == 0:
-                        creative_prompt = add_creative_randomness(current_prompt)
-                        stream.prepare(
-                            prompt=creative_prompt,
-                            negative_prompt="low quality, bad quality, blurry, low resolution",
-                            num_inference_steps=config.num_inference_steps,
-                            guidance_scale=config.guidance_scale,
-                            delta=config.delta,
-                        )
-                    
-                    # 自動保存を無効化
-                    # if frame_count % save_interval == 0:
-                    #     save_to_gallery(output_image, current_prompt)
-                    #     print(f"💾 自動保存（{frame_count}フレーム毎）")
-            
-            except Exception as e:
-                print(f"❌ 生成中のエラー: {e}")
-                if FRAME_HISTORY:
-                    display_image = FRAME_HISTORY[-1].resize((DISPLAY_WIDTH, DISPLAY_HEIGHT), Image.LANCZOS)
-                    fallback_np = cv2.cvtColor(np.array(display_image), cv2.COLOR_RGB2BGR)
-                    cv2.imshow(WINDOW_NAME, fallback_np)
+            # 表示するフレームを待つ（なければキー入力の処理だけ行う）
+            shown = display_window.refresh(timeout=FRAME_WAIT_TIMEOUT)
+            if shown is not None:
+                on_displayed(shown[1])
 
             # キー入力処理
             key = cv2.waitKey(1) & 0xFF
@@ -677,15 +692,11 @@ def main():
                 current_prompt = generate_random_prompt()
                 PROMPT_HISTORY.append(current_prompt)
                 print(f"🔁 新プロンプト: {current_prompt}")
-                stream.prepare(
-                    prompt=add_creative_randomness(current_prompt),
-                    negative_prompt="low quality, bad quality, blurry, low resolution",
-                    num_inference_steps=config.num_inference_steps,
-                    guidance_scale=config.guidance_scale,
-                    delta=config.delta,
-                )
-            elif key == ord('s') and FRAME_HISTORY:
-                filename = save_to_gallery(FRAME_HISTORY[-1], current_prompt)
+                prompt_controller.submit(add_creative_randomness(current_prompt))
+            elif key == ord('s') and len(FRAME_BLENDER):
+                with history_lock:
+                    latest_image = FRAME_BLENDER.latest().copy()
+                filename = save_to_gallery(latest_image, current_prompt)
                 print(f"💾 手動保存: {filename}")
             elif key == ord('i'):
                 print("\n💡 プロンプト入力モード")
@@ -716,13 +727,7 @@ def main():
                     current_prompt = new_prompt
                     PROMPT_HISTORY.append(new_prompt)
                     
-                    stream.prepare(
-                        prompt=add_creative_randomness(new_prompt),
-                        negative_prompt="low quality, bad quality, blurry, low resolution", 
-                        num_inference_steps=config.num_inference_steps,
-                        guidance_scale=config.guidance_scale,
-                        delta=config.delta,
-                    )
+                    prompt_controller.submit(add_creative_randomness(new_prompt))
                     print(f"🔄 プロンプトを更新しました: {new_prompt}")
                     
                 except Exception as e:
@@ -732,13 +737,28 @@ def main():
                 print("\n=== Prompt History ===")
                 for i, prompt in enumerate(PROMPT_HISTORY, 1):
                     print(f"{i}. {prompt}")
+                print(stream.prompt_cache.format_stats())
+                print(prompt_controller.format_stats())
                 print("=======================\n")
+            elif key == ord('m') and SWITCH_MODELS:
+                # switch_models を順に切り替える
+                active_model = model_registry.active_key.model_id
+                index = SWITCH_MODELS.index(active_model) + 1 if active_model in SWITCH_MODELS else 0
+                print(switch_model(SWITCH_MODELS[index % len(SWITCH_MODELS)]))
+            elif key == ord('l'):
+                print(latency_tracker.format_report())
+                print(pipeline.format_report())
+                print(f"ウィンドウ: 表示 {display_window.shown} / 表示前に置き換え {display_window.skipped}")
+                print(change_gate.format_stats())
+                print(model_registry.format_stats())
 
         except KeyboardInterrupt:
             print("👋 キーボード割り込みによって終了")
             break
 
     # リソース解放
+    pipeline.stop()
+    prompt_controller.close()
     if cap:
         cap.release()
     if frame_receiver:
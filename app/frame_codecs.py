@@ -0,0 +1,93 @@
+"""
+フレームの圧縮エンコード
+
+ビジュアライザと SD 実行マシンが別の場合に、生フレーム（800x800x3 で約1.9MB）の
+代わりに JPEG / WebP / PNG で送るためのエンコーダ・デコーダ。
+どの形式を使うかは接続時に FrameReceiver と FrameSender の間で取り決める。
+
+エンコード・デコードはチャンネル順を変えないため、BGR のフレームは BGR のまま復元される。
+"""
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+ENCODING_WEBP = 2
+ENCODING_PNG = 3
+
+ENCODINGS = {
+    "raw": ENCODING_RAW,
+    "jpeg": ENCODING_JPEG,
+    "webp": ENCODING_WEBP,
+    "png": ENCODING_PNG,
+}
+ENCODING_NAMES = {value: name for name, value in ENCODINGS.items()}
+
+_EXTENSIONS = {
+    ENCODING_JPEG: ".jpg",
+    ENCODING_WEBP: ".webp",
+    ENCODING_PNG: ".png",
+}
+
+# PNGは可逆なので品質の代わりに最速の圧縮レベルを使う
+PNG_COMPRESSION_LEVEL = 1
+
+
+def available_encodings() -> List[str]:
+    """このOpenCVビルドでエンコード・デコードできる形式（raw を含む）"""
+    names = ["raw"]
+    for name, encoding in ENCODINGS.items():
+        if encoding == ENCODING_RAW:
+            continue
+        extension = _EXTENSIONS[encoding]
+        if cv2.haveImageWriter(extension):
+            names.append(name)
+    return names
+
+
+def can_encode(frame: np.ndarray) -> bool:
+    """画像コーデックで扱えるフレームか（uint8 のグレースケール / 3ch / 4ch）"""
+    if frame.dtype != np.uint8:
+        return False
+    return frame.ndim == 2 or (frame.ndim == 3 and frame.shape[2] in (1, 3, 4))
+
+
+def encode_frame(frame: np.ndarray, encoding: int, quality: int) -> Tuple[np.ndarray, float]:
+    """フレームをエンコードし (エンコード済みバイト列, 所要時間[秒]) を返す"""
+    start = time.perf_counter()
+    if encoding == ENCODING_JPEG:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif encoding == ENCODING_WEBP:
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif encoding == ENCODING_PNG:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION_LEVEL]
+    else:
+        raise ValueError(f"unsupported encoding: {encoding}")
+
+    ok, encoded = cv2.imencode(_EXTENSIONS[encoding], frame, params)
+    if not ok:
+        raise ValueError(f"failed to encode frame as {ENCODING_NAMES[encoding]}")
+    return encoded, time.perf_counter() - start
+
+
+def decode_frame(payload, encoding: int, shape=None) -> np.ndarray:
+    """エンコード済みバイト列をフレームに復元
+
+    shape を渡すとグレースケールをその形（(H, W) / (H, W, 1)）に揃える。
+    OpenCV はグレースケールを (H, W) で返し、WebP は 3ch に展開して返すため。
+    """
+    if encoding not in _EXTENSIONS:
+        raise ValueError(f"unsupported encoding: {encoding}")
+    frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if frame is None:
+        raise ValueError(f"failed to decode {ENCODING_NAMES[encoding]} frame")
+    if shape is not None and frame.shape != tuple(shape):
+        grayscale = len(shape) == 2 or (len(shape) == 3 and shape[2] == 1)
+        if grayscale and frame.shape[:2] == tuple(shape[:2]):
+            if frame.ndim == 3:
+                frame = np.ascontiguousarray(frame[:, :, 0])
+            frame = frame.reshape(shape)
+    return frame
@@ -0,0 +1,151 @@
+"""
+受信側が必要とするフレームの形（切り抜き・解像度・チャンネル順・dtype）
+
+web_camera.py は受け取ったフレームを中央で SD_SIDE_LENGTH*2 に切り抜き、
+NEAREST で SD_SIDE_LENGTH に縮小して RGB で使う。FrameReceiver がこの形を
+接続時に伝え、FrameSender が送信前に一度だけ変換することで、余分な画素の
+転送と BGR⇔RGB の往復変換をなくす。
+
+変換結果は PIL の crop（範囲外は黒で埋める）+ resize(NEAREST) と一致する。
+"""
+from typing import Optional
+
+import numpy as np
+
+CHANNEL_ORDERS = ("rgb", "bgr")
+DTYPES = ("uint8", "float32")
+
+
+def _nearest_indices(length: int, crop: Optional[int], size: Optional[int]):
+    """中央切り抜き + NEAREST縮小で参照する元画素の位置と、画像内に収まるかのマスク"""
+    crop = length if crop is None else crop
+    size = crop if size is None else size
+    start = (length - crop) // 2
+    # PIL の NEAREST は出力画素の中心 (i + 0.5) を元画像の座標に写して切り捨てる。
+    # 座標は1画素ごとに倍率を足していく（ImagingScaleAffine）ので、丸め誤差も同じ順で足して再現する
+    scale = crop / size
+    steps = np.full(size, scale)
+    steps[0] = scale * 0.5
+    indices = start + np.add.accumulate(steps).astype(np.intp)
+    valid = (indices >= 0) & (indices < length)
+    return np.clip(indices, 0, length - 1), valid
+
+
+def _regular_slices(indices: np.ndarray, valid: np.ndarray):
+    """参照位置が等間隔なら (元画像のスライス, 出力のスライス)、そうでなければ None
+
+    縮小率が整数の場合（SD_SIDE_LENGTH*2 → SD_SIDE_LENGTH など）は1つおきの参照になり、
+    インデックス配列による参照をスライス（コピーなしのビュー）に置き換えられる。
+    範囲外（黒で埋める）は出力の両端にしか現れない。
+    """
+    inside = np.flatnonzero(valid)
+    if len(inside) == 0:
+        return None
+    start, stop = inside[0], inside[-1] + 1
+    used = indices[start:stop]
+    step = int(used[1] - used[0]) if len(used) > 1 else 1
+    if step <= 0 or np.any(np.diff(used) != step):
+        return None
+    return slice(int(used[0]), int(used[-1]) + 1, step), slice(int(start), int(stop))
+
+
+class FrameLayout:
+    """フレームの切り抜き・解像度・チャンネル順・dtype
+
+    crop_size / size が None の場合はそれぞれ切り抜き・縮小を行わない。
+    dtype が float32 の場合は [0, 1] に正規化する。
+    """
+
+    def __init__(self, crop_size: Optional[int] = None, size: Optional[int] = None, channels: str = "bgr",
+                 dtype: str = "uint8"):
+        if channels not in CHANNEL_ORDERS:
+            raise ValueError(f"channels must be one of {CHANNEL_ORDERS}, got {channels}")
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, got {dtype}")
+        self.crop_size = crop_size
+        self.size = size
+        self.channels = channels
+        self.dtype = dtype
+        self._indices = {}
+        self._slices = {}
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "FrameLayout":
+        crop_size = values.get("crop")
+        size = values.get("size")
+        return cls(
+            crop_size=None if crop_size is None else int(crop_size),
+            size=None if size is None else int(size),
+            channels=values.get("channels", "bgr"),
+            dtype=values.get("dtype", "uint8"),
+        )
+
+    def to_dict(self) -> dict:
+        return {"crop": self.crop_size, "size": self.size, "channels": self.channels, "dtype": self.dtype}
+
+    @property
+    def key(self):
+        return (self.crop_size, self.size, self.channels, self.dtype)
+
+    @property
+    def is_passthrough(self) -> bool:
+        """切り抜き・縮小・型変換を行わないか（チャンネル順の入れ替えのみ）"""
+        return self.crop_size is None and self.size is None and self.dtype == "uint8"
+
+    def _gather_indices(self, height: int, width: int):
+        key = (height, width)
+        if key not in self._indices:
+            rows, rows_valid = _nearest_indices(height, self.crop_size, self.size)
+            cols, cols_valid = _nearest_indices(width, self.crop_size, self.size)
+            self._indices[key] = (rows[:, None], cols[None, :], rows_valid, cols_valid)
+        return self._indices[key]
+
+    def slices(self, height: int, width: int):
+        """切り抜き・縮小をスライスで表せる場合は (元の行, 元の列, 出力の行, 出力の列)、そうでなければ None
+
+        出力のうち (出力の行, 出力の列) の範囲が frame[元の行, 元の列] になり、残りは黒。
+        """
+        key = (height, width)
+        if key not in self._slices:
+            rows, cols, rows_valid, cols_valid = self._gather_indices(height, width)
+            row_slices = _regular_slices(rows[:, 0], rows_valid)
+            col_slices = _regular_slices(cols[0], cols_valid)
+            if row_slices is None or col_slices is None:
+                self._slices[key] = None
+            else:
+                self._slices[key] = (row_slices[0], col_slices[0], row_slices[1], col_slices[1])
+        return self._slices[key]
+
+    def apply(self, frame: np.ndarray, source_channels: str = "bgr") -> np.ndarray:
+        """HWC の uint8 フレームをこのレイアウトに変換"""
+        channel_index = slice(None) if source_channels == self.channels else slice(None, None, -1)
+        if self.is_passthrough:
+            # 並べ替えだけならビューで済む（送信時もコピーされない）
+            return frame[:, :, channel_index]
+
+        slices = self.slices(frame.shape[0], frame.shape[1])
+        if slices is not None:
+            # 等間隔の参照はスライスのビューから1回コピーするだけで済む
+            source_rows, source_cols, rows, cols = slices
+            size = (rows.stop - rows.start, cols.stop - cols.start)
+            output_size = self.size or self.crop_size
+            if output_size is None or size == (output_size, output_size):
+                converted = frame[source_rows, source_cols, channel_index].copy()
+            else:
+                converted = np.zeros((output_size, output_size, frame.shape[2]), dtype=frame.dtype)
+                converted[rows, cols] = frame[source_rows, source_cols, channel_index]
+        else:
+            rows, cols, rows_valid, cols_valid = self._gather_indices(frame.shape[0], frame.shape[1])
+            # 切り抜き・縮小・チャンネル並べ替えを1回のインデックス参照で行う
+            converted = frame[:, :, channel_index][rows, cols]
+            if not rows_valid.all():
+                converted[~rows_valid] = 0
+            if not cols_valid.all():
+                converted[:, ~cols_valid] = 0
+        if self.dtype == "float32":
+            converted = converted.astype(np.float32)
+            converted /= np.float32(255.0)
+        return converted
+
+    def __repr__(self):
+        return f"FrameLayout(crop={self.crop_size}, size={self.size}, channels={self.channels}, dtype={self.dtype})"
@@ -0,0 +1,386 @@
+"""
+フレーム転送用のバイナリプロトコル
+
+numpy配列を「固定長ヘッダ + 生ピクセル」で送受信する。
+pickleを使わないため、ネットワークから受け取ったデータが実行されることはない。
+送信側は配列のメモリを memoryview のまま sendmsg し、受信側は再利用バッファへ
+recv_into してそのままnumpyビューとして公開するので、1フレームあたりの
+シリアライズ・連結コピーが発生しない。
+
+フレームヘッダ（ネットワークバイトオーダー）:
+    magic(4s) version(B) msg_type(B) ndim(B) encoding(B) dtype(4s)
+    shape(4I) strides(4q) offset(Q) sequence(Q) timestamp(d) payload_size(Q)
+    capture_time(d) send_time(d)
+
+timestamp は送信側で描画が終わった時刻、capture_time はそのフレームの元になった
+音声チャンクの取得時刻（不明なら0）、send_time は実際に送信した時刻（latency を参照）。
+version 2 以前のヘッダには capture_time / send_time がない。
+
+encoding が raw 以外の場合、ペイロードは frame_codecs でエンコードされた画像で、
+shape/dtype は復元後の配列を表す。
+
+制御メッセージ（接続時のエンコード取り決めなど）:
+    magic(4s) version(B) msg_type(B) pad(2x) payload_size(I) + JSON
+
+ハートビート（接続時に取り決めた間隔で双方向に送る。ペイロードなし）:
+    magic(4s) version(B) msg_type(B) pad(2x) payload_size(I)=0
+
+送信用の *_buffers 関数はバッファのリストを返すだけなので、ノンブロッキング
+ソケットでは send_some で少しずつ送れる。受信は FrameParser が逐次組み立てる。
+
+旧形式（4バイト長 + pickle）もレガシーモードとして送受信できる。
+"""
+import json
+import pickle
+import struct
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .frame_codecs import ENCODING_NAMES, ENCODING_RAW, decode_frame
+
+MAGIC = b"SDFR"
+PROTOCOL_VERSION = 3
+# version 1 は encoding フィールドが常に0（raw）、version 2 は capture_time / send_time のない旧ヘッダ
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+MSG_FRAME = 1
+MSG_CONTROL = 2
+MSG_HEARTBEAT = 3
+
+MAX_NDIM = 4
+# 不正なヘッダで巨大なバッファを確保しないための上限
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+# 受け付けるdtype（bool, 符号付き/なし整数, 浮動小数点のみ。objectは不可）
+ALLOWED_DTYPE_KINDS = "biuf"
+
+PREFIX = struct.Struct("!4sBB")
+HEADER = struct.Struct("!4sBBBB4s4I4qQQdQdd")
+HEADER_V2 = struct.Struct("!4sBBBB4s4I4qQQdQ")
+CONTROL = struct.Struct("!4sBB2xI")
+MAX_CONTROL_SIZE = 64 * 1024
+LEGACY_SIZE = struct.Struct("!I")
+
+
+class ProtocolError(ConnectionError):
+    """受信データがプロトコルに従っていない"""
+
+
+class FrameHeader(NamedTuple):
+    """受信したフレームのメタデータ"""
+    sequence: int
+    timestamp: float
+    payload_size: int
+    encoding: int = ENCODING_RAW
+    capture_time: Optional[float] = None
+    send_time: Optional[float] = None
+
+
+def _pad(values, fill=0):
+    return tuple(values) + (fill,) * (MAX_NDIM - len(values))
+
+
+def _payload_view(frame: np.ndarray) -> Tuple[np.ndarray, Tuple[int, ...], int]:
+    """コピーせずに送れる連続メモリ領域と、それを元の配列として見るための strides/offset を返す
+
+    転置や [:, :, ::-1] のようなビューでも、元のメモリが隙間なく連続していれば
+    そのまま送信できる。連続していない場合のみ ascontiguousarray でコピーする。
+    """
+    view = frame
+    offset = 0
+    for axis, stride in enumerate(frame.strides):
+        if stride < 0:
+            offset += (frame.shape[axis] - 1) * -stride
+            index = [slice(None)] * frame.ndim
+            index[axis] = slice(None, None, -1)
+            view = view[tuple(index)]
+    order = sorted(range(view.ndim), key=lambda axis: view.strides[axis], reverse=True)
+    view = view.transpose(order)
+    if view.flags.c_contiguous:
+        return view, frame.strides, offset
+
+    contiguous = np.ascontiguousarray(frame)
+    return contiguous, contiguous.strides, 0
+
+
+def as_views(buffers) -> List[memoryview]:
+    """送信バッファをバイト単位の memoryview のリストにする（send_some 用）"""
+    return [memoryview(buffer).cast("B") for buffer in buffers]
+
+
+def _consume(views: List[memoryview], sent: int) -> None:
+    """送信済みの sent バイトを views の先頭から取り除く"""
+    while views and sent >= len(views[0]):
+        sent -= len(views[0])
+        views.pop(0)
+    if views and sent:
+        views[0] = views[0][sent:]
+
+
+def send_some(sock, views: List[memoryview]) -> bool:
+    """ノンブロッキングソケットに送れるだけ送る
+
+    views から送信済みの部分を取り除き、すべて送り終えたら True を返す。
+    """
+    while views:
+        try:
+            sent = sock.sendmsg(views)
+        except (BlockingIOError, InterruptedError):
+            return False
+        _consume(views, sent)
+    return True
+
+
+def _c_strides(frame: np.ndarray) -> Tuple[int, ...]:
+    """frame と同じ shape/dtype の C連続配列の strides"""
+    strides = []
+    stride = frame.dtype.itemsize
+    for size in reversed(frame.shape):
+        strides.append(stride)
+        stride *= size
+    return tuple(reversed(strides))
+
+
+def _check_frame(frame: np.ndarray) -> None:
+    if frame.ndim > MAX_NDIM:
+        raise ValueError(f"ndim must be <= {MAX_NDIM}, got {frame.ndim}")
+    if frame.dtype.kind not in ALLOWED_DTYPE_KINDS:
+        raise ValueError(f"unsupported dtype: {frame.dtype}")
+
+
+def _pack_header(frame, encoding, strides, offset, sequence, timestamp, payload_size, capture_time) -> bytes:
+    send_time = time.time()
+    return HEADER.pack(
+        MAGIC,
+        PROTOCOL_VERSION,
+        MSG_FRAME,
+        frame.ndim,
+        encoding,
+        frame.dtype.str.encode("ascii"),
+        *_pad(frame.shape),
+        *_pad(strides),
+        offset,
+        sequence,
+        send_time if timestamp is None else timestamp,
+        payload_size,
+        capture_time or 0.0,
+        send_time,
+    )
+
+
+def frame_buffers(frame: np.ndarray, sequence: int, timestamp: Optional[float] = None,
+                  capture_time: Optional[float] = None) -> List:
+    """生フレームの送信バッファ [ヘッダ, ペイロード]（ペイロードは配列のメモリそのもの）"""
+    frame = np.asarray(frame)
+    _check_frame(frame)
+    payload, strides, offset = _payload_view(frame)
+    header = _pack_header(frame, ENCODING_RAW, strides, offset, sequence, timestamp, payload.nbytes, capture_time)
+    return [header, payload]
+
+
+def encoded_frame_buffers(frame: np.ndarray, payload: np.ndarray, encoding: int, sequence: int,
+                          timestamp: Optional[float] = None, capture_time: Optional[float] = None) -> List:
+    """frame_codecs でエンコード済みのフレームの送信バッファ [ヘッダ, ペイロード]
+
+    frame はヘッダ（復元後の shape/dtype）を作るためだけに使う。
+    """
+    frame = np.asarray(frame)
+    _check_frame(frame)
+    header = _pack_header(frame, encoding, _c_strides(frame), 0, sequence, timestamp, payload.nbytes, capture_time)
+    return [header, payload]
+
+
+def control_buffers(message: dict) -> List:
+    """制御メッセージ（JSON）の送信バッファ"""
+    payload = json.dumps(message).encode("utf-8")
+    return [CONTROL.pack(MAGIC, PROTOCOL_VERSION, MSG_CONTROL, len(payload)), payload]
+
+
+def heartbeat_buffers() -> List:
+    """ハートビートの送信バッファ（ペイロードなしの制御メッセージ）"""
+    return [CONTROL.pack(MAGIC, PROTOCOL_VERSION, MSG_HEARTBEAT, 0)]
+
+
+def pickled_frame_buffers(frame: np.ndarray) -> List:
+    """旧形式（4バイト長 + pickle）の送信バッファ（レガシーモード）"""
+    frame_data = pickle.dumps(frame)
+    return [LEGACY_SIZE.pack(len(frame_data)), frame_data]
+
+
+class FrameParser:
+    """受信したバイト列からメッセージを組み立てる逐次パーサ
+
+    ソケットを直接読まないので、イベントループ上のノンブロッキングソケットから
+    受信したバイト列を渡して使う:
+
+        count = sock.recv_into(parser.next_buffer())
+        message = parser.advance(count)  # 完成したら (msg_type, 内容)、途中なら None
+
+    メッセージは (MSG_FRAME, (frame, header))、(MSG_CONTROL, dict)、
+    (MSG_HEARTBEAT, None) のいずれか。旧形式のキープアライブは MSG_HEARTBEAT になる。
+
+    フレームのペイロードは buffer_count 個の受信バッファへ順番に受信され、
+    返される配列はそのバッファへのビューになる。同じバッファは
+    buffer_count - 1 フレーム後に上書きされるため、長く保持する場合は
+    呼び出し側でコピーすること。
+    """
+
+    def __init__(self, allow_pickle: bool = False, buffer_count: int = 3):
+        self.allow_pickle = allow_pickle
+        self._header = bytearray(HEADER.size)
+        self._buffers = [bytearray() for _ in range(buffer_count)]
+        self._buffer_index = 0
+        self._legacy_sequence = 0
+        self._frame_fields = None
+        self._view = None
+        self._filled = 0
+        self._handler = None
+        self._expect_magic()
+        # 受信統計
+        self.frames = 0
+        self.bytes_total = 0
+        self.decode_time_total = 0.0
+
+    def next_buffer(self) -> memoryview:
+        """次に受信したバイト列を書き込む領域"""
+        return self._view[self._filled:]
+
+    def advance(self, count: int):
+        """next_buffer() に count バイト書き込んだことを通知し、完成したメッセージがあれば返す"""
+        self._filled += count
+        if self._filled < len(self._view):
+            return None
+        return self._handler()
+
+    def _expect(self, view: memoryview, handler):
+        """view が埋まったら handler を呼ぶ（空なら即座に呼ぶ）"""
+        self._view = view
+        self._filled = 0
+        self._handler = handler
+        if not len(view):
+            return handler()
+        return None
+
+    def _expect_magic(self):
+        return self._expect(memoryview(self._header)[:4], self._on_magic)
+
+    def _complete(self, message):
+        """メッセージが完成したので次のメッセージの先頭を待つ"""
+        self._expect_magic()
+        return message
+
+    def _next_buffer(self, size: int) -> memoryview:
+        """次の受信バッファを取得（不足時のみ確保し直す）"""
+        self._buffer_index = (self._buffer_index + 1) % len(self._buffers)
+        buffer = self._buffers[self._buffer_index]
+        if len(buffer) < size:
+            # 既存バッファはnumpyビューから参照されている可能性があるため、
+            # サイズ変更せず新しいバッファに差し替える
+            buffer = bytearray(size)
+            self._buffers[self._buffer_index] = buffer
+        return memoryview(buffer)[:size]
+
+    def _on_magic(self):
+        if self._header[:4] != MAGIC:
+            return self._on_legacy_size()
+        return self._expect(memoryview(self._header)[4:PREFIX.size], self._on_prefix)
+
+    def _on_prefix(self):
+        _, version, msg_type = PREFIX.unpack_from(self._header)
+        if version not in SUPPORTED_VERSIONS:
+            raise ProtocolError(f"未対応のプロトコルバージョン: {version}")
+        if msg_type in (MSG_CONTROL, MSG_HEARTBEAT):
+            return self._expect(memoryview(self._header)[PREFIX.size:CONTROL.size], self._on_control_size)
+        if msg_type != MSG_FRAME:
+            raise ProtocolError(f"未対応のメッセージ種別: {msg_type}")
+        header_struct = HEADER if version >= 3 else HEADER_V2
+        return self._expect(memoryview(self._header)[PREFIX.size:header_struct.size], self._on_frame_header)
+
+    def _on_control_size(self):
+        msg_type, payload_size = CONTROL.unpack_from(self._header)[2:]
+        if msg_type == MSG_HEARTBEAT:
+            if payload_size:
+                raise ProtocolError(f"不正なハートビート: {payload_size}")
+            return self._complete((MSG_HEARTBEAT, None))
+        if payload_size > MAX_CONTROL_SIZE:
+            raise ProtocolError(f"不正な制御メッセージサイズ: {payload_size}")
+        return self._expect(memoryview(bytearray(payload_size)), self._on_control_payload)
+
+    def _on_control_payload(self):
+        try:
+            message = json.loads(bytes(self._view).decode("utf-8"))
+        except ValueError as e:
+            raise ProtocolError(f"制御メッセージを解析できません: {e}") from e
+        if not isinstance(message, dict):
+            raise ProtocolError("制御メッセージはJSONオブジェクトである必要があります")
+        return self._complete((MSG_CONTROL, message))
+
+    def _on_frame_header(self):
+        version = self._header[4]
+        header_struct = HEADER if version >= 3 else HEADER_V2
+        fields = header_struct.unpack_from(self._header)
+        ndim, encoding, dtype_code = fields[3:6]
+        shape = fields[6:6 + MAX_NDIM][:ndim]
+        strides = fields[6 + MAX_NDIM:6 + 2 * MAX_NDIM][:ndim]
+        offset, sequence, timestamp, payload_size = fields[6 + 2 * MAX_NDIM:10 + 2 * MAX_NDIM]
+        capture_time = send_time = None
+        if version >= 3:
+            capture_time, send_time = fields[10 + 2 * MAX_NDIM:]
+            capture_time = capture_time or None
+
+        if ndim > MAX_NDIM or payload_size > MAX_PAYLOAD_SIZE:
+            raise ProtocolError(f"不正なフレームヘッダ: ndim={ndim}, size={payload_size}")
+        if encoding not in ENCODING_NAMES:
+            raise ProtocolError(f"未対応のエンコード: {encoding}")
+        dtype = np.dtype(dtype_code.rstrip(b"\0").decode("ascii"))
+        if dtype.kind not in ALLOWED_DTYPE_KINDS:
+            raise ProtocolError(f"未対応のdtype: {dtype}")
+
+        self._frame_fields = (
+            shape, strides, offset, dtype, FrameHeader(sequence, timestamp, payload_size, encoding, capture_time, send_time)
+        )
+        return self._expect(self._next_buffer(payload_size), self._on_frame_payload)
+
+    def _on_frame_payload(self):
+        shape, strides, offset, dtype, header = self._frame_fields
+        payload = self._view
+        self.frames += 1
+        self.bytes_total += header.payload_size
+
+        if header.encoding != ENCODING_RAW:
+            start = time.perf_counter()
+            try:
+                frame = decode_frame(payload, header.encoding, shape)
+            except ValueError as e:
+                raise ProtocolError(str(e)) from e
+            self.decode_time_total += time.perf_counter() - start
+            if frame.shape != tuple(shape) or frame.dtype != dtype:
+                raise ProtocolError(f"復元したフレームがヘッダと一致しません: {frame.shape} != {tuple(shape)}")
+            return self._complete((MSG_FRAME, (frame, header)))
+
+        try:
+            frame = np.ndarray(shape, dtype=dtype, buffer=payload, offset=offset, strides=strides)
+        except (TypeError, ValueError) as e:
+            raise ProtocolError(f"ヘッダとペイロードが一致しません: {e}") from e
+        return self._complete((MSG_FRAME, (frame, header)))
+
+    def _on_legacy_size(self):
+        """旧形式（4バイト長 + pickle）のフレーム"""
+        if not self.allow_pickle:
+            raise ProtocolError("pickle形式のフレームを受信しました（network.frame_protocol が 'pickle' の場合のみ許可）")
+
+        frame_size = LEGACY_SIZE.unpack_from(self._header)[0]
+        # キープアライブ
+        if frame_size == 0:
+            return self._complete((MSG_HEARTBEAT, None))
+        if frame_size > MAX_PAYLOAD_SIZE:
+            raise ProtocolError(f"不正なフレームサイズ: {frame_size}")
+        return self._expect(memoryview(bytearray(frame_size)), self._on_legacy_payload)
+
+    def _on_legacy_payload(self):
+        self._legacy_sequence += 1
+        frame = pickle.loads(self._view)
+        self.frames += 1
+        self.bytes_total += len(self._view)
+        return self._complete((MSG_FRAME, (frame, FrameHeader(self._legacy_sequence, time.time(), len(self._view)))))
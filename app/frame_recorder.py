@@ -0,0 +1,428 @@
+"""
+フレームストリームの録画と再生
+
+ビジュアライザが FrameSender に渡したフレームを、タイムスタンプ・音声取得時刻・
+音声特徴量（volume / bass / mid / high）と一緒に追記専用のファイルに書き出し、
+ReplaySource がそのファイルを FrameSender 経由で元の速度（または speed 倍速）で
+配信する。マイク・pygame のウィンドウ・カメラなしで web_camera.py を
+実際の入力でベンチマーク・回帰テストするために使う。
+
+ファイル形式（リトルエンディアン）:
+    [0:4096)  ヘッダ（magic, version, メタデータJSONの長さ）+ メタデータJSON
+              （shape, dtype, channels, features）
+    以降      レコード × N。1レコードは
+              レコードヘッダ（sequence int64, timestamp float64, capture_time float64
+              （不明なら NaN）, 特徴量 float32 × len(features)）を64バイトに整列したもの
+              + フレームデータ（64バイトに整列）
+
+レコードは固定長で追記のみのため、レコード数はファイルサイズから求まり、
+書き込み途中で止まった末尾のレコードは無視される。FrameRecording は
+ファイルを mmap し、各フレームと時刻の列をコピーせずにビューとして返すので、
+録画全体をメモリに読み込むことはない。
+
+使い方:
+    python -m app.frame_recorder record out.sdrec [--seconds 60]   # 送信中のストリームを録画
+    python -m app.frame_recorder replay out.sdrec [--speed 2] [--loop]
+    python -m app.frame_recorder info out.sdrec
+
+ビジュアライザ内で録画する場合（音声特徴量も記録される）は
+visualizer.record_path を設定する。
+"""
+import argparse
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .frame_layout import FrameLayout
+from .frame_protocol import ALLOWED_DTYPE_KINDS
+
+MAGIC = b"SDRC"
+RECORDING_VERSION = 1
+
+HEADER = struct.Struct("<4sII")
+DATA_OFFSET = 4096
+ALIGNMENT = 64
+# レコードヘッダの固定部分（sequence, timestamp, capture_time）
+RECORD_FIXED = struct.Struct("<qdd")
+
+# ビジュアライザが記録する音声特徴量
+AUDIO_FEATURES = ("volume", "bass", "mid", "high")
+# 書き込みスレッドに渡すまでに溜められるフレーム数（超えた分は録画しない）
+RECORD_QUEUE_SIZE = 32
+
+
+def _align(value: int) -> int:
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _record_layout(frame_size: int, feature_count: int):
+    """(レコードヘッダの大きさ, 1レコードの間隔) を返す"""
+    header_size = _align(RECORD_FIXED.size + 4 * feature_count)
+    return header_size, header_size + _align(frame_size)
+
+
+class RecordedFrame(NamedTuple):
+    """FrameRecording の1レコード（frame は mmap へのビュー）"""
+    sequence: int
+    timestamp: float
+    capture_time: Optional[float]
+    features: dict
+    frame: np.ndarray
+
+
+class FrameRecorder:
+    """フレームを追記専用ファイルに書き出す
+
+    append() はキューに積むだけで戻り、書き込みは専用スレッドで行う。
+    フレームの形は最初のフレームで決まり、形の違うフレームは記録しない。
+    """
+
+    def __init__(self, path: str, channels: str = "bgr", features: Sequence[str] = AUDIO_FEATURES,
+                 queue_size: int = RECORD_QUEUE_SIZE):
+        self.path = path
+        self.channels = channels
+        self.features = tuple(features)
+        self.shape = None
+        self.dtype = None
+        self.recorded = 0
+        self.dropped = 0
+        self.bytes_total = 0
+        self._file = open(path, "wb")
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, name="frame-recorder", daemon=True)
+        self._thread.start()
+        print(f"⏺️  録画開始: {path}")
+
+    def append(self, frame: np.ndarray, sequence: int, timestamp: float, capture_time: Optional[float] = None,
+               features: Optional[dict] = None) -> None:
+        """フレームを録画キューに追加（書き込みが追いつかない場合は記録しない）
+
+        send_frame と同じく、呼び出し後に frame の内容を書き換えないこと。
+        """
+        try:
+            self._queue.put_nowait((frame, sequence, timestamp, capture_time, features))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_header(self, frame):
+        self.shape = tuple(frame.shape)
+        self.dtype = frame.dtype
+        metadata = json.dumps({
+            "shape": list(self.shape),
+            "dtype": self.dtype.str,
+            "channels": self.channels,
+            "features": list(self.features),
+            "created": time.time(),
+        }).encode("utf-8")
+        if HEADER.size + len(metadata) > DATA_OFFSET:
+            raise ValueError("録画のメタデータが大きすぎます")
+        header = HEADER.pack(MAGIC, RECORDING_VERSION, len(metadata)) + metadata
+        self._file.write(header.ljust(DATA_OFFSET, b"\0"))
+        self._record_header_size, _ = _record_layout(frame.nbytes, len(self.features))
+        self._frame_padding = b"\0" * (_align(frame.nbytes) - frame.nbytes)
+
+    def _write_record(self, frame, sequence, timestamp, capture_time, features):
+        if self.shape is None:
+            if frame.dtype.kind not in ALLOWED_DTYPE_KINDS:
+                raise ValueError(f"未対応のdtype: {frame.dtype}")
+            self._write_header(frame)
+        elif frame.shape != self.shape or frame.dtype != self.dtype:
+            self.dropped += 1
+            return
+
+        features = features or {}
+        values = np.array([features.get(name, np.nan) for name in self.features], dtype="<f4")
+        capture_time = np.nan if capture_time is None else capture_time
+        record_header = RECORD_FIXED.pack(sequence, timestamp, capture_time) + values.tobytes()
+        self._file.write(record_header.ljust(self._record_header_size, b"\0"))
+        # ビジュアライザのフレームは転置ビューなので連続な配列にしてから書く
+        self._file.write(np.ascontiguousarray(frame).data)
+        self._file.write(self._frame_padding)
+        self.recorded += 1
+        self.bytes_total += self._record_header_size + frame.nbytes + len(self._frame_padding)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write_record(*item)
+            except Exception as e:
+                print(f"❌ 録画の書き込みエラー: {e}")
+                break
+        self._file.close()
+
+    def close(self) -> None:
+        """キューに残ったフレームを書き終えてからファイルを閉じる"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        print(f"⏹️  録画終了: {self.path} ({self.recorded}フレーム, 未記録 {self.dropped}, "
+              f"{self.bytes_total / 1024 / 1024:.1f}MB)")
+
+
+class FrameRecording:
+    """録画ファイルを mmap で読む
+
+    recording[i] は RecordedFrame、recording.frames(start, stop) はフレームのビューの
+    リストを返す。timestamps / capture_times / features は全レコード分の列をまとめた
+    ビュー（コピーなし）。録画中のファイルを開いた場合、その時点までのレコードが見える。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < DATA_OFFSET:
+                raise ValueError(f"{path} は録画ファイルではありません（またはフレームがありません）")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, metadata_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != RECORDING_VERSION:
+            raise ValueError(f"{path} は録画ファイルではありません")
+        metadata = json.loads(bytes(self._mmap[HEADER.size:HEADER.size + metadata_size]).decode("utf-8"))
+        self.shape = tuple(metadata["shape"])
+        self.dtype = np.dtype(metadata["dtype"])
+        self.channels = metadata.get("channels", "bgr")
+        self.feature_names = tuple(metadata.get("features", ()))
+        frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._record_header_size, self._stride = _record_layout(frame_size, len(self.feature_names))
+        self._count = (size - DATA_OFFSET) // self._stride
+
+        count, stride = self._count, self._stride
+        self.sequences = np.ndarray((count,), dtype="<i8", buffer=self._mmap, offset=DATA_OFFSET, strides=(stride,))
+        self.timestamps = np.ndarray(
+            (count,), dtype="<f8", buffer=self._mmap, offset=DATA_OFFSET + 8, strides=(stride,)
+        )
+        self.capture_times = np.ndarray(
+            (count,), dtype="<f8", buffer=self._mmap, offset=DATA_OFFSET + 16, strides=(stride,)
+        )
+        self.features = np.ndarray(
+            (count, len(self.feature_names)), dtype="<f4", buffer=self._mmap,
+            offset=DATA_OFFSET + RECORD_FIXED.size, strides=(stride, 4),
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def duration(self) -> float:
+        """最初のフレームから最後のフレームまでの時間（秒）"""
+        return float(self.timestamps[-1] - self.timestamps[0]) if self._count > 1 else 0.0
+
+    def frame(self, index: int) -> np.ndarray:
+        """index 番目のフレーム（mmap への読み取り専用ビュー）"""
+        if not 0 <= index < self._count:
+            raise IndexError(f"frame index {index} out of range (0-{self._count - 1})")
+        offset = DATA_OFFSET + index * self._stride + self._record_header_size
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._mmap, offset=offset)
+
+    def frames(self, start: int = 0, stop: Optional[int] = None):
+        """start から stop 直前までのフレームのビュー"""
+        return [self.frame(index) for index in range(*slice(start, stop).indices(self._count))]
+
+    def __getitem__(self, index: int) -> RecordedFrame:
+        if index < 0:
+            index += self._count
+        frame = self.frame(index)
+        capture_time = float(self.capture_times[index])
+        return RecordedFrame(
+            sequence=int(self.sequences[index]),
+            timestamp=float(self.timestamps[index]),
+            capture_time=None if np.isnan(capture_time) else capture_time,
+            features=dict(zip(self.feature_names, self.features[index].tolist())),
+            frame=frame,
+        )
+
+    def close(self) -> None:
+        # ビューを先に解放する
+        self.sequences = self.timestamps = self.capture_times = self.features = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 呼び出し側（送信キューなど）がまだフレームのビューを保持している
+            pass
+
+    def __repr__(self):
+        return (f"FrameRecording({self.path}: {self._count}フレーム, {self.duration:.1f}秒, "
+                f"{self.shape} {self.dtype} {self.channels})")
+
+
+def load_frames(count: int, size: int, recording_path: Optional[str] = None) -> List[np.ndarray]:
+    """size x size の RGB uint8 フレームを count 枚用意する
+
+    録画があれば中央を切り抜いて縮小したフレーム（録画が短ければ繰り返す）、なければ
+    滑らかに動く合成画像（ノイズだけだと VAE の負荷や量子化の範囲が実際と変わるため）。
+    ベンチマークと int8 のキャリブレーションの入力に使う。
+    """
+    if recording_path:
+        layout = FrameLayout(crop_size=size * 2, size=size, channels="rgb")
+        recording = FrameRecording(recording_path)
+        try:
+            # 変換でコピーされるので mmap を閉じても残る
+            return [layout.apply(recording.frame(i % len(recording)), recording.channels) for i in range(count)]
+        finally:
+            recording.close()
+
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    frames = []
+    for i in range(count):
+        phase = i * 0.1
+        channels = [np.sin((x * (3 + c) + y * (2 + c)) * np.pi + phase * (c + 1)) for c in range(3)]
+        frames.append(((np.stack(channels, axis=-1) + 1) * 127.5).astype(np.uint8))
+    return frames
+
+
+class ReplaySource:
+    """録画を FrameSender で配信する（ビジュアライザの代わり）
+
+    speed=1.0 で録画時と同じ間隔、2.0 で2倍速、0 で待たずに送る。
+    送信するかどうかはビジュアライザと同じく FramePacer で決めるので、
+    on_request の場合は web_camera.py が要求した分だけ送られる（間引かれた
+    フレームも時間は進む）。capture_time は録画時の描画時刻との差を保ったまま
+    現在時刻に付け替えるため、web_camera.py 側のレイテンシ計測もそのまま使える。
+    """
+
+    def __init__(self, recording: FrameRecording, sender, speed: float = 1.0, loop: bool = False, pacer=None):
+        from .frame_transport import FramePacer
+
+        if len(recording) == 0:
+            raise ValueError(f"{recording.path} にはフレームがありません")
+        if sender.source_channels != recording.channels:
+            raise ValueError(
+                f"sender.source_channels ({sender.source_channels}) と録画のチャンネル順 "
+                f"({recording.channels}) が一致しません"
+            )
+        self.recording = recording
+        self.sender = sender
+        self.speed = speed
+        self.loop = loop
+        self.pacer = pacer or FramePacer(sender)
+        self.sent = 0
+        self.running = False
+
+    def _wait_until(self, index, started_at):
+        if self.speed <= 0:
+            return
+        offset = (self.recording.timestamps[index] - self.recording.timestamps[0]) / self.speed
+        delay = started_at + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self) -> None:
+        """録画を最後まで（loop=True なら止めるまで繰り返し）配信する"""
+        self.running = True
+        recording = self.recording
+        while self.running:
+            started_at = time.monotonic()
+            for index in range(len(recording)):
+                if not self.running:
+                    break
+                self._wait_until(index, started_at)
+                if not self.pacer.should_send():
+                    continue
+                capture_time = float(recording.capture_times[index])
+                if np.isnan(capture_time):
+                    capture_time = None
+                else:
+                    capture_time = time.time() - (float(recording.timestamps[index]) - capture_time)
+                self.sender.send_frame(recording.frame(index), capture_time)
+                self.pacer.mark_sent()
+                self.sent += 1
+            if not self.loop:
+                break
+        self.running = False
+
+    def stop(self) -> None:
+        self.running = False
+
+
+def _record(args):
+    """送信中のストリームに受信側として接続し、フル解像度のまま録画する（音声特徴量は記録されない）"""
+    from .frame_layout import FrameLayout
+    from .frame_transport import FrameReceiver
+
+    receiver = FrameReceiver(layout=FrameLayout(), flow_control=False)
+    receiver.connect_to_sender()
+    receiver.start_receiving()
+    recorder = FrameRecorder(args.path, channels="bgr")
+    deadline = time.monotonic() + args.seconds if args.seconds else None
+    last_frame_id = 0
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            received = receiver.wait_for_frame(last_frame_id, timeout=0.5)
+            if received is None:
+                continue
+            last_frame_id = received.frame_id
+            provenance = received.provenance
+            timestamp = dict(provenance.stages).get("render", time.time())
+            recorder.append(received.frame, provenance.sequence, timestamp, provenance.capture_time)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop_receiving()
+        recorder.close()
+
+
+def _replay(args):
+    from .frame_transport import FrameSender
+
+    recording = FrameRecording(args.path)
+    print(f"▶️  {recording}")
+    sender = FrameSender(source_channels=recording.channels)
+    sender.start_server()
+    source = ReplaySource(recording, sender, speed=args.speed, loop=args.loop)
+    started_at = time.monotonic()
+    try:
+        source.run()
+    except KeyboardInterrupt:
+        source.stop()
+    finally:
+        elapsed = time.monotonic() - started_at
+        print(f"⏹️  再生終了: 送信 {source.sent}フレーム / 間引き {source.pacer.skipped} ({elapsed:.1f}秒)")
+        sender.stop_server()
+        recording.close()
+
+
+def _info(args):
+    recording = FrameRecording(args.path)
+    print(recording)
+    if len(recording) > 1:
+        intervals = np.diff(recording.timestamps)
+        print(f"平均 {1.0 / intervals.mean():.1f} fps (フレーム間隔 p50 {np.median(intervals) * 1000:.1f}ms, "
+              f"最大 {intervals.max() * 1000:.1f}ms)")
+    if recording.feature_names and len(recording):
+        means = np.nanmean(recording.features, axis=0) if not np.isnan(recording.features).all() else None
+        if means is not None:
+            print("音声特徴量の平均: " + ", ".join(f"{n}={v:.3f}" for n, v in zip(recording.feature_names, means)))
+    recording.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フレームストリームの録画・再生")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="送信中のストリームを録画")
+    record.add_argument("path")
+    record.add_argument("--seconds", type=float, default=0, help="録画する秒数（0 で Ctrl+C まで）")
+    replay = commands.add_parser("replay", help="録画を FrameSender で配信")
+    replay.add_argument("path")
+    replay.add_argument("--speed", type=float, default=1.0, help="再生速度（0 で待たずに送る）")
+    replay.add_argument("--loop", action="store_true", help="最後まで送ったら最初から繰り返す")
+    info = commands.add_parser("info", help="録画の内容を表示")
+    info.add_argument("path")
+    args = parser.parse_args()
+    {"record": _record, "replay": _replay, "info": _info}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1004 @@
+"""
+ビジュアライザ（main_moon.py / main_mandala.py）と web_camera.py の間のフレーム転送
+
+送信側 FrameSender と受信側 FrameReceiver。ワイヤ形式は frame_protocol を参照。
+接続時に受信側が希望するエンコード（raw / jpeg / webp / png）とフレームの形
+（frame_layout: 切り抜き・解像度・チャンネル順・dtype）を送り、送信側が
+対応可能なものを選んで返す。
+
+ソケットの読み書き・ハートビート・再接続はプロセスで1つのイベントループ
+（event_loop）が担当し、接続ごとのスレッドは持たない。レイアウト変換と
+エンコードは送信側のワーカープールで、デコードはイベントループで行う。
+双方が取り決めた間隔でハートビートを送り合い、heartbeat_timeout の間に
+何も届かなければ相手が止まったとみなして切断する（受信側は指数バックオフ
+＋ジッターで再接続する）。
+
+受信側はフロー制御（network.flow_control）を有効にすると、欲しいフレーム数
+（クレジット）と処理レートを demand メッセージで送信側に伝える。送信側は
+クレジットがあるときだけ最新のフレームを送り、ビジュアライザは FramePacer で
+描画・送信をその要求に合わせて間引く。
+network.frame_transport が "shm" の場合は同一ホスト向けに共有メモリのリング
+（shm_ring）を使い、接続できない場合は TCP にフォールバックする。
+各フレームは音声取得・描画・送信の時刻を運び、受信側で FrameProvenance（latency）になる。
+"""
+import errno
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from config import config
+
+from .frame_codecs import ENCODING_NAMES, ENCODING_RAW, ENCODINGS, available_encodings, can_encode, encode_frame
+from .frame_layout import FrameLayout
+from .event_loop import EVENT_READ, EVENT_WRITE, get_event_loop
+from .frame_protocol import (
+    MSG_CONTROL,
+    MSG_FRAME,
+    FrameParser,
+    ProtocolError,
+    as_views,
+    control_buffers,
+    encoded_frame_buffers,
+    frame_buffers,
+    heartbeat_buffers,
+    pickled_frame_buffers,
+    send_some,
+)
+from .latency import FrameProvenance
+from .latest_queue import LatestQueue
+from .shm_ring import SharedFrameRing
+
+# TCP設定
+FRAME_HOST = config.host
+FRAME_PORT = config.frame_port
+# "raw": バイナリプロトコル / "pickle": 旧形式（レガシー）
+FRAME_PROTOCOL = config.frame_protocol
+# "tcp": ソケット転送 / "shm": 共有メモリ（TCPはフォールバック）
+FRAME_TRANSPORT = config.frame_transport
+SHM_NAME = config.shm_name
+SHM_SLOTS = config.shm_slots
+# 共有メモリの新フレーム確認間隔（秒）
+SHM_POLL_INTERVAL = 0.002
+# クライアントごとの送信キュー長（超えた分は古いフレームから破棄）
+CLIENT_QUEUE_SIZE = config.client_queue_size
+MAX_PENDING_CONNECTIONS = 8
+# 受信側が希望するエンコードと品質（jpeg/webp: 1-100, webpは101で可逆）
+FRAME_ENCODING = config.frame_encoding
+FRAME_QUALITY = config.frame_quality
+ENCODE_WORKERS = config.encode_workers
+# 接続直後に受信側のエンコード希望を待つ時間（秒）。届かなければ raw で送る
+HANDSHAKE_TIMEOUT = 1.0
+# 複数クライアントで同じエンコード結果を共有するために保持するフレーム数
+ENCODE_CACHE_SIZE = 8
+# ハートビートの送信間隔と、何も届かなければ切断するまでの時間（秒）
+HEARTBEAT_INTERVAL = config.heartbeat_interval
+HEARTBEAT_TIMEOUT = config.heartbeat_timeout
+# 送受信バッファのサイズ（バイト）。0 で OS の既定値
+SOCKET_BUFFER_SIZE = config.socket_buffer_size
+CONNECT_TIMEOUT = 2.0
+# 再接続の待ち時間は RECONNECT_BASE_DELAY から倍々で RECONNECT_MAX_DELAY まで伸ばす
+RECONNECT_BASE_DELAY = 0.05
+RECONNECT_MAX_DELAY = config.reconnect_max_delay
+# 受信側がクレジットで送信数を制御するか、接続直後に要求するフレーム数
+FLOW_CONTROL = config.flow_control
+INITIAL_CREDITS = 1
+# ビジュアライザの送信ペース（FramePacer を参照）
+SEND_MODES = ("always", "throttle", "on_request")
+SEND_MODE = config.send_mode
+
+
+def configured_layout():
+    """config の network.frame_layout に従った受信側レイアウト（"full" の場合は None）
+
+    "sd" の場合は web_camera.py の前処理（中央を SD_SIDE_LENGTH*2 で切り抜き、
+    SD_SIDE_LENGTH に NEAREST 縮小、RGB）を送信側で済ませる。
+    """
+    if config.frame_layout != "sd":
+        return None
+    side = config.sd_side_length
+    return FrameLayout(crop_size=side * 2, size=side, channels="rgb", dtype=config.frame_dtype)
+
+
+class ReceivedFrame(NamedTuple):
+    """FrameReceiver.wait_for_frame の戻り値"""
+    frame_id: int
+    frame: object
+    provenance: FrameProvenance
+
+
+def configure_socket(sock):
+    """フレーム転送用のソケット設定（Nagle無効化・送受信バッファ拡大）"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if SOCKET_BUFFER_SIZE > 0:
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+            except OSError:
+                pass  # 上限を超える場合は OS の既定値のまま
+
+
+def heartbeat_timeout(interval):
+    """ハートビート間隔に対する切断判定の時間（間隔の3回分より短くしない）"""
+    return max(HEARTBEAT_TIMEOUT, interval * 3)
+
+
+def _prepare_frame(frame_array, layout, source_channels, protocol, encoding, quality):
+    """送信するフレームを作る（レイアウト変換・エンコード）。ワーカープールで実行する
+
+    (変換後のフレーム, 実際のエンコード, ペイロード, エンコード時間[秒]) を返す。
+    ペイロードは raw なら None、pickle なら送信バッファのリスト。
+    """
+    frame_array = layout.apply(frame_array, source_channels)
+    if protocol == "pickle":
+        return frame_array, ENCODING_RAW, pickled_frame_buffers(frame_array), 0.0
+    if encoding != ENCODING_RAW and can_encode(frame_array):
+        payload, encode_time = encode_frame(frame_array, encoding, quality)
+        return frame_array, encoding, payload, encode_time
+    return frame_array, ENCODING_RAW, None, 0.0
+
+
+class _Connection:
+    """イベントループ上のノンブロッキング接続（送信キューとハートビートの共通部分）
+
+    メソッドはすべてイベントループのスレッドから呼ぶ。
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.sock = None
+        self.parser = None
+        self.heartbeat_interval = None
+        self.last_received = time.monotonic()
+        self._outgoing = []
+        self._events = 0
+        self._heartbeat_timer = None
+
+    def _set_events(self, events):
+        if events != self._events:
+            self.loop.modify(self.sock, events, self._on_event)
+            self._events = events
+
+    def _send_buffers(self, buffers):
+        """送信バッファを送信待ちの末尾に追加して送れるだけ送る"""
+        self._outgoing.extend(as_views(buffers))
+        self._flush()
+
+    def _flush(self):
+        try:
+            done = send_some(self.sock, self._outgoing)
+        except OSError as e:
+            self._on_connection_lost(f"送信エラー: {e}")
+            return
+        if done:
+            self._set_events(EVENT_READ)
+            self._on_drained()
+        else:
+            # 送信バッファが空くのを待つ
+            self._set_events(EVENT_READ | EVENT_WRITE)
+
+    def _on_event(self, mask):
+        if mask & EVENT_WRITE:
+            self._flush()
+        if mask & EVENT_READ and self.sock is not None:
+            self._read()
+
+    def _read(self):
+        """読めるだけ読み、完成したメッセージを処理"""
+        while self.sock is not None:
+            try:
+                count = self.sock.recv_into(self.parser.next_buffer())
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self._on_connection_lost(f"受信エラー: {e}")
+                return
+            if count == 0:
+                self._on_connection_lost("接続が閉じられました")
+                return
+            self.last_received = time.monotonic()
+            try:
+                message = self.parser.advance(count)
+            except ProtocolError as e:
+                self._on_connection_lost(str(e))
+                return
+            if message is not None:
+                self._on_message(*message)
+
+    def _start_heartbeat(self, interval):
+        self.heartbeat_interval = interval
+        self.last_received = time.monotonic()
+        if self._heartbeat_timer is not None:
+            self._heartbeat_timer.cancel()
+        self._heartbeat_timer = self.loop.call_later(interval, self._heartbeat)
+
+    def _heartbeat(self):
+        """相手からの受信が途絶えていないか確認し、送信待ちがなければハートビートを送る"""
+        self._heartbeat_timer = None
+        if self.sock is None:
+            return
+        silence = time.monotonic() - self.last_received
+        if silence > heartbeat_timeout(self.heartbeat_interval):
+            self._on_connection_lost(f"ハートビートが {silence * 1000:.0f}ms 途絶えました")
+            return
+        if not self._outgoing:
+            # フレーム送信中は送信データそのものが生存確認になる
+            self._send_buffers(heartbeat_buffers())
+        if self.sock is not None:
+            self._heartbeat_timer = self.loop.call_later(self.heartbeat_interval, self._heartbeat)
+
+    def _close_socket(self):
+        if self._heartbeat_timer is not None:
+            self._heartbeat_timer.cancel()
+            self._heartbeat_timer = None
+        if self.sock is not None:
+            self.loop.unregister(self.sock)
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+        self._outgoing = []
+        self._events = 0
+
+    def _on_drained(self):
+        """送信待ちをすべて送り終えた"""
+
+    def _on_message(self, msg_type, value):
+        """メッセージを受信した"""
+
+    def _on_connection_lost(self, reason):
+        """切断・エラー・ハートビート途絶"""
+
+
+class _ClientConnection(_Connection):
+    """1クライアント分の送信状態
+
+    描画スレッドは post() でフレームの参照をキューに入れるだけで戻る。
+    イベントループは送信中のフレームがなければキューから取り出し、
+    レイアウト変換・エンコードをワーカープールに任せ、出来上がったものを
+    ノンブロッキングで送る。送信が追いつかない場合は古いフレームを破棄する。
+    """
+
+    def __init__(self, conn, addr, sender):
+        super().__init__(sender.loop)
+        self.sock = conn
+        self.addr = addr
+        self.sender = sender
+        self.protocol = sender.protocol
+        self.queue = LatestQueue(sender.client_queue_size)
+        self.encoding = ENCODING_RAW
+        self.quality = FRAME_QUALITY
+        # 受信側の指定がなければ従来通りフル解像度のBGR
+        self.layout = FrameLayout()
+        self.parser = FrameParser()
+        # pickle（旧形式）の受信側は何も送ってこないので取り決めを待たない
+        self.negotiated = self.protocol == "pickle"
+        self.closed = False
+        # 受信側が要求しているフレーム数（None はフロー制御なし）と処理レート
+        self.credits = None
+        self.demand_rate = None
+        self._preparing = False
+        self._sending_size = None
+        self.sent = 0
+        self.bytes_total = 0
+        self.encode_time_total = 0.0
+
+        configure_socket(conn)
+        conn.setblocking(False)
+        self.loop.register(conn, EVENT_READ, self._on_event)
+        self._events = EVENT_READ
+        self._handshake_timer = None
+        if not self.negotiated:
+            self._handshake_timer = self.loop.call_later(HANDSHAKE_TIMEOUT, self._on_handshake_timeout)
+
+    def post(self, frame_array, sequence, timestamp, capture_time=None):
+        """送信キューにフレームを追加（満杯なら最も古いフレームを破棄）。どのスレッドからでも呼べる"""
+        self.queue.put((frame_array, sequence, timestamp, capture_time))
+
+    def _on_handshake_timeout(self):
+        self._handshake_timer = None
+        print(f"⚠️ エンコード希望が届かないため raw で送信します: {self.addr}")
+        self.negotiated = True
+        self.pump()
+
+    def _negotiate(self, hello):
+        """受信側のエンコード・レイアウト・ハートビートの希望から使うものを決めて返答"""
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
+            self._handshake_timer = None
+
+        supported = available_encodings()
+        requested = [name for name in hello.get("encodings", []) if name in supported]
+        name = requested[0] if requested else "raw"
+        self.encoding = ENCODINGS[name]
+        self.quality = max(1, min(101, int(hello.get("quality", FRAME_QUALITY))))
+        if hello.get("layout"):
+            try:
+                self.layout = FrameLayout.from_dict(hello["layout"])
+            except (TypeError, ValueError) as e:
+                print(f"⚠️ 不正なレイアウト指定のためフル解像度で送信します ({self.addr}): {e}")
+        accept = {
+            "type": "accept",
+            "encoding": name,
+            "quality": self.quality,
+            "layout": self.layout.to_dict(),
+        }
+        if hello.get("credits") is not None:
+            self.credits = max(0, int(hello["credits"]))
+        if hello.get("heartbeat_interval"):
+            # 受信側が希望した場合のみハートビートを送り合う（旧受信側は送ってこない）
+            interval = max(0.01, float(hello["heartbeat_interval"]))
+            accept["heartbeat_interval"] = interval
+            self._start_heartbeat(interval)
+        self._send_buffers(control_buffers(accept))
+        print(f"🗜️  エンコード決定 ({self.addr}): {name} (quality={self.quality}), {self.layout}")
+        self.negotiated = True
+        self.pump()
+
+    def wants_frame(self):
+        """今フレームを渡せば送られるか（フロー制御なし、またはキュー待ちを上回るクレジットがある）"""
+        credits = self.credits
+        return credits is None or credits > len(self.queue)
+
+    def _on_demand(self, message):
+        """受信側からのクレジット追加・処理レートの通知"""
+        credits = max(0, int(message.get("credits", 0)))
+        self.credits = credits if self.credits is None else self.credits + credits
+        if message.get("rate") is not None:
+            self.demand_rate = max(0.0, float(message["rate"]))
+        self.pump()
+
+    def pump(self):
+        """送信中のフレームがなければキューから次のフレームを取り出して送信を始める"""
+        if self.closed or not self.negotiated or self._outgoing or self._preparing:
+            return
+        if self.credits is None:
+            item = self.queue.get(timeout=0)
+        elif self.credits > 0:
+            # クレジットを待つ間に溜まったフレームは古いので最新だけ送る
+            item = self.queue.take_latest()
+        else:
+            return
+        if item is None:
+            return
+        if self.credits is not None:
+            self.credits -= 1
+        frame_array, sequence, timestamp, capture_time = item
+        if self.protocol != "pickle" and self.encoding == ENCODING_RAW and self.layout.is_passthrough:
+            # 並べ替えだけならビューで済むのでワーカーに渡さない
+            prepared = (self.layout.apply(frame_array, self.sender.source_channels), ENCODING_RAW, None, 0.0)
+            self._start_frame(prepared, sequence, timestamp, capture_time)
+            return
+
+        self._preparing = True
+        future = self.sender.prepare(frame_array, sequence, self.layout, self.protocol, self.encoding, self.quality)
+        future.add_done_callback(
+            lambda done: self.loop.call_soon(self._on_prepared, done, sequence, timestamp, capture_time)
+        )
+
+    def _on_prepared(self, future, sequence, timestamp, capture_time):
+        self._preparing = False
+        if self.closed:
+            return
+        try:
+            prepared = future.result()
+        except Exception as e:
+            self.close(f"フレーム変換エラー: {e}")
+            return
+        self._start_frame(prepared, sequence, timestamp, capture_time)
+
+    def _start_frame(self, prepared, sequence, timestamp, capture_time):
+        frame_array, encoding, payload, encode_time = prepared
+        if self.protocol == "pickle":
+            buffers = payload
+        elif encoding != ENCODING_RAW:
+            buffers = encoded_frame_buffers(frame_array, payload, encoding, sequence, timestamp, capture_time)
+        else:
+            # 配列のメモリをそのまま送信（ヘッダに shape/dtype/strides を含む）
+            buffers = frame_buffers(frame_array, sequence, timestamp, capture_time)
+        self.encode_time_total += encode_time
+        self._sending_size = len(memoryview(buffers[1]).cast("B"))
+        self._send_buffers(buffers)
+
+    def _on_drained(self):
+        if self._sending_size is not None:
+            self.sent += 1
+            self.bytes_total += self._sending_size
+            self._sending_size = None
+        self.pump()
+
+    def _on_message(self, msg_type, value):
+        if msg_type == MSG_CONTROL and value.get("type") == "hello":
+            self._negotiate(value)
+        elif msg_type == MSG_CONTROL and value.get("type") == "demand":
+            self._on_demand(value)
+        elif msg_type == MSG_FRAME:
+            self.close("受信側からフレームが届きました")
+
+    def _on_connection_lost(self, reason):
+        self.close(reason)
+
+    def stats(self):
+        """送信統計"""
+        sent = max(1, self.sent)
+        return {
+            "address": f"{self.addr[0]}:{self.addr[1]}",
+            "encoding": ENCODING_NAMES[self.encoding],
+            "sent": self.sent,
+            "dropped": self.queue.dropped,
+            "queued": len(self.queue),
+            "credits": self.credits,
+            "bytes_per_frame": self.bytes_total / sent,
+            "encode_ms": self.encode_time_total / sent * 1000,
+        }
+
+    def close(self, reason=None):
+        """接続を閉じる（イベントループのスレッドから呼ぶ）"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
+        self._close_socket()
+        self.queue.close()
+        self.sender._remove_client(self, reason)
+
+
+# フレーム送信クラス（複数クライアント・再接続対応）
+class FrameSender:
+    def __init__(self, host=FRAME_HOST, port=FRAME_PORT, protocol=FRAME_PROTOCOL, transport=FRAME_TRANSPORT,
+                 shm_name=SHM_NAME, shm_slots=SHM_SLOTS, client_queue_size=CLIENT_QUEUE_SIZE, source_channels="bgr"):
+        """source_channels は send_frame に渡すフレームのチャンネル順（pygame の画面なら "rgb"）"""
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.transport = transport
+        self.shm_name = shm_name
+        self.shm_slots = shm_slots
+        self.client_queue_size = client_queue_size
+        self.source_channels = source_channels
+        # 共有メモリには受信側と同じ config から決まるレイアウトで書き込む
+        self.shm_layout = configured_layout() or FrameLayout()
+        self.loop = get_event_loop()
+        self.ring = None
+        self.server_socket = None
+        self.clients = []
+        self.clients_lock = threading.Lock()
+        self.encode_pool = None
+        self._prepared = {}
+        self._prepare_lock = threading.Lock()
+        self.running = False
+        self.sequence = 0
+        self.recorder = None
+
+    def start_server(self):
+        """フレーム送信サーバーを開始（接続の受け付けはイベントループで行う）"""
+        self.running = True
+        print(f"🖼️  フレーム送信サーバー開始: {self.host}:{self.port} ({self.protocol}, {self.transport})")
+        try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # 受信バッファは listen 前に設定しないと受け付けた接続に反映されない
+            configure_socket(self.server_socket)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(MAX_PENDING_CONNECTIONS)
+            self.server_socket.setblocking(False)
+        except Exception as e:
+            print(f"❌ サーバー初期化エラー: {e}")
+            return
+        self.loop.call_soon(self.loop.register, self.server_socket, EVENT_READ, self._on_accept)
+        print(f"🔗 フレーム受信待機中: {self.host}:{self.port}")
+
+    def _on_accept(self, mask):
+        """接続を受け付ける（イベントループのスレッド）"""
+        while self.running:
+            try:
+                conn, addr = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"❌ 接続エラー: {e}")
+                return
+            print(f"✨ クライアント接続: {addr}")
+            client = _ClientConnection(conn, addr, self)
+            with self.clients_lock:
+                self.clients.append(client)
+
+    def prepare(self, frame_array, sequence, layout, protocol, encoding, quality):
+        """送信するフレームをワーカープールで作る（同じフレーム・設定の結果はクライアント間で共有）
+
+        concurrent.futures.Future を返す（結果は _prepare_frame を参照）。
+        """
+        key = (sequence, layout.key, protocol, encoding, quality)
+        with self._prepare_lock:
+            future = self._prepared.get(key)
+            if future is None:
+                if self.encode_pool is None:
+                    self.encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="frame-encode")
+                future = self.encode_pool.submit(
+                    _prepare_frame, frame_array, layout, self.source_channels, protocol, encoding, quality
+                )
+                self._prepared[key] = future
+                while len(self._prepared) > ENCODE_CACHE_SIZE:
+                    self._prepared.pop(next(iter(self._prepared)))
+        return future
+
+    def _remove_client(self, client, reason=None):
+        """切断されたクライアントを一覧から外す"""
+        with self.clients_lock:
+            if client not in self.clients:
+                return
+            self.clients.remove(client)
+        stats = client.stats()
+        reason = f" - {reason}" if reason else ""
+        print(f"🔌 クライアント切断: {stats['address']} (送信 {stats['sent']} / 破棄 {stats['dropped']}, "
+              f"{stats['encoding']} {stats['bytes_per_frame'] / 1024:.0f}KB/フレーム, "
+              f"エンコード {stats['encode_ms']:.1f}ms){reason}")
+
+    def _write_shared(self, frame_array, timestamp, capture_time):
+        """共有メモリのリングへ書き込み（形状が変わった場合はリングを作り直す）"""
+        try:
+            frame_array = self.shm_layout.apply(frame_array, self.source_channels)
+            if self.ring is not None and (self.ring.shape != frame_array.shape or self.ring.dtype != frame_array.dtype):
+                self.ring.close()
+                self.ring = None
+            if self.ring is None:
+                self.ring = SharedFrameRing.create(self.shm_name, frame_array.shape, frame_array.dtype, self.shm_slots)
+                print(f"🧠 共有メモリ転送開始: {self.shm_name} ({self.shm_slots}スロット)")
+            self.ring.write(frame_array, timestamp, capture_time)
+        except Exception as e:
+            print(f"❌ 共有メモリ書き込みエラー: {e}")
+            print("🔄 TCP転送のみで継続します")
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+            self.transport = "tcp"
+
+    def start_recording(self, path):
+        """送信するフレームを音声特徴量と一緒にファイルへ録画する（frame_recorder を参照）"""
+        from .frame_recorder import FrameRecorder
+
+        self.stop_recording()
+        self.recorder = FrameRecorder(path, channels=self.source_channels)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
+
+    def send_frame(self, frame_array, capture_time=None, audio_features=None):
+        """フレームを全クライアントの送信キューに追加（ブロックしない）
+
+        capture_time はこのフレームの元になった音声チャンクの取得時刻（time.time()）。
+        audio_features（{"volume", "bass", "mid", "high"}）は録画中のみ記録される。
+        送信はイベントループとワーカープールで行われるため、呼び出し後に
+        frame_array の内容を書き換えないこと。
+        """
+        self.sequence += 1
+        timestamp = time.time()
+        if self.recorder is not None:
+            self.recorder.append(frame_array, self.sequence, timestamp, capture_time, audio_features)
+        if self.transport == "shm":
+            self._write_shared(frame_array, timestamp, capture_time)
+
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.post(frame_array, self.sequence, timestamp, capture_time)
+        if clients:
+            self.loop.call_soon(self._pump_clients)
+
+    def _pump_clients(self):
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.pump()
+
+    def wants_frame(self):
+        """今フレームを送れば使われるか
+
+        フロー制御していないクライアントがいるか、クレジットの残っている
+        クライアントがいれば True。共有メモリ転送では要求が届かないため、
+        録画中は全フレームを記録するため常に True。
+        """
+        if self.transport == "shm" or self.recorder is not None:
+            return True
+        with self.clients_lock:
+            clients = list(self.clients)
+        return any(client.wants_frame() for client in clients)
+
+    def demand_rate(self):
+        """クライアントが伝えてきた処理レートの最大値
+
+        フロー制御していないクライアント・レート未通知のクライアントがいる場合
+        （または共有メモリ転送・録画中）は None（制限なし）、クライアントがいなければ 0。
+        """
+        if self.transport == "shm" or self.recorder is not None:
+            return None
+        with self.clients_lock:
+            clients = list(self.clients)
+        rates = [client.demand_rate for client in clients]
+        if any(rate is None for rate in rates):
+            return None
+        return max(rates, default=0.0)
+
+    def get_client_stats(self):
+        """クライアントごとの送信統計（送信数・破棄数・キュー滞留数・クレジット）"""
+        with self.clients_lock:
+            return [client.stats() for client in self.clients]
+
+    def _close_sockets(self):
+        if self.server_socket:
+            self.loop.unregister(self.server_socket)
+            try:
+                self.server_socket.close()
+            except OSError:
+                pass
+            self.server_socket = None
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close("サーバー停止")
+
+    def stop_server(self):
+        """サーバー停止"""
+        self.running = False
+        self.stop_recording()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        self.loop.run_sync(self._close_sockets)
+        if self.encode_pool is not None:
+            self.encode_pool.shutdown(wait=False)
+
+
+class FramePacer:
+    """ビジュアライザがフレームを送るかどうかを決める
+
+    mode:
+        "always"      毎フレーム送信する（従来通り）
+        "throttle"    受信側が伝えてきた処理レートを超えて送らない
+        "on_request"  受信側がクレジットで要求しているときだけ送る
+
+    送らないフレームは画面のキャプチャ・変換・送信を省ける。プレビューを
+    表示しない場合は描画そのものも省ける。
+    """
+
+    def __init__(self, sender, mode=SEND_MODE):
+        if mode not in SEND_MODES:
+            raise ValueError(f"mode must be one of {SEND_MODES}, got {mode}")
+        self.sender = sender
+        self.mode = mode
+        self.last_sent = 0.0
+        self.skipped = 0
+
+    def should_send(self):
+        """このフレームを送るべきか"""
+        if self.mode == "always":
+            send = True
+        elif self.mode == "on_request":
+            send = self.sender.wants_frame()
+        else:
+            rate = self.sender.demand_rate()
+            if rate is None:
+                send = True
+            else:
+                send = rate > 0 and time.monotonic() - self.last_sent >= 1.0 / rate
+        if not send:
+            self.skipped += 1
+        return send
+
+    def mark_sent(self):
+        """フレームを送った"""
+        self.last_sent = time.monotonic()
+
+
+# フレーム受信クラス（再接続対応）
+class FrameReceiver(_Connection):
+    def __init__(self, host=FRAME_HOST, port=FRAME_PORT, protocol=FRAME_PROTOCOL, transport=FRAME_TRANSPORT,
+                 shm_name=SHM_NAME, encoding=FRAME_ENCODING, quality=FRAME_QUALITY, layout=None,
+                 flow_control=FLOW_CONTROL):
+        """layout を省略すると config の network.frame_layout に従う
+
+        flow_control が True の場合、接続直後に INITIAL_CREDITS フレームだけ要求し、
+        以降は request_frames() で要求した数だけフレームが届く。
+        """
+        super().__init__(get_event_loop())
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.transport = transport
+        self.shm_name = shm_name
+        self.requested_encoding = encoding
+        self.quality = quality
+        self.encoding = "raw"
+        self.requested_layout = configured_layout() if layout is None else layout
+        self.flow_control = flow_control
+        # 受信中のフレームのレイアウト（None は送信側そのままのフル解像度BGR）
+        self.layout = None
+        self.ring = None
+        self.latest_frame = None
+        self.latest_header = None
+        # (frame, header, 受信時刻) を1つの参照で差し替え、フレームと来歴を食い違わせない
+        self._latest = (None, None, None)
+        # 受信したフレームの通し番号（再接続・送信側の再起動をまたいで単調増加）
+        self.frame_id = 0
+        self._frame_condition = threading.Condition()
+        self.running = False
+        self.connected = False
+        self._connect_done = threading.Event()
+        self._connect_timer = None
+        self._reconnect_timer = None
+        self._reconnect_attempts = 0
+        self._shm_timer = None
+        self._last_shared_sequence = 0
+
+    @property
+    def socket(self):
+        return self.sock
+
+    def connect_to_sender(self):
+        """フレーム送信元に接続（初回のみ。以降の再接続はイベントループが行う）"""
+        if self._try_attach_shared():
+            return True
+        self._connect_done.clear()
+        self.loop.call_soon(self._connect)
+        self._connect_done.wait(CONNECT_TIMEOUT + 1.0)
+        return self.connected
+
+    def _try_attach_shared(self):
+        """共有メモリのリングへの接続を試行（shmモード時のみ）"""
+        if self.transport != "shm":
+            return False
+        try:
+            ring = SharedFrameRing.attach(self.shm_name)
+        except (FileNotFoundError, ValueError):
+            return False
+        if ring.closed:
+            ring.close()
+            return False
+        self.ring = ring
+        self.layout = self.requested_layout
+        self._last_shared_sequence = 0
+        print(f"✨ 共有メモリに接続成功: {self.shm_name}")
+        return True
+
+    def _connect(self):
+        """ノンブロッキングで接続を開始（イベントループのスレッド）"""
+        self._close_socket()
+        try:
+            self.sock = sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # 受信バッファは接続前に設定しないとウィンドウサイズに反映されない
+            configure_socket(sock)
+            sock.setblocking(False)
+            error = sock.connect_ex((self.host, self.port))
+        except OSError as e:
+            self._on_connect_failed(str(e))
+            return
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+            self._on_connect_failed(os.strerror(error))
+            return
+        self.loop.register(sock, EVENT_WRITE, self._on_connect_ready)
+        self._events = EVENT_WRITE
+        self._connect_timer = self.loop.call_later(CONNECT_TIMEOUT, self._on_connect_failed, "タイムアウト")
+
+    def _on_connect_ready(self, mask):
+        if self._connect_timer is not None:
+            self._connect_timer.cancel()
+            self._connect_timer = None
+        error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            self._on_connect_failed(os.strerror(error))
+            return
+
+        # pickleは信頼できる送信元との旧形式互換のためだけに許可する
+        self.parser = FrameParser(allow_pickle=self.protocol == "pickle")
+        self.last_received = time.monotonic()
+        self.loop.modify(self.sock, EVENT_READ, self._on_event)
+        self._events = EVENT_READ
+        self.connected = True
+        print(f"✨ {'再接続成功' if self._reconnect_attempts else 'main_moon.pyに接続成功'}: {self.host}:{self.port}")
+        self._reconnect_attempts = 0
+        self._connect_done.set()
+        if self.protocol != "pickle":
+            self._send_hello()
+
+    def _on_connect_failed(self, reason):
+        self._connect_timer = None
+        self._close_socket()
+        self.connected = False
+        if not self._reconnect_attempts:
+            print(f"❌ main_moon.pyへの接続失敗: {reason}")
+        self._connect_done.set()
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        """指数バックオフ＋ジッターで再接続を予約（受信中のみ）"""
+        if not self.running or self._reconnect_timer is not None:
+            return
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self._reconnect_attempts)
+        # 複数の受信側が同時に再接続しないよう待ち時間をばらつかせる
+        delay *= random.uniform(0.5, 1.0)
+        if not self._reconnect_attempts:
+            print("🔄 main_moon.pyへの再接続を試行中...")
+        self._reconnect_attempts += 1
+        self._reconnect_timer = self.loop.call_later(delay, self._reconnect)
+
+    def _reconnect(self):
+        self._reconnect_timer = None
+        if not self.running:
+            return
+        if self._try_attach_shared():
+            self._reconnect_attempts = 0
+            self._poll_shared()
+            return
+        self._connect()
+
+    def _send_hello(self):
+        """希望するエンコード・レイアウト・ハートビート間隔を送信側に伝える（デコードできないものは除外し、最後に raw）"""
+        supported = available_encodings()
+        encodings = [name for name in (self.requested_encoding, "raw") if name in supported]
+        self.encoding = "raw"
+        self.layout = None
+        hello = {
+            "type": "hello",
+            "encodings": encodings,
+            "quality": self.quality,
+            "heartbeat_interval": HEARTBEAT_INTERVAL,
+        }
+        if self.requested_layout is not None:
+            hello["layout"] = self.requested_layout.to_dict()
+        if self.flow_control:
+            hello["credits"] = INITIAL_CREDITS
+        self._send_buffers(control_buffers(hello))
+
+    def request_frames(self, count=1, rate=None):
+        """送信側に count フレームを追加で要求し、処理レート（fps）を伝える（どのスレッドからでも呼べる）
+
+        フロー制御しない場合と共有メモリ転送では何もしない。
+        """
+        if self.flow_control and self.protocol != "pickle":
+            self.loop.call_soon(self._send_demand, count, rate)
+
+    def _send_demand(self, count, rate):
+        if self.sock is None or not self.connected:
+            return  # 再接続時の hello で改めて要求する
+        message = {"type": "demand", "credits": count}
+        if rate:
+            message["rate"] = rate
+        self._send_buffers(control_buffers(message))
+
+    def _handle_control(self, message):
+        """送信側からの制御メッセージを処理"""
+        if message.get("type") == "accept":
+            self.encoding = message.get("encoding", "raw")
+            layout = FrameLayout.from_dict(message["layout"]) if message.get("layout") else None
+            self.layout = None if layout is None or (layout.is_passthrough and layout.channels == "bgr") else layout
+            if message.get("heartbeat_interval"):
+                self._start_heartbeat(float(message["heartbeat_interval"]))
+            print(f"🗜️  フレームエンコード: {self.encoding} (quality={message.get('quality')}), {self.layout}")
+
+    def _on_message(self, msg_type, value):
+        if msg_type == MSG_FRAME:
+            frame_array, header = value
+            if header.encoding == ENCODING_RAW and self.protocol != "pickle":
+                # 生フレームはパーサの受信バッファへのビューで、buffer_count - 1 フレーム後に
+                # 上書きされる。パイプラインが保持している間に変わらないようコピーして公開する
+                frame_array = frame_array.copy()
+            self._set_latest(frame_array, header)
+        elif msg_type == MSG_CONTROL:
+            self._handle_control(value)
+
+    def _on_connection_lost(self, reason):
+        print(f"❌ フレーム受信エラー: {reason}")
+        print("🔌 接続が切断されました。再接続を試行します...")
+        self._close_socket()
+        self.connected = False
+        self._schedule_reconnect()
+
+    def start_receiving(self):
+        """フレーム受信開始（受信・再接続はイベントループで行う）"""
+        self.running = True
+        self.loop.call_soon(self._start)
+        return True
+
+    def _start(self):
+        if self.ring is not None:
+            self._poll_shared()
+        elif not self.connected:
+            self._schedule_reconnect()
+
+    def _poll_shared(self):
+        """共有メモリの最新スロットを確認（送信側がリングを閉じるまで SHM_POLL_INTERVAL ごと）"""
+        self._shm_timer = None
+        if not self.running or self.ring is None:
+            return
+        try:
+            if self.ring.closed:
+                print("🔌 共有メモリが閉じられました。再接続を試行します...")
+                raise EOFError
+            # 共有メモリはクレジットと無関係に上書きされるため、スロットへのビューではなくコピーを渡す
+            frame_array, header = self.ring.read_latest(copy=True)
+        except Exception as e:
+            if not isinstance(e, EOFError):
+                print(f"❌ 共有メモリ受信エラー: {e}")
+            self.ring.close()
+            self.ring = None
+            self._schedule_reconnect()
+            return
+        if header is not None and header.sequence != self._last_shared_sequence:
+            self._last_shared_sequence = header.sequence
+            self._set_latest(frame_array, header)
+        self._shm_timer = self.loop.call_later(SHM_POLL_INTERVAL, self._poll_shared)
+
+    def _set_latest(self, frame_array, header):
+        """受信したフレームを最新として公開し、wait_for_frame の待機を起こす
+
+        frame_array は受信バッファ・共有メモリから切り離されたものであること。
+        """
+        with self._frame_condition:
+            self.frame_id += 1
+            self._latest = (frame_array, header, time.time())
+            self.latest_header = header
+            self.latest_frame = frame_array
+            self._frame_condition.notify_all()
+
+    def get_stats(self):
+        """受信統計（エンコード形式・1フレームあたりのバイト数・デコード時間）"""
+        if self.ring is not None or self.parser is None:
+            return {"encoding": "shm" if self.ring is not None else self.encoding}
+        frames = max(1, self.parser.frames)
+        return {
+            "encoding": self.encoding,
+            "frames": self.parser.frames,
+            "bytes_per_frame": self.parser.bytes_total / frames,
+            "decode_ms": self.parser.decode_time_total / frames * 1000,
+        }
+
+    def get_latest_frame(self):
+        """最新フレームを取得（受信バッファから切り離されたコピー）"""
+        return self.latest_frame
+
+    def get_latest_frame_with_provenance(self):
+        """最新フレームとその来歴（音声取得・描画・送信・受信の時刻）を取得（未受信なら (None, None)）"""
+        frame_array, header, received_at = self._latest
+        if frame_array is None:
+            return None, None
+        return frame_array, FrameProvenance.from_header(header, received_at)
+
+    def wait_for_frame(self, after_id: int = 0, timeout: Optional[float] = None) -> Optional[ReceivedFrame]:
+        """frame_id が after_id より新しいフレームが届くまで待つ
+
+        タイムアウトした場合と stop_receiving() された場合は None を返す。
+        処理済みのフレームの frame_id を after_id に渡せば、同じフレームを
+        二度処理せず、ポーリングもせずに次のフレームを待てる。
+        """
+        with self._frame_condition:
+            self._frame_condition.wait_for(lambda: self.frame_id > after_id or not self.running, timeout)
+            if self.frame_id <= after_id:
+                return None
+            frame_id = self.frame_id
+            frame_array, header, received_at = self._latest
+        return ReceivedFrame(frame_id, frame_array, FrameProvenance.from_header(header, received_at))
+
+    def _shutdown(self):
+        for timer in (self._connect_timer, self._reconnect_timer, self._shm_timer):
+            if timer is not None:
+                timer.cancel()
+        self._connect_timer = self._reconnect_timer = self._shm_timer = None
+        self._close_socket()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def stop_receiving(self):
+        """受信停止"""
+        with self._frame_condition:
+            self.running = False
+            self._frame_condition.notify_all()
+        self.connected = False
+        self.loop.run_sync(self._shutdown)
@@ -0,0 +1,172 @@
+"""
+フレームの来歴（provenance）とレイテンシ計測
+
+音声チャンクの取得からウィンドウに表示されるまで、1フレームが各ステージを
+通過した時刻を FrameProvenance に記録し、LatencyTracker がステージごとと
+エンドツーエンドの所要時間を直近 window フレーム分の分布（p50/p95/p99）で集計する。
+
+ステージ（記録されたものだけが使われる）:
+    capture     音声チャンクの取得（カメラ入力の場合はカメラフレームの取得）
+    render      ビジュアライザが描画を終えて send_frame を呼んだ時刻
+    send        送信スレッドがヘッダを書いた時刻（TCPのみ）
+    receive     web_camera.py 側で受信・デコードが終わった時刻
+    pickup      メインループがフレームを取り出した時刻
+    preprocess  テンソル化の完了
+    inference   UNet / VAE の完了
+    postprocess 画像への変換（セーフティチェック含む）の完了
+    blend       フレーム履歴とのブレンドの完了
+    display     cv2.imshow の完了
+
+プロセスをまたいで比較するため時刻は time.time()（壁時計）を使う。
+送信側と受信側が別マシンの場合は時刻同期（NTP等）されている前提。
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+
+# 分布を求める直近フレーム数
+LATENCY_WINDOW = config.latency_window
+# レポートを表示する間隔（秒）。0 で定期表示しない
+LATENCY_REPORT_INTERVAL = config.latency_report_interval
+PERCENTILES = (50, 95, 99)
+
+
+class FrameProvenance:
+    """1フレームの来歴（シーケンス番号・音声取得時刻・ステージごとの通過時刻）"""
+
+    __slots__ = ("sequence", "capture_time", "stages")
+
+    def __init__(self, sequence: int, capture_time: Optional[float] = None):
+        self.sequence = sequence
+        self.capture_time = capture_time
+        self.stages: List[Tuple[str, float]] = []
+        if capture_time is not None:
+            self.stages.append(("capture", capture_time))
+
+    @classmethod
+    def from_header(cls, header, received_at: float) -> "FrameProvenance":
+        """受信したフレームヘッダ（frame_protocol.FrameHeader）から来歴を作る"""
+        provenance = cls(header.sequence, header.capture_time)
+        provenance.mark("render", header.timestamp)
+        if header.send_time is not None:
+            provenance.mark("send", header.send_time)
+        provenance.mark("receive", received_at)
+        return provenance
+
+    def mark(self, stage: str, timestamp: Optional[float] = None) -> None:
+        """ステージの通過時刻を記録"""
+        self.stages.append((stage, time.time() if timestamp is None else timestamp))
+
+    def durations(self) -> List[Tuple[str, float]]:
+        """各ステージについて、直前のステージからの所要時間（秒）"""
+        return [
+            (stage, timestamp - previous)
+            for (_, previous), (stage, timestamp) in zip(self.stages, self.stages[1:])
+        ]
+
+    def end_to_end(self) -> Optional[float]:
+        """最初のステージ（通常は音声取得）から最後のステージまでの時間（秒）"""
+        if len(self.stages) < 2:
+            return None
+        return self.stages[-1][1] - self.stages[0][1]
+
+    def to_dict(self) -> dict:
+        return {"sequence": self.sequence, "capture_time": self.capture_time, "stages": list(self.stages)}
+
+    def __repr__(self):
+        durations = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.durations())
+        return f"FrameProvenance(#{self.sequence}: {durations})"
+
+
+class RollingHistogram:
+    """直近 window 個の値の分布"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._values = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+        self.count += 1
+
+    def percentiles(self, percentiles=PERCENTILES) -> Dict[str, float]:
+        """{"p50": ..., "p95": ..., "p99": ...}（値がなければ空）"""
+        if not self._values:
+            return {}
+        values = np.percentile(np.fromiter(self._values, dtype=np.float64, count=len(self._values)), percentiles)
+        return {f"p{p}": float(value) for p, value in zip(percentiles, values)}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class LatencyTracker:
+    """FrameProvenance を集計し、ステージごと・エンドツーエンドのレイテンシ分布を保持する（スレッドセーフ）"""
+
+    END_TO_END = "end_to_end"
+
+    def __init__(self, window: int = LATENCY_WINDOW, report_interval: float = LATENCY_REPORT_INTERVAL):
+        self.window = window
+        self.report_interval = report_interval
+        # ステージ名 -> RollingHistogram（ミリ秒）。最初に現れた順で並ぶ
+        self.histograms: Dict[str, RollingHistogram] = {}
+        self.end_to_end = RollingHistogram(window)
+        self._recorded_at = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    def record(self, provenance: FrameProvenance) -> None:
+        """表示まで終わったフレームの来歴を集計に加える"""
+        durations = provenance.durations()
+        end_to_end = provenance.end_to_end()
+        with self._lock:
+            for stage, seconds in durations:
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = RollingHistogram(self.window)
+                histogram.add(seconds * 1000)
+            if end_to_end is not None:
+                self.end_to_end.add(end_to_end * 1000)
+            self._recorded_at.append(time.monotonic())
+
+    def fps(self) -> float:
+        """直近 window フレームの表示レート"""
+        with self._lock:
+            if len(self._recorded_at) < 2:
+                return 0.0
+            elapsed = self._recorded_at[-1] - self._recorded_at[0]
+            return (len(self._recorded_at) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """{ステージ名: {"count", "p50", "p95", "p99"}}（ミリ秒）。最後に "end_to_end" を含む"""
+        with self._lock:
+            histograms = list(self.histograms.items()) + [(self.END_TO_END, self.end_to_end)]
+            return {
+                stage: {"count": histogram.count, **histogram.percentiles()}
+                for stage, histogram in histograms
+                if len(histogram)
+            }
+
+    def format_report(self) -> str:
+        """ステージごとの p50/p95/p99 を表形式の文字列にする"""
+        lines = [f"=== Latency (直近{self.window}フレーム, {self.fps():.1f} fps) ==="]
+        lines.append(f"{'stage':<12} {'p50':>8} {'p95':>8} {'p99':>8}  [ms]")
+        for stage, values in self.summary().items():
+            lines.append(f"{stage:<12} {values['p50']:8.1f} {values['p95']:8.1f} {values['p99']:8.1f}")
+        return "\n".join(lines)
+
+    def maybe_report(self) -> bool:
+        """report_interval 秒ごとにレポートを表示（表示したら True）"""
+        if self.report_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval:
+            return False
+        self._last_report = now
+        print(self.format_report())
+        return True
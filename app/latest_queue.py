@@ -0,0 +1,64 @@
+"""
+最新優先の有界キュー
+
+リアルタイム処理では古いフレームを待たせるより捨てた方がよいため、
+満杯のときは最も古い要素を破棄して新しい要素を入れる。
+破棄した数は dropped で確認できる。
+"""
+import threading
+from collections import deque
+
+
+class LatestQueue:
+    """満杯時に最も古い要素を捨てる有界キュー（スレッドセーフ）"""
+
+    def __init__(self, maxsize: int = 1):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be >= 1, got {maxsize}")
+        self.maxsize = maxsize
+        self._items = deque()
+        self._condition = threading.Condition()
+        self.closed = False
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item) -> None:
+        """要素を追加（満杯なら最も古い要素を破棄）。呼び出し側はブロックしない"""
+        with self._condition:
+            if self.closed:
+                return
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """最も古い要素を取り出す（タイムアウトまたは close() 後は None）"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self.closed, timeout)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def take_latest(self):
+        """最も新しい要素だけを取り出し、それより古い要素は破棄する（空なら None。ブロックしない）"""
+        with self._condition:
+            if not self._items:
+                return None
+            self.dropped += len(self._items) - 1
+            item = self._items.pop()
+            self._items.clear()
+            return item
+
+    def close(self) -> None:
+        """キューを閉じ、get() で待機中のスレッドを起こす"""
+        with self._condition:
+            self.closed = True
+            self._items.clear()
+            self._condition.notify_all()
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._items)
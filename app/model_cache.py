@@ -0,0 +1,326 @@
+"""
+モデルのコンポーネント（パイプライン・TinyVAE・LCM-LoRA・セーフティチェッカー）のローカルキャッシュ
+
+従来キャッシュしていたのはメインのパイプライン（models_dir/<モデルID>）だけで、
+TinyVAE・LCM-LoRA・セーフティチェッカーは起動のたびに Hugging Face Hub に問い合わせていた
+（起動時間が Hub の応答に左右され、ネットワークのない環境では起動できない）。
+ModelCache は StreamDiffusionWrapper が使うすべてのコンポーネントを models_dir 以下の
+ディレクトリ（<リポジトリID の / を -- にしたもの>）に置き、マニフェスト
+（models_dir/manifest.json）にリビジョンとファイルごとのサイズ・SHA-256 を記録する。
+
+- resolve() はコンポーネントのローカルのパスを返す。キャッシュになければ読み込みに
+  必要なファイルだけをダウンロードして登録する
+- offline（paths.offline_models）では Hub に一切アクセスせず、キャッシュになければ
+  ModelCacheError を送出する。事前に prefetch で取得しておく
+- 起動時の確認はファイルの有無とサイズだけ（数 GB のハッシュ計算はしない）。
+  ハッシュの照合は verify で行う
+- fast_load のスナップショット（models_dir/<モデルID>.safetensors）はキャッシュから
+  作られるのでマニフェストには含めない
+
+使い方:
+    python -m app.model_cache prefetch [--model KBlueLeaf/kohaku-v2.1] [--safety-checker]
+    python -m app.model_cache verify
+    python -m app.model_cache list
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import config
+
+MODELS_DIR = config.models_dir
+OFFLINE_MODELS = config.offline_models
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# StreamDiffusionWrapper が ID を指定されなかったときに使うコンポーネント
+DEFAULT_TINY_VAE_ID = "madebyollin/taesd"
+DEFAULT_LCM_LORA_ID = "latent-consistency/lcm-lora-sdv1-5"
+SAFETY_CHECKER_ID = "CompVis/stable-diffusion-safety-checker"
+FEATURE_EXTRACTOR_ID = "openai/clip-vit-base-patch32"
+
+# コンポーネントの種類（取得するファイルの選び方が異なる）
+#   pipeline           model_index.json とサブフォルダ（unet/ vae/ text_encoder/ ...）の設定・重み
+#   vae, lora, safety_checker  ルートの設定・重み
+#   feature_extractor  ルートの設定だけ（重みは不要）
+COMPONENT_KINDS = ("pipeline", "vae", "lora", "safety_checker", "feature_extractor")
+CONFIG_SUFFIXES = (".json", ".txt")
+WEIGHT_SUFFIXES = (".safetensors", ".bin")
+# 同じ重みの別形式（読み込みには使わない）
+WEIGHT_VARIANT_MARKERS = (".fp16.", "non_ema", ".ema.")
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+class ModelCacheError(OSError):
+    """コンポーネントがキャッシュになく、取得もできない（offline など）"""
+
+
+def select_files(filenames: Iterable[str], kind: str) -> List[str]:
+    """リポジトリのファイルから、kind のコンポーネントの読み込みに必要なものを選ぶ
+
+    重みは .safetensors を優先し、同じフォルダに .safetensors がない場合だけ .bin を使う。
+    fp16 / EMA などの別形式と、ルートの単一ファイル形式のチェックポイントは選ばない。
+    """
+    if kind not in COMPONENT_KINDS:
+        raise ValueError(f"kind must be one of {COMPONENT_KINDS}, got {kind}")
+    configs = []
+    weights: Dict[str, List[str]] = {}
+    for filename in filenames:
+        directory, _, basename = filename.rpartition("/")
+        if kind == "pipeline":
+            if directory == "" and basename != "model_index.json":
+                continue
+            if "/" in directory:
+                continue
+        elif directory:
+            continue
+        if basename.endswith(CONFIG_SUFFIXES):
+            configs.append(filename)
+        elif (kind != "feature_extractor" and basename.endswith(WEIGHT_SUFFIXES)
+              and not any(marker in basename for marker in WEIGHT_VARIANT_MARKERS)):
+            weights.setdefault(directory, []).append(filename)
+
+    selected = list(configs)
+    for files in weights.values():
+        safetensors = [filename for filename in files if filename.endswith(".safetensors")]
+        selected.extend(safetensors or files)
+    return sorted(selected)
+
+
+def required_components(model_id_or_path: str, use_tiny_vae: bool = True, use_lcm_lora: bool = True,
+                        lcm_lora_id: Optional[str] = None, vae_id: Optional[str] = None,
+                        use_safety_checker: bool = False) -> List[Tuple[str, str]]:
+    """StreamDiffusionWrapper がこの設定で読み込むコンポーネント（(リポジトリID, 種類) のリスト）"""
+    components = [(model_id_or_path, "pipeline")]
+    # sd-turbo には LCM-LoRA を使わない（StreamDiffusionWrapper.sd_turbo と同じ判定）
+    if use_lcm_lora and "turbo" not in model_id_or_path:
+        components.append((lcm_lora_id or DEFAULT_LCM_LORA_ID, "lora"))
+    if use_tiny_vae:
+        components.append((vae_id or DEFAULT_TINY_VAE_ID, "vae"))
+    if use_safety_checker:
+        components.append((SAFETY_CHECKER_ID, "safety_checker"))
+        components.append((FEATURE_EXTRACTOR_ID, "feature_extractor"))
+    return components
+
+
+def file_digest(path: str) -> str:
+    """ファイルの SHA-256（16進）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """models_dir 以下のコンポーネントのキャッシュとマニフェスト（スレッドセーフ）"""
+
+    def __init__(self, cache_dir: str = MODELS_DIR, offline: bool = OFFLINE_MODELS):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self._lock = threading.RLock()
+
+    def local_path(self, repo_id: str) -> str:
+        """リポジトリを置くディレクトリ（従来のパイプラインのキャッシュと同じ名前）"""
+        return os.path.join(self.cache_dir, repo_id.replace("/", "--"))
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "components": {}}
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ModelCacheError(f"{self.manifest_path} has unsupported version {manifest.get('version')}")
+        return manifest
+
+    def _write_manifest(self, manifest: dict) -> None:
+        # 書き込み中のマニフェストを読まないよう、一時ファイルに書いてから置き換える
+        os.makedirs(self.cache_dir, exist_ok=True)
+        partial = self.manifest_path + ".partial"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(partial, self.manifest_path)
+
+    def entries(self) -> Dict[str, dict]:
+        """マニフェストのエントリ（リポジトリID → kind / path / revision / files）"""
+        with self._lock:
+            return self._read_manifest()["components"]
+
+    def missing_files(self, repo_id: str, entry: dict) -> List[str]:
+        """エントリのファイルのうち、ないかサイズの違うもの"""
+        root = os.path.join(self.cache_dir, entry["path"])
+        missing = []
+        for filename, info in entry["files"].items():
+            path = os.path.join(root, filename)
+            if not os.path.isfile(path) or os.path.getsize(path) != info["size"]:
+                missing.append(filename)
+        return missing
+
+    def resolve(self, repo_id: str, kind: str) -> str:
+        """コンポーネントのローカルのパス（キャッシュになければ取得する。offline では取得しない）
+
+        ローカルのファイル・ディレクトリを指す場合はそのまま返す。
+        """
+        if os.path.exists(repo_id):
+            return repo_id
+        with self._lock:
+            entry = self._read_manifest()["components"].get(repo_id)
+            if entry is not None and not self.missing_files(repo_id, entry):
+                return os.path.join(self.cache_dir, entry["path"])
+
+            path = self.local_path(repo_id)
+            if entry is None and kind == "pipeline" and os.path.isfile(os.path.join(path, "model_index.json")):
+                # マニフェスト以前に save_pretrained で保存したキャッシュは、そのまま登録する
+                print(f"📝 既存のキャッシュを登録: {path}")
+                return self._register(repo_id, kind, None, self._walk(path))
+
+            if self.offline:
+                state = "is incomplete" if entry is not None else "is not cached"
+                raise ModelCacheError(
+                    f"{repo_id} {state} in {self.cache_dir} (offline mode; run `python -m app.model_cache prefetch`)"
+                )
+            return self.fetch(repo_id, kind)
+
+    def fetch(self, repo_id: str, kind: str, revision: Optional[str] = None) -> str:
+        """Hub からコンポーネントの必要なファイルを取得してマニフェストに登録する"""
+        if self.offline:
+            raise ModelCacheError(f"cannot fetch {repo_id} in offline mode")
+        from huggingface_hub import HfApi, snapshot_download
+
+        with self._lock:
+            print(f"🌐 Hugging Faceから取得: {repo_id} ({kind})")
+            info = HfApi().model_info(repo_id, revision=revision)
+            files = select_files([sibling.rfilename for sibling in info.siblings], kind)
+            if not files:
+                raise ModelCacheError(f"{repo_id} has no files to load as {kind}")
+            snapshot_download(
+                repo_id,
+                revision=info.sha,
+                local_dir=self.local_path(repo_id),
+                local_dir_use_symlinks=False,
+                allow_patterns=files,
+            )
+            return self._register(repo_id, kind, info.sha, files)
+
+    @staticmethod
+    def _walk(root: str) -> List[str]:
+        files = []
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                files.append(os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, "/"))
+        return sorted(files)
+
+    def _register(self, repo_id: str, kind: str, revision: Optional[str], files: Sequence[str]) -> str:
+        """取得したファイルのサイズとハッシュをマニフェストに書く"""
+        path = self.local_path(repo_id)
+        manifest = self._read_manifest()
+        manifest["components"][repo_id] = {
+            "kind": kind,
+            "path": os.path.relpath(path, self.cache_dir),
+            "revision": revision,
+            "files": {
+                filename: {
+                    "size": os.path.getsize(os.path.join(path, filename)),
+                    "sha256": file_digest(os.path.join(path, filename)),
+                }
+                for filename in files
+            },
+        }
+        self._write_manifest(manifest)
+        return path
+
+    def verify(self, repo_ids: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+        """ハッシュを照合し、リポジトリID → 一致しない（またはない）ファイルを返す"""
+        entries = self.entries()
+        problems = {}
+        for repo_id in repo_ids if repo_ids is not None else sorted(entries):
+            entry = entries.get(repo_id)
+            if entry is None:
+                problems[repo_id] = ["(not in manifest)"]
+                continue
+            root = os.path.join(self.cache_dir, entry["path"])
+            bad = []
+            for filename, info in entry["files"].items():
+                path = os.path.join(root, filename)
+                if not os.path.isfile(path) or file_digest(path) != info["sha256"]:
+                    bad.append(filename)
+            if bad:
+                problems[repo_id] = bad
+        return problems
+
+
+def _configured_components(models: Sequence[str], use_safety_checker: bool) -> List[Tuple[str, str]]:
+    """config.json の設定と追加のモデルで使うコンポーネント（重複なし）"""
+    model_ids = [config.model_id]
+    if config.get('streamdiffusion.use_kohaku_model', False):
+        model_ids.append("KBlueLeaf/kohaku-v2.1")
+    model_ids.extend(models)
+
+    components = []
+    for model_id in model_ids:
+        for component in required_components(model_id, use_safety_checker=use_safety_checker):
+            if component not in components:
+                components.append(component)
+    return components
+
+
+def prefetch(args) -> None:
+    cache = ModelCache(args.cache_dir, offline=False)
+    for repo_id, kind in _configured_components(args.model, args.safety_checker):
+        entry = cache.entries().get(repo_id)
+        if entry is not None and not args.refresh and not cache.missing_files(repo_id, entry):
+            print(f"✅ {repo_id} ({kind}): キャッシュ済み")
+            continue
+        path = cache.fetch(repo_id, kind)
+        print(f"✅ {repo_id} ({kind}): {path}")
+    print(f"📝 マニフェスト: {cache.manifest_path}")
+
+
+def verify(args) -> None:
+    cache = ModelCache(args.cache_dir)
+    problems = cache.verify()
+    for repo_id in sorted(cache.entries()):
+        if repo_id in problems:
+            print(f"❌ {repo_id}: {', '.join(problems[repo_id])}")
+        else:
+            print(f"✅ {repo_id}")
+    if problems:
+        raise SystemExit(1)
+
+
+def list_components(args) -> None:
+    cache = ModelCache(args.cache_dir)
+    for repo_id, entry in sorted(cache.entries().items()):
+        size = sum(info["size"] for info in entry["files"].values())
+        revision = (entry["revision"] or "-")[:12]
+        print(f"{repo_id:<48} {entry['kind']:<18} {revision:<12} {size / 1024 ** 2:9.1f}MB  {entry['path']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルのコンポーネントのローカルキャッシュ")
+    parser.add_argument("--cache-dir", default=MODELS_DIR, help="キャッシュのディレクトリ（paths.models_dir）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch = commands.add_parser("prefetch", help="設定で使うすべてのコンポーネントを取得する")
+    fetch.add_argument("--model", action="append", default=[], help="追加で取得するモデル（複数指定可）")
+    fetch.add_argument("--safety-checker", action="store_true", help="セーフティチェッカーも取得する")
+    fetch.add_argument("--refresh", action="store_true", help="キャッシュ済みでも取得し直す")
+    fetch.set_defaults(run=prefetch)
+
+    check = commands.add_parser("verify", help="キャッシュのファイルをマニフェストのハッシュと照合する")
+    check.set_defaults(run=verify)
+
+    show = commands.add_parser("list", help="キャッシュ済みのコンポーネント")
+    show.set_defaults(run=list_components)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+モデルの高速読み込み（コールドスタートの短縮）と起動時間の計測
+
+StreamDiffusionWrapper._load_model は StableDiffusionPipeline を low_cpu_mem_usage=False で
+読み込んでいた（ランダム初期化した重みを読み込んだ重みで上書きする）。
+初回はダウンロード後に save_pretrained でディレクトリ形式の複製も書いていた。
+streamdiffusion.fast_load が有効な場合は次のようにする。
+
+- 初回の読み込み後に、UNet・テキストエンコーダ・VAE の重みと設定・トークナイザを
+  1つの safetensors ファイル（スナップショット）にまとめて保存する
+- 次回からはスナップショットを mmap で開き、初期化を省いた（meta デバイスの）モデルに
+  重みをそのまま割り当てる。3つのコンポーネントは別々のスレッドで並行に読み込む
+- スナップショットがない場合も from_pretrained を low_cpu_mem_usage=True で呼ぶ
+
+StartupProfile はフェーズ（import・重みの読み込み・デバイスへの転送・LoRA の融合・
+prepare など）ごとの所要時間を記録し、起動時に表示する。
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+# スナップショットの形式（safetensors のメタデータに書く）
+SNAPSHOT_FORMAT = "streamdiffusion-snapshot"
+SNAPSHOT_VERSION = "1"
+SNAPSHOT_SUFFIX = ".safetensors"
+# スナップショットにまとめるコンポーネント（重みを持つもの）
+SNAPSHOT_COMPONENTS = ("unet", "text_encoder", "vae")
+
+
+class StartupProfile:
+    """起動のフェーズごとの所要時間（スレッドセーフ。並行したフェーズは重なって記録される）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def elapsed(self) -> float:
+        """計測を始めてからの経過時間（import は含まない）"""
+        return time.perf_counter() - self.started
+
+    def format_report(self) -> str:
+        with self._lock:
+            phases = list(self.phases)
+        lines = ["=== Startup ==="]
+        for name, seconds in phases:
+            lines.append(f"{name:<24} {seconds * 1000:9.0f}ms")
+        lines.append(f"{'total (wall)':<24} {self.elapsed() * 1000:9.0f}ms")
+        return "\n".join(lines)
+
+
+def snapshot_path(local_model_path: str) -> str:
+    """ディレクトリ形式のキャッシュのパスに対応するスナップショットのパス"""
+    return local_model_path.rstrip("/\\") + SNAPSHOT_SUFFIX
+
+
+def _component_config(component) -> Tuple[str, dict]:
+    """コンポーネントのクラス名と設定（diffusers の ConfigMixin / transformers の PretrainedConfig）"""
+    config = component.config
+    if hasattr(config, "to_dict"):
+        return type(component).__name__, config.to_dict()
+    return type(component).__name__, json.loads(component.to_json_string())
+
+
+def save_snapshot(pipe, path: str) -> None:
+    """パイプラインの重み・設定・トークナイザを1つの safetensors ファイルに保存する
+
+    書き込み中のファイルを読まないよう、一時ファイルに書いてから置き換える。
+    """
+    from safetensors.torch import save_file
+
+    tensors: Dict[str, torch.Tensor] = {}
+    components = {}
+    for name in SNAPSHOT_COMPONENTS:
+        component = getattr(pipe, name)
+        components[name] = _component_config(component)
+        for key, tensor in component.state_dict().items():
+            tensors[f"{name}.{key}"] = tensor.detach().to("cpu").contiguous()
+
+    # トークナイザはファイル（vocab.json / merges.txt など）の中身をそのままメタデータに入れる
+    with tempfile.TemporaryDirectory() as directory:
+        pipe.tokenizer.save_pretrained(directory)
+        tokenizer_files = {}
+        for filename in os.listdir(directory):
+            with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                tokenizer_files[filename] = f.read()
+
+    metadata = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "components": json.dumps({name: list(value) for name, value in components.items()}),
+        "tokenizer": json.dumps([type(pipe.tokenizer).__name__, tokenizer_files]),
+        "scheduler": json.dumps(_component_config(pipe.scheduler)),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial = path + ".partial"
+    save_file(tensors, partial, metadata=metadata)
+    os.replace(partial, path)
+
+
+def _empty_weights():
+    """パラメータを確保・初期化せずにモデルを作るコンテキスト（accelerate がなければ通常どおり作る）"""
+    try:
+        from accelerate import init_empty_weights
+    except ImportError:
+        return nullcontext()
+    return init_empty_weights()
+
+
+def _empty_component(name: str, class_name: str, config: dict):
+    """重みを持たない（meta デバイスの）コンポーネントを作る
+
+    accelerate の init_empty_weights は nn.Module をプロセス全体で書き換えるため、
+    並行して読み込む前にメインスレッドでまとめて作っておく。
+    """
+    if name == "text_encoder":
+        import transformers
+
+        model_class = getattr(transformers, class_name)
+        with _empty_weights():
+            return model_class(model_class.config_class.from_dict(config))
+
+    import diffusers
+
+    with _empty_weights():
+        return getattr(diffusers, class_name).from_config(config)
+
+
+def _load_component(path: str, name: str, model, device, dtype, profile: StartupProfile):
+    """スナップショットの重みをコンポーネントに割り当て、デバイスへ送る"""
+    from safetensors import safe_open
+
+    with profile.phase(f"read:{name}"):
+        prefix = f"{name}."
+        # safe_open はファイルを mmap し、get_tensor はそこから読む
+        with safe_open(path, framework="pt", device="cpu") as f:
+            state_dict = {key[len(prefix):]: f.get_tensor(key) for key in f.keys() if key.startswith(prefix)}
+        model.load_state_dict(state_dict, strict=False, assign=True)
+        missing = [key for key, tensor in model.state_dict().items() if tensor.device.type == "meta"]
+        if missing:
+            raise ValueError(f"snapshot {path} has no weights for {name}: {missing[:3]}")
+    with profile.phase(f"to_device:{name}"):
+        model = model.to(device=device, dtype=dtype)
+    return model.eval()
+
+
+def load_snapshot(path: str, device, dtype, profile: Optional[StartupProfile] = None):
+    """save_snapshot() で保存したファイルから StableDiffusionPipeline を作る"""
+    import diffusers
+    import transformers
+    from safetensors import safe_open
+
+    profile = profile or StartupProfile()
+    with safe_open(path, framework="pt", device="cpu") as f:
+        metadata = f.metadata() or {}
+    if metadata.get("format") != SNAPSHOT_FORMAT or metadata.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a {SNAPSHOT_FORMAT} v{SNAPSHOT_VERSION} file")
+    components = json.loads(metadata["components"])
+    with profile.phase("build"):
+        empty = {name: _empty_component(name, *components[name]) for name in SNAPSHOT_COMPONENTS}
+
+    # UNet・テキストエンコーダ・VAE の重みを並行して読み込む
+    with ThreadPoolExecutor(max_workers=len(SNAPSHOT_COMPONENTS), thread_name_prefix="load") as executor:
+        futures = {
+            name: executor.submit(_load_component, path, name, empty[name], device, dtype, profile)
+            for name in SNAPSHOT_COMPONENTS
+        }
+        # トークナイザとスケジューラは小さいので待つ間に作る
+        with profile.phase("read:tokenizer"):
+            tokenizer_class, tokenizer_files = json.loads(metadata["tokenizer"])
+            with tempfile.TemporaryDirectory() as directory:
+                for filename, content in tokenizer_files.items():
+                    with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+                        f.write(content)
+                tokenizer = getattr(transformers, tokenizer_class).from_pretrained(directory)
+            scheduler_class, scheduler_config = json.loads(metadata["scheduler"])
+            scheduler = getattr(diffusers, scheduler_class).from_config(scheduler_config)
+        models = {name: future.result() for name, future in futures.items()}
+
+    return diffusers.StableDiffusionPipeline(
+        vae=models["vae"],
+        text_encoder=models["text_encoder"],
+        tokenizer=tokenizer,
+        unet=models["unet"],
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
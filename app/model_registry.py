@@ -0,0 +1,235 @@
+"""
+常駐モデルのレジストリ（実行中のモデルの切り替え）
+
+sd-turbo と kohaku-v2.1（use_kohaku_model）を切り替えるにはプロセスを再起動する必要があった。
+ModelRegistry は (model_id, t_index_list, cfg_type, dtype, tiny_vae) をキーに、
+読み込み・prepare 済みの StreamDiffusion（app/stream_diffusion.py）を最大 max_models 個、
+重みの合計が max_bytes 以下になるよう保持する。超えたら最も長く使われていないものを捨てる
+（使用中のモデルは捨てない）。
+
+- activate() は常駐しているモデルならすぐに切り替え、なければ別スレッドで読み込んでから
+  切り替える（読み込みの間も使用中のモデルで生成を続けられる）
+- TinyVAE のようにモデルによらない部品は shared_component() で1つを共有する。
+  重みの合計はテンソルの記憶領域ごとに1回だけ数える
+"""
+import gc
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, NamedTuple, Optional, Set, Tuple
+
+import torch
+
+from config import config
+
+# 常駐させるモデルの数と、重みの合計の上限
+RESIDENT_MODELS = config.resident_models
+RESIDENT_BYTES = int(config.resident_memory_mb * 1024 * 1024)
+
+# shared_component() で共有している部品（使うモデルがなくなれば解放される）
+_shared_components = weakref.WeakValueDictionary()
+_shared_components_lock = threading.Lock()
+
+
+class ModelKey(NamedTuple):
+    model_id: str
+    t_index_list: Tuple[int, ...]
+    cfg_type: str
+    dtype: str
+    tiny_vae: bool
+
+    def __str__(self) -> str:
+        steps = ",".join(str(t) for t in self.t_index_list)
+        return f"{self.model_id} [t={steps} cfg={self.cfg_type} {self.dtype}{' tiny_vae' if self.tiny_vae else ''}]"
+
+
+def shared_component(key: Hashable, load: Callable[[], torch.nn.Module]) -> torch.nn.Module:
+    """key の部品がすでに読み込まれていればそれを、なければ load() の結果を返す（推論専用で共有する）"""
+    with _shared_components_lock:
+        component = _shared_components.get(key)
+        if component is None:
+            component = load()
+            _shared_components[key] = component
+        return component
+
+
+def wrapper_modules(stream_diffusion) -> Iterable[torch.nn.Module]:
+    """StreamDiffusion が持つ重み（パイプラインの各コンポーネントと TinyVAE）"""
+    stream = stream_diffusion.stream.stream
+    modules = [component for component in stream.pipe.components.values() if isinstance(component, torch.nn.Module)]
+    modules.extend(module for module in (stream.unet, stream.vae, stream.text_encoder) if isinstance(module, torch.nn.Module))
+    return modules
+
+
+def tensor_bytes(modules: Iterable[torch.nn.Module], seen: Optional[Set[Tuple[str, int]]] = None) -> int:
+    """モジュールのパラメータとバッファの記憶領域の合計（seen にあるものは数えず、数えたものを加える）"""
+    seen = set() if seen is None else seen
+    total = 0
+    for module in modules:
+        for tensor in [*module.parameters(), *module.buffers()]:
+            storage = tensor.untyped_storage()
+            key = (str(tensor.device), storage.data_ptr())
+            if key in seen or tensor.device.type == "meta":
+                continue
+            seen.add(key)
+            total += storage.nbytes()
+    return total
+
+
+def release_memory() -> None:
+    """捨てたモデルの重みを解放する"""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    if hasattr(torch, "mps") and torch.backends.mps.is_available():
+        torch.mps.empty_cache()
+
+
+class ModelRegistry:
+    """常駐モデルの LRU（スレッドセーフ）
+
+    factory(key) は key のモデルを読み込み、prepare まで済ませた StreamDiffusion を返す。
+    """
+
+    def __init__(self, factory: Callable[[ModelKey], object], max_models: int = RESIDENT_MODELS,
+                 max_bytes: int = RESIDENT_BYTES):
+        if max_models < 1:
+            raise ValueError(f"max_models must be at least 1, got {max_models}")
+        self.factory = factory
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[ModelKey, object]" = OrderedDict()
+        self._loading: Dict[ModelKey, threading.Thread] = {}
+        # 読み込んだモデルの重みの大きさ（読み込む前に空けるべき量の見積もりに使う）
+        self._model_bytes: Dict[ModelKey, int] = {}
+        self._lock = threading.Lock()
+        self.active_key: Optional[ModelKey] = None
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def active(self):
+        """使用中のモデル"""
+        with self._lock:
+            return self._entries.get(self.active_key)
+
+    def __contains__(self, key: ModelKey) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def keys(self):
+        """常駐しているモデルのキー（古い順）"""
+        with self._lock:
+            return list(self._entries)
+
+    def add(self, key: ModelKey, stream_diffusion, activate: bool = True) -> None:
+        """読み込み済みのモデルを登録する"""
+        model_bytes = tensor_bytes(wrapper_modules(stream_diffusion))
+        with self._lock:
+            self._entries[key] = stream_diffusion
+            self._entries.move_to_end(key)
+            self._model_bytes[key] = model_bytes
+            if activate:
+                self.active_key = key
+            evicted = self._evict(keep=key)
+        if evicted:
+            release_memory()
+
+    def total_bytes(self) -> int:
+        """常駐しているモデルの重みの合計（共有している部品は1回だけ数える）"""
+        with self._lock:
+            entries = list(self._entries.values())
+        seen = set()
+        return sum(tensor_bytes(wrapper_modules(entry), seen) for entry in entries)
+
+    def _estimated_bytes(self, key: ModelKey) -> int:
+        """key のモデルの重みの見積もり（読み込んだことがなければ、これまでで最大のモデルと同じとみなす）"""
+        if key in self._model_bytes:
+            return self._model_bytes[key]
+        return max(self._model_bytes.values(), default=0)
+
+    def _evict(self, keep: ModelKey, room: int = 0, incoming_bytes: int = 0) -> int:
+        """上限を超えた分（room 個と incoming_bytes バイトの空きを作る分）を古いものから捨てる。ロックを持って呼ぶこと"""
+        evicted = 0
+        while True:
+            candidates = [key for key in self._entries if key not in (keep, self.active_key)]
+            if not candidates:
+                return evicted
+            over_count = len(self._entries) + room > self.max_models
+            if not over_count:
+                seen = set()
+                total = sum(tensor_bytes(wrapper_modules(entry), seen) for entry in self._entries.values())
+                if total + incoming_bytes <= self.max_bytes:
+                    return evicted
+            print(f"🗑️ モデルを解放: {candidates[0]}")
+            del self._entries[candidates[0]]
+            self.evictions += 1
+            evicted += 1
+
+    def get(self, key: ModelKey):
+        """key のモデル（常駐していなければこのスレッドで読み込む）。切り替えはしない"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            # 読み込みのピークを抑えるため、数と重みの上限を超えるなら先に空ける
+            evicted = self._evict(keep=key, room=1, incoming_bytes=self._estimated_bytes(key))
+        if evicted:
+            release_memory()
+
+        entry = self.factory(key)
+        model_bytes = tensor_bytes(wrapper_modules(entry))
+        with self._lock:
+            self._entries[key] = entry
+            self._model_bytes[key] = model_bytes
+            self.loads += 1
+            evicted = self._evict(keep=key)
+        if evicted:
+            release_memory()
+        return entry
+
+    def activate(self, key: ModelKey, on_ready: Callable[[ModelKey, object], None]) -> bool:
+        """key のモデルに切り替え、on_ready(key, モデル) を呼ぶ
+
+        常駐していればこのスレッドで on_ready を呼んで True を返す。常駐していなければ
+        別スレッドで読み込みを始め（読み込み中なら何もしない）、False を返す。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.active_key = key
+                self.hits += 1
+            elif key not in self._loading:
+                thread = threading.Thread(target=self._load_and_activate, args=(key, on_ready),
+                                          name="model-load", daemon=True)
+                self._loading[key] = thread
+                thread.start()
+        if entry is None:
+            return False
+        on_ready(key, entry)
+        return True
+
+    def _load_and_activate(self, key: ModelKey, on_ready: Callable[[ModelKey, object], None]) -> None:
+        try:
+            entry = self.get(key)
+        except Exception as e:
+            print(f"❌ モデルの読み込みに失敗: {key}: {e}")
+            return
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        with self._lock:
+            self.active_key = key
+        on_ready(key, entry)
+
+    def format_stats(self) -> str:
+        lines = [f"常駐モデル: {len(self.keys())}/{self.max_models}, "
+                 f"{self.total_bytes() / 1024 ** 2:.0f}MB / {self.max_bytes / 1024 ** 2:.0f}MB "
+                 f"(切り替え {self.hits}, 読み込み {self.loads}, 解放 {self.evictions})"]
+        for key in reversed(self.keys()):
+            lines.append(f"  {'*' if key == self.active_key else ' '} {key}")
+        return "\n".join(lines)
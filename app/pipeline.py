@@ -0,0 +1,227 @@
+"""
+ステージごとのスレッドで処理するパイプライン
+
+web_camera.py のキャプチャ/前処理 → 推論 → 後処理 → 表示を別々のスレッドで
+動かし、間を最新優先の有界キュー（LatestQueue）でつなぐ。推論中のフレーム N と
+並行して、フレーム N+1 のキャプチャ・前処理とフレーム N-1 の後処理・表示が進む。
+下流が追いつかない場合はキューの古いフレームが捨てられる（待たせない）。
+
+各ステージは処理にかかった時間を記録し、稼働率（経過時間のうち処理していた割合）を
+報告する。推論ステージの稼働率が 100% に近いほどモデルが遊んでいない。
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from .latest_queue import LatestQueue
+
+# ステージ間のキュー長（1 で常に最新のフレームだけを渡す）
+STAGE_QUEUE_SIZE = 1
+# 入力待ちでタイムアウトして停止を確認する間隔（秒）
+STAGE_POLL_INTERVAL = 0.1
+# PacedQueue がまとまりの届く間隔を平滑化する係数（新しい間隔の重み）
+PACE_SMOOTHING = 0.2
+
+
+class PacedQueue:
+    """まとめて届いた出力を1つずつ等間隔で取り出すキュー（スレッドセーフ）
+
+    put() に K 個の要素のリストを渡すと、まとまりが届く間隔（平滑化）を K 等分した
+    ペースで get() が1つずつ返す。バッチ推論の K 枚の出力を一度に表示せず、
+    滑らかに見せるために使う。前のまとまりを出し切る前に次が届いた場合、
+    残りは古いので破棄する（dropped）。LatestQueue と同じ get/close で使える。
+    """
+
+    def __init__(self):
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._last_put = None
+        self.interval = 0.0
+        self.closed = False
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, items) -> None:
+        """まとまりを追加（最初の要素はすぐに取り出せる）"""
+        items = list(items)
+        if not items:
+            return
+        with self._condition:
+            if self.closed:
+                return
+            now = time.monotonic()
+            if self._last_put is not None:
+                interval = (now - self._last_put) / len(items)
+                self.interval = interval if self.interval == 0 else (
+                    self.interval * (1 - PACE_SMOOTHING) + interval * PACE_SMOOTHING
+                )
+            self._last_put = now
+            self.dropped += len(self._items)
+            self._items.clear()
+            self._items.extend((now + i * self.interval, item) for i, item in enumerate(items))
+            self.put_count += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """表示時刻になった要素を取り出す（タイムアウトまたは close() 後は None）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self.closed:
+                now = time.monotonic()
+                wait = None if deadline is None else deadline - now
+                if self._items:
+                    due = self._items[0][0] - now
+                    if due <= 0:
+                        return self._items.popleft()[1]
+                    wait = due if wait is None else min(wait, due)
+                if wait is not None and wait <= 0:
+                    return None
+                self._condition.wait(wait)
+            return None
+
+    def close(self) -> None:
+        with self._condition:
+            self.closed = True
+            self._items.clear()
+            self._condition.notify_all()
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._items)
+
+
+class PipelineStage:
+    """入力を取り出して process() で処理し、結果を出力キューへ渡すステージ
+
+    入力は前段の LatestQueue か、source（呼ぶと次の入力を返す関数。なければ None）。
+    process() が None を返した場合は次のステージへ渡さない。
+    start() で専用スレッドを立てるか、呼び出し側のスレッドで poll() を繰り返す
+    （cv2 のウィンドウ表示のようにメインスレッドで行う必要がある処理）。
+    """
+
+    def __init__(self, name: str, process: Callable, input_queue: Optional[LatestQueue] = None,
+                 source: Optional[Callable] = None, output_queue: Optional[LatestQueue] = None):
+        if (input_queue is None) == (source is None):
+            raise ValueError("input_queue と source のどちらか一方を指定してください")
+        self.name = name
+        self.process = process
+        self.input_queue = input_queue
+        self.source = source
+        self.output_queue = output_queue
+        self.processed = 0
+        self.errors = 0
+        self._busy = 0.0
+        self._busy_total = 0.0
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.running = False
+
+    def poll(self, timeout: float = STAGE_POLL_INTERVAL) -> bool:
+        """入力を1つ処理する（入力がなければ timeout まで待って False）"""
+        if self.source is not None:
+            item = self.source()
+        else:
+            item = self.input_queue.get(timeout=timeout)
+        if item is None:
+            return False
+
+        started = time.monotonic()
+        try:
+            result = self.process(item)
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ {self.name} ステージのエラー: {e}")
+            result = None
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._busy += elapsed
+            self._busy_total += elapsed
+            self.processed += 1
+        if result is not None and self.output_queue is not None:
+            self.output_queue.put(result)
+        return True
+
+    def _run(self):
+        while self.running:
+            self.poll()
+
+    def start(self) -> None:
+        """専用スレッドで poll() を繰り返す"""
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self.running = False
+        if self.input_queue is not None:
+            self.input_queue.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self, reset: bool = True) -> dict:
+        """前回 reset してからの稼働率と、処理数・入力で捨てたフレーム数・平均処理時間"""
+        now = time.monotonic()
+        with self._lock:
+            window = now - self._window_start
+            occupancy = self._busy / window if window > 0 else 0.0
+            if reset:
+                self._busy = 0.0
+                self._window_start = now
+            processed = self.processed
+            busy_total = self._busy_total
+        return {
+            "name": self.name,
+            "occupancy": occupancy,
+            "processed": processed,
+            "dropped": self.input_queue.dropped if self.input_queue is not None else 0,
+            "errors": self.errors,
+            "mean_ms": busy_total / processed * 1000 if processed else 0.0,
+        }
+
+
+class Pipeline:
+    """ステージを順につないだパイプライン"""
+
+    def __init__(self):
+        self.stages: List[PipelineStage] = []
+
+    def add_stage(self, name: str, process: Callable, source: Optional[Callable] = None,
+                  queue_size: int = STAGE_QUEUE_SIZE, input_queue=None) -> PipelineStage:
+        """ステージを末尾に追加する（最初のステージは source が必要）
+
+        前のステージとの間には queue_size の LatestQueue（input_queue を渡した場合はそれ）が入る。
+        """
+        if self.stages:
+            if input_queue is None:
+                input_queue = LatestQueue(queue_size)
+            self.stages[-1].output_queue = input_queue
+        stage = PipelineStage(name, process, input_queue=input_queue, source=source)
+        self.stages.append(stage)
+        return stage
+
+    def start(self, exclude=()) -> None:
+        """exclude 以外のステージのスレッドを開始（exclude は呼び出し側で poll() する）"""
+        for stage in self.stages:
+            if stage not in exclude:
+                stage.start()
+
+    def stop(self) -> None:
+        for stage in self.stages:
+            stage.running = False
+        for stage in self.stages:
+            stage.stop()
+
+    def format_report(self) -> str:
+        """ステージごとの稼働率・平均処理時間・入力で捨てたフレーム数（稼働率は前回の表示以降）"""
+        lines = ["=== Pipeline ==="]
+        lines.append(f"{'stage':<12} {'busy':>6} {'mean':>8} {'done':>7} {'dropped':>8}")
+        for stage in self.stages:
+            stats = stage.stats()
+            lines.append(
+                f"{stats['name']:<12} {stats['occupancy'] * 100:5.0f}% {stats['mean_ms']:6.1f}ms "
+                f"{stats['processed']:7d} {stats['dropped']:8d}"
+            )
+        return "\n".join(lines)
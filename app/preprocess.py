@@ -0,0 +1,104 @@
+"""
+PIL を経由しないフレームの前処理
+
+従来の経路（BGR→RGB 変換、PIL で中央切り抜き・NEAREST 縮小、
+image_processor.preprocess で [0,1]→[-1,1]、(x+1)/2 で [0,1] に戻す）と
+ビット単位で同じテンソルを、numpy の配列操作だけで作る。
+
+- 切り抜き・縮小・チャンネル並べ替えは FrameLayout のスライス（コピーなしのビュー）で表す
+- uint8 → float は、従来と同じ演算順（/255 → 2x-1 → (x+1)/2）で求めた 256 要素の
+  変換表を引くだけにし、HWC → CHW の並べ替えと切り抜きも同じ1回の読み出しで行う
+- 出力は使い回すバッファのリングに書く（毎フレームの確保をしない）
+
+リングのバッファは buffers 回後に上書きされる。パイプラインで前処理と推論が
+並行する場合は、同時に保持されうるフレーム数より多くしておくこと。
+"""
+import itertools
+from typing import Optional
+
+import numpy as np
+import torch
+
+from .frame_layout import FrameLayout
+
+
+def _reference_lut() -> np.ndarray:
+    """uint8 の各値を従来の経路で変換した結果（float32 × 256）"""
+    # PIL → numpy: np.array(image).astype(np.float32) / 255.0
+    values = np.arange(256, dtype=np.uint8).astype(np.float32) / 255.0
+    # image_processor.normalize: 2.0 * images - 1.0（torch）
+    values = 2.0 * torch.from_numpy(values) - 1.0
+    # StreamDiffusionWrapper.preprocess_image: (x + 1.0) / 2.0
+    values = (values + 1.0) / 2.0
+    return values.numpy()
+
+
+class ArrayPreprocessor:
+    """HWC の ndarray を StreamDiffusion の入力テンソル (1, 3, height, width) にする"""
+
+    def __init__(self, width: int, height: int, device: torch.device = torch.device("cpu"),
+                 dtype: torch.dtype = torch.float32, buffers: int = 4):
+        if width != height:
+            raise ValueError(f"ArrayPreprocessor supports square outputs only, got {width}x{height}")
+        self.width = width
+        self.height = height
+        self.device = device
+        self.dtype = dtype
+        self._lut = _reference_lut()
+        self._layouts = {}
+        # CPU 上の float32 バッファ（numpy とメモリを共有）と、必要ならデバイス/dtype の異なる転送先
+        self._host = [np.empty((1, 3, height, width), dtype=np.float32) for _ in range(buffers)]
+        self._host_tensors = [torch.from_numpy(buffer) for buffer in self._host]
+        if device.type == "cpu" and dtype == torch.float32:
+            self._device_tensors = self._host_tensors
+        else:
+            self._device_tensors = [torch.empty((1, 3, height, width), device=device, dtype=dtype)
+                                    for _ in range(buffers)]
+        self._slots = itertools.cycle(range(buffers))
+
+    def _layout(self, crop_size: Optional[int]) -> FrameLayout:
+        layout = self._layouts.get(crop_size)
+        if layout is None:
+            layout = self._layouts[crop_size] = FrameLayout(crop_size=crop_size, size=self.width, channels="rgb")
+        return layout
+
+    def __call__(self, frame: np.ndarray, channels: str = "rgb", crop_size: Optional[int] = None) -> torch.Tensor:
+        """frame を中央 crop_size で切り抜き、出力サイズに NEAREST 縮小してテンソルにする
+
+        frame は uint8、または FrameLayout の float32（[0,1] に正規化済み）。
+        channels は frame のチャンネル順（"rgb" / "bgr"）。
+        """
+        layout = self._layout(crop_size)
+        slot = next(self._slots)
+        host = self._host[slot][0]
+
+        slices = layout.slices(frame.shape[0], frame.shape[1])
+        if slices is None:
+            # 参照が等間隔でない縮小率は FrameLayout のインデックス参照で一度 RGB に並べる
+            source = layout.apply(frame, channels).transpose(2, 0, 1)
+            target = host
+        else:
+            # 切り抜き・縮小・チャンネル並べ替えはビューのまま、変換と同時に1回で読む
+            source_rows, source_cols, rows, cols = slices
+            channel_index = slice(None) if channels == "rgb" else slice(None, None, -1)
+            source = frame[source_rows, source_cols, channel_index].transpose(2, 0, 1)
+            target = host[:, rows, cols]
+            # 画像の外側（黒）は変換後も 0.0
+            host[:, :rows.start] = 0.0
+            host[:, rows.stop:] = 0.0
+            host[:, :, :cols.start] = 0.0
+            host[:, :, cols.stop:] = 0.0
+
+        if source.dtype == np.uint8:
+            np.take(self._lut, source, out=target)
+        else:
+            # float32 の場合も従来と同じ順で 2x-1 → (x+1)/2
+            np.multiply(source, np.float32(2.0), out=target)
+            np.subtract(target, np.float32(1.0), out=target)
+            np.add(target, np.float32(1.0), out=target)
+            np.divide(target, np.float32(2.0), out=target)
+
+        device_tensor = self._device_tensors[slot]
+        if device_tensor is not self._host_tensors[slot]:
+            device_tensor.copy_(self._host_tensors[slot], non_blocking=True)
+        return device_tensor
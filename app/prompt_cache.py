@@ -0,0 +1,134 @@
+"""
+プロンプト埋め込み（テキストエンコーダの出力）の LRU キャッシュ
+
+プロンプトを変えるたびに stream.prepare() が CLIP テキストエンコーダを実行するが、
+テーマ・修飾語の組み合わせは限られていて同じプロンプトに何度も戻ってくる。
+(prompt, negative_prompt, モデル) をキーに encode_prompt の結果を保持し、
+2回目以降はエンコーダを実行せずに返す。エントリ数とバイト数の両方で上限を設け、
+超えたら最も長く使われていないものから捨てる。
+
+StreamDiffusionWrapper が stream.pipe.encode_prompt を wrap() で包むので、
+prepare() / update_prompt() のどちらからの呼び出しもキャッシュを通る。
+キャッシュはプロセスで1つ（get_prompt_cache()）を共有し、モデルの異なる
+ラッパーが複数あってもキーで区別される。
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+from config import config
+
+# 保持するエントリ数とバイト数の上限
+PROMPT_CACHE_ENTRIES = config.prompt_cache_entries
+PROMPT_CACHE_BYTES = int(config.prompt_cache_mb * 1024 * 1024)
+
+
+def _nbytes(value) -> int:
+    """テンソル（またはそのタプル）が使うメモリ量"""
+    if value is None:
+        return 0
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    return value.element_size() * value.nelement()
+
+
+class PromptEmbeddingCache:
+    """エントリ数とバイト数で上限を設けた LRU キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries: int = PROMPT_CACHE_ENTRIES, max_bytes: int = PROMPT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        """キャッシュされた値（なければ None）。見つかったものは最新として扱う"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value) -> None:
+        """値を追加し、上限を超えた分を古い順に捨てる（1つで上限を超える値は保持しない）"""
+        size = _nbytes(value)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def wrap(self, encode_prompt: Callable, model_id: str) -> Callable:
+        """diffusers の encode_prompt をキャッシュ付きにした関数を返す
+
+        キーは (model_id, prompt, negative_prompt, CFGの有無, 生成枚数, デバイス)。
+        埋め込みを直接渡す呼び出しや LoRA スケール指定などはキャッシュしない。
+        返すテンソルは共有されるため、呼び出し側は書き換えないこと
+        （StreamDiffusion は repeat() で複製してから使う）。
+        """
+        def cached_encode_prompt(prompt, device, num_images_per_prompt, do_classifier_free_guidance,
+                                 negative_prompt=None, **kwargs):
+            if any(value is not None for value in kwargs.values()) or not isinstance(prompt, str):
+                return encode_prompt(prompt, device, num_images_per_prompt, do_classifier_free_guidance,
+                                     negative_prompt, **kwargs)
+            key = (model_id, prompt, negative_prompt or "", bool(do_classifier_free_guidance),
+                   num_images_per_prompt, str(device))
+            value = self.get(key)
+            if value is None:
+                value = encode_prompt(prompt, device, num_images_per_prompt, do_classifier_free_guidance,
+                                      negative_prompt)
+                self.put(key, tuple(value))
+            return value
+
+        cached_encode_prompt.__wrapped__ = encode_prompt
+        return cached_encode_prompt
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def format_stats(self) -> str:
+        stats = self.stats()
+        return (f"プロンプトキャッシュ: {stats['entries']}件 / {stats['bytes'] / 1024 / 1024:.1f}MB, "
+                f"ヒット {stats['hits']} / ミス {stats['misses']} ({stats['hit_rate'] * 100:.0f}%), "
+                f"追い出し {stats['evictions']}")
+
+
+_shared_cache: Optional[PromptEmbeddingCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_prompt_cache() -> PromptEmbeddingCache:
+    """プロセス内で共有するキャッシュ（StreamDiffusionWrapper が使う）"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = PromptEmbeddingCache()
+        return _shared_cache
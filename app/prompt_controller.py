@@ -0,0 +1,135 @@
+"""
+常駐する StreamDiffusionWrapper へのプロンプト更新
+
+ref/_ref_web_camera.py の PromptServer はプロンプトを受け付けるたびに
+StreamDiffusion(prompt=...) を作り直していた（重みの読み込みと prepare をやり直すため
+1回に数十秒かかり、更新を30秒に1回に制限していた）。PromptController は1つの
+ラッパーを使い続け、プロンプトを update_conditioning()（テキストエンコードと埋め込みの
+差し替えだけ。プロンプト埋め込みのキャッシュに当たればエンコードもしない）で反映する。
+
+- submit() はどのスレッドからでも呼べてブロックしない。反映は専用のスレッドが行い、
+  推論スレッドは埋め込みを差し替える瞬間しか待たない
+- 反映が追いつかない間に届いたプロンプトは最新のものだけを反映する（音声認識や
+  TCP で連続して届いても、古いプロンプトを順にエンコードしない）
+- add_words() / add_speech() は音韻トリガー（README_PHONEME_SYSTEM.md）の流れで、
+  認識した日本語の最初の音韻から phoneme_dictionary の英語表現を選び、
+  ベースのプロンプトに直近 max_words 語を足したプロンプトを submit() する
+"""
+import random
+import threading
+import time
+from collections import deque
+from typing import Iterable, List, Optional
+
+from .latest_queue import LatestQueue
+from .phoneme_dictionary import GOJUON_WORDS
+
+# 音韻トリガーでプロンプトに残す語の数と、1つの音韻から選ぶ語の数
+MAX_PHONEME_WORDS = 6
+WORDS_PER_PHONEME = 3
+# 反映にかかった時間の統計に使う直近の回数
+TIMING_WINDOW = 64
+
+
+def select_phoneme(text: str, last_phoneme: Optional[str] = None) -> Optional[str]:
+    """認識したテキストの最初の音韻（前回と同じなら2文字目の音韻。辞書になければ None）"""
+    phonemes = [char for char in text[:2] if char in GOJUON_WORDS]
+    if not phonemes:
+        return None
+    if phonemes[0] == last_phoneme and len(phonemes) > 1:
+        return phonemes[1]
+    return phonemes[0]
+
+
+def phoneme_words(phoneme: str, count: int = WORDS_PER_PHONEME) -> List[str]:
+    """音韻の単語リストから重複なしで count 個の英語表現を選ぶ"""
+    pairs = GOJUON_WORDS.get(phoneme, [])
+    return [english for _, english in random.sample(pairs, min(count, len(pairs)))]
+
+
+class PromptController:
+    """1つの StreamDiffusionWrapper のプロンプトを、作り直さずに更新する（スレッドセーフ）"""
+
+    def __init__(self, stream, negative_prompt: Optional[str] = None, base_prompt: str = "",
+                 max_words: int = MAX_PHONEME_WORDS):
+        self.stream = stream
+        self.negative_prompt = negative_prompt
+        self.base_prompt = base_prompt
+        self.max_words = max_words
+        self.words: List[str] = []
+        self.last_phoneme: Optional[str] = None
+        self.prompt = stream.prompt
+        # 最後に submit() したプロンプト（ラッパーを切り替えたときに反映し直す）
+        self.latest = stream.prompt
+        self._words_lock = threading.Lock()
+        self._pending = LatestQueue(1)
+        self._timings = deque(maxlen=TIMING_WINDOW)
+        self.applied = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="prompt", daemon=True)
+        self._thread.start()
+
+    @property
+    def coalesced(self) -> int:
+        """反映する前に新しいプロンプトに置き換えられた数"""
+        return self._pending.dropped
+
+    def submit(self, prompt: str) -> None:
+        """次に反映するプロンプト（まだ反映していないものがあれば置き換える）"""
+        self.latest = prompt
+        self._pending.put(prompt)
+
+    def attach(self, stream) -> None:
+        """プロンプトを反映するラッパーを切り替え（ModelRegistry でのモデル切り替え）、最新のプロンプトを反映する"""
+        self.stream = stream
+        if self.latest is not None and self.latest != stream.prompt:
+            self.submit(self.latest)
+
+    def add_words(self, words: Iterable[str]) -> str:
+        """ベースのプロンプトに語を足したプロンプトを submit() する（古い語から max_words 語を超えた分を除く）"""
+        with self._words_lock:
+            self.words.extend(word for word in words if word not in self.words)
+            del self.words[:-self.max_words]
+            prompt = ", ".join([self.base_prompt, *self.words] if self.base_prompt else self.words)
+        self.submit(prompt)
+        return prompt
+
+    def add_speech(self, text: str) -> Optional[str]:
+        """認識した音声の音韻から選んだ語を add_words() する（音韻が辞書になければ None）"""
+        with self._words_lock:
+            phoneme = select_phoneme(text, self.last_phoneme)
+            if phoneme is None:
+                return None
+            self.last_phoneme = phoneme
+        words = phoneme_words(phoneme)
+        print(f"音韻「{phoneme}」から選択: → {', '.join(words)}")
+        return self.add_words(words)
+
+    def _run(self) -> None:
+        while True:
+            prompt = self._pending.get()
+            if prompt is None:
+                return
+            started = time.perf_counter()
+            try:
+                self.stream.update_conditioning(prompt, self.negative_prompt)
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ プロンプトの反映に失敗: {e}")
+                continue
+            self._timings.append(time.perf_counter() - started)
+            self.prompt = prompt
+            self.applied += 1
+
+    def close(self) -> None:
+        self._pending.close()
+
+    def format_stats(self) -> str:
+        timings = sorted(self._timings)
+        if timings:
+            median = timings[len(timings) // 2] * 1000
+            timing = f"反映 中央値 {median:.0f}ms / 最大 {timings[-1] * 1000:.0f}ms"
+        else:
+            timing = "反映なし"
+        return (f"プロンプト更新: {self.applied} 回反映, {self.coalesced} 回は新しいプロンプトに置き換え, "
+                f"失敗 {self.failed}, {timing}")
@@ -0,0 +1,57 @@
+"""
+プロンプト埋め込みの補間によるプロンプト遷移
+
+プロンプトを切り替えると出力が急に変わる。切り替え前後の埋め込みから
+N フレーム分の中間の埋め込みを一度だけ作っておき、推論ごとに1つずつ
+差し替えることで、テキストエンコーダを追加で呼ばずに連続的に変化させる。
+
+補間方法:
+    "lerp"   線形補間
+    "slerp"  トークンごとに向きを球面線形補間し、大きさは線形補間する
+             （CLIP の埋め込みは向きが意味を持つため、途中で大きさが縮まない）
+"""
+from typing import List
+
+import torch
+
+TRANSITION_METHODS = ("none", "lerp", "slerp")
+# これより小さい角度は線形補間で代用する（sin(ω) での割り算を避ける）
+SLERP_EPSILON = 1e-4
+
+
+def lerp(start: torch.Tensor, end: torch.Tensor, t: float) -> torch.Tensor:
+    return start + (end - start) * t
+
+
+def slerp(start: torch.Tensor, end: torch.Tensor, t: float) -> torch.Tensor:
+    """最後の次元（埋め込みの次元）をベクトルとして球面線形補間する"""
+    start_norm = start.norm(dim=-1, keepdim=True)
+    end_norm = end.norm(dim=-1, keepdim=True)
+    start_unit = start / start_norm.clamp_min(SLERP_EPSILON)
+    end_unit = end / end_norm.clamp_min(SLERP_EPSILON)
+    dot = (start_unit * end_unit).sum(dim=-1, keepdim=True).clamp(-1.0, 1.0)
+    omega = torch.acos(dot)
+    sin_omega = torch.sin(omega)
+    small = sin_omega < SLERP_EPSILON
+    safe_sin = torch.where(small, torch.ones_like(sin_omega), sin_omega)
+    start_weight = torch.where(small, torch.full_like(omega, 1.0 - t), torch.sin((1.0 - t) * omega) / safe_sin)
+    end_weight = torch.where(small, torch.full_like(omega, t), torch.sin(t * omega) / safe_sin)
+    direction = start_weight * start_unit + end_weight * end_unit
+    return direction * lerp(start_norm, end_norm, t)
+
+
+def transition_steps(start: torch.Tensor, end: torch.Tensor, frames: int, method: str = "slerp") -> List[torch.Tensor]:
+    """start から end へ frames フレームで移る埋め込みの列（最後は end そのもの）
+
+    形が異なる場合（CFG の有無が変わった等）や frames が1以下の場合は [end] を返す。
+    """
+    if method not in TRANSITION_METHODS:
+        raise ValueError(f"method must be one of {TRANSITION_METHODS}, got {method}")
+    if method == "none" or frames <= 1 or start is None or start.shape != end.shape:
+        return [end]
+    interpolate = slerp if method == "slerp" else lerp
+    # 補間は float32 で行い、元の dtype に戻す
+    start32, end32 = start.float(), end.float()
+    steps = [interpolate(start32, end32, (i + 1) / frames).to(end.dtype) for i in range(frames - 1)]
+    steps.append(end)
+    return steps
@@ -0,0 +1,200 @@
+"""
+同一ホスト用の共有メモリ・リングバッファ
+
+ビジュアライザ（書き込み側）と web_camera.py（読み出し側）が同じマシンで
+動いている場合、ソケットを経由せずに multiprocessing.shared_memory 上の
+N スロットのリングでフレームを受け渡す。
+
+メモリレイアウト:
+    [0:64)    固定メタデータ（magic, version, slot_count, ndim, dtype, shape, slot_size）
+    [64:128)  制御ブロック（書き込みカーソル, closedフラグ）
+    [128:...) スロットごとのシーケンス番号（int64 × N）、タイムスタンプ（float64 × N）、
+              音声取得時刻（float64 × N、不明なら0）
+    以降      フレームデータのスロット × N（64バイト境界に整列）
+
+書き込み側はスロットのシーケンス番号を -1 にしてからデータを書き、
+書き終えた後にシーケンス番号とカーソルを更新する。読み出し側は
+カーソルが指す最新スロットのシーケンス番号がカーソルと一致する場合のみ
+完成したフレームとして扱う。
+"""
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .frame_protocol import ALLOWED_DTYPE_KINDS, MAX_NDIM, FrameHeader
+
+MAGIC = b"SDSM"
+RING_VERSION = 2
+
+META = struct.Struct("<4sIII8s4QQ")
+CONTROL_OFFSET = 64
+SLOT_TABLE_OFFSET = 128
+ALIGNMENT = 64
+
+_CURSOR = 0
+_CLOSED = 1
+
+
+def _align(value: int) -> int:
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(slot_count: int, slot_size: int) -> Tuple[int, int, int, int]:
+    """(タイムスタンプ表, 音声取得時刻表, データ領域のオフセット, 1スロットの間隔) を返す"""
+    timestamps_offset = SLOT_TABLE_OFFSET + 8 * slot_count
+    capture_times_offset = timestamps_offset + 8 * slot_count
+    data_offset = _align(capture_times_offset + 8 * slot_count)
+    return timestamps_offset, capture_times_offset, data_offset, _align(slot_size)
+
+
+# このプロセスで作成した共有メモリの名前（resource_tracker への登録は作成側が持つ）
+_created_names = set()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """既存の共有メモリに接続（読み出し側の終了時に削除されないよう追跡を外す）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.12以前は track 引数がないため、resource_tracker から登録を外す。
+        # 同じプロセスで作成したものは作成側の unlink が登録を外すので触らない
+        shm = shared_memory.SharedMemory(name=name)
+        if shm._name not in _created_names:
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        return shm
+
+
+class SharedFrameRing:
+    """共有メモリ上のフレームリング
+
+    create() で書き込み側として作成し、attach() で読み出し側として接続する。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+
+        magic, version, slot_count, ndim, dtype_code, *rest = META.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != RING_VERSION:
+            raise ValueError(f"共有メモリ {shm.name} はフレームリングではありません")
+        self.slot_count = slot_count
+        self.shape = tuple(rest[:MAX_NDIM][:ndim])
+        self.dtype = np.dtype(dtype_code.rstrip(b"\0").decode("ascii"))
+        if self.dtype.kind not in ALLOWED_DTYPE_KINDS:
+            raise ValueError(f"未対応のdtype: {self.dtype}")
+        slot_size = rest[MAX_NDIM]
+
+        timestamps_offset, capture_times_offset, data_offset, slot_stride = _layout(slot_count, slot_size)
+        self._control = np.ndarray((2,), dtype=np.int64, buffer=shm.buf, offset=CONTROL_OFFSET)
+        self._slot_sequences = np.ndarray((slot_count,), dtype=np.int64, buffer=shm.buf, offset=SLOT_TABLE_OFFSET)
+        self._slot_timestamps = np.ndarray((slot_count,), dtype=np.float64, buffer=shm.buf, offset=timestamps_offset)
+        self._slot_capture_times = np.ndarray(
+            (slot_count,), dtype=np.float64, buffer=shm.buf, offset=capture_times_offset
+        )
+        self._slots = [
+            np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf, offset=data_offset + i * slot_stride)
+            for i in range(slot_count)
+        ]
+
+    @classmethod
+    def create(cls, name: str, shape, dtype, slot_count: int = 4) -> "SharedFrameRing":
+        """書き込み側としてリングを作成（同名の残骸があれば削除して作り直す）"""
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        if slot_count < 2:
+            raise ValueError(f"slot_count must be >= 2, got {slot_count}")
+        if len(shape) > MAX_NDIM:
+            raise ValueError(f"ndim must be <= {MAX_NDIM}, got {len(shape)}")
+        slot_size = int(np.prod(shape)) * dtype.itemsize
+        _, _, data_offset, slot_stride = _layout(slot_count, slot_size)
+        size = data_offset + slot_stride * slot_count
+
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 前回異常終了したプロセスの残骸（unlink で追跡も外れるので追跡したまま開く）
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            _created_names.discard(stale._name)
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created_names.add(shm._name)
+
+        padded_shape = shape + (0,) * (MAX_NDIM - len(shape))
+        META.pack_into(
+            shm.buf, 0, MAGIC, RING_VERSION, slot_count, len(shape), dtype.str.encode("ascii"), *padded_shape, slot_size
+        )
+        ring = cls(shm, owner=True)
+        ring._control[:] = 0
+        ring._slot_sequences[:] = 0
+        ring._slot_timestamps[:] = 0.0
+        ring._slot_capture_times[:] = 0.0
+        return ring
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedFrameRing":
+        """読み出し側として既存のリングに接続"""
+        return cls(_attach(name), owner=False)
+
+    @property
+    def closed(self) -> bool:
+        """書き込み側がリングを閉じたか（作り直し・終了時）"""
+        return self._control is None or bool(self._control[_CLOSED])
+
+    def write(self, frame: np.ndarray, timestamp: float, capture_time: Optional[float] = None) -> int:
+        """次のスロットへフレームを書き込み、シーケンス番号を返す"""
+        sequence = int(self._control[_CURSOR]) + 1
+        slot = sequence % self.slot_count
+        self._slot_sequences[slot] = -1  # 書き込み中
+        np.copyto(self._slots[slot], frame)
+        self._slot_timestamps[slot] = timestamp
+        self._slot_capture_times[slot] = capture_time or 0.0
+        self._slot_sequences[slot] = sequence
+        self._control[_CURSOR] = sequence
+        return sequence
+
+    def read_latest(self, copy: bool = False) -> Tuple[Optional[np.ndarray], Optional[FrameHeader]]:
+        """最新の完成済みスロットを (frame, header) で返す（まだなければ (None, None)）
+
+        copy=False の場合はスロットへのビューを返す。そのスロットは
+        slot_count - 1 フレーム後に上書きされるため、保持する場合はコピーすること。
+        """
+        while True:
+            sequence = int(self._control[_CURSOR])
+            if sequence == 0:
+                return None, None
+            slot = sequence % self.slot_count
+            if int(self._slot_sequences[slot]) != sequence:
+                continue  # 読み出し中に追い越された
+            timestamp = float(self._slot_timestamps[slot])
+            capture_time = float(self._slot_capture_times[slot]) or None
+            frame = self._slots[slot]
+            if copy:
+                frame = frame.copy()
+                if int(self._slot_sequences[slot]) != sequence:
+                    continue
+            return frame, FrameHeader(sequence, timestamp, frame.nbytes, capture_time=capture_time)
+
+    def close(self) -> None:
+        """リングを閉じる（書き込み側は共有メモリを削除する）"""
+        if self.owner:
+            self._control[_CLOSED] = 1
+        # 共有メモリを参照するビューを先に解放する
+        self._control = self._slot_sequences = self._slot_timestamps = self._slot_capture_times = None
+        self._slots = []
+        try:
+            self.shm.close()
+        except BufferError:
+            # 呼び出し側がまだフレームのビューを保持している
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            _created_names.discard(self.shm._name)
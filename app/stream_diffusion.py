@@ -1,4 +1,4 @@
-from typing import Literal
+from typing import Literal, Optional
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -6,8 +6,62 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import torch
 
 from .utils import StreamDiffusionWrapper
+from .cpu_precision import PRECISION_MODES
+from .frame_recorder import load_frames
+from .model_registry import ModelKey
 from config import config
 
+# use_kohaku_model で使う芸術特化モデル（ref版）
+KOHAKU_MODEL_ID = "KBlueLeaf/kohaku-v2.1"
+
+
+def resolve_device(name: str = None) -> torch.device:
+    """推論に使うデバイス（省略時は config.json。使えなければ CPU）"""
+    if name is None:
+        name = config.device
+    if name == "mps" and not torch.backends.mps.is_available():
+        print("⚠️ MPS が使えないため CPU を使います")
+        name = "cpu"
+    elif name == "cuda" and not torch.cuda.is_available():
+        print("⚠️ CUDA が使えないため CPU を使います")
+        name = "cpu"
+    return torch.device(name)
+
+
+def model_key_for(
+    model_id_or_path: str = None,
+    use_tiny_vae: bool = True,
+    guidance_scale: float = None,
+    optimize_for_speed: bool = None,
+    use_kohaku_model: bool = None,
+    device: torch.device = None,
+    cpu_precision: str = None,
+) -> ModelKey:
+    """StreamDiffusion をこの設定（省略したものは config.json）で作ったときのモデルのキー"""
+    if model_id_or_path is None:
+        model_id_or_path = config.model_id
+    if guidance_scale is None:
+        guidance_scale = config.guidance_scale
+    if optimize_for_speed is None:
+        optimize_for_speed = config.get('streamdiffusion.optimize_for_speed', True)
+    if use_kohaku_model is None:
+        use_kohaku_model = config.get('streamdiffusion.use_kohaku_model', False)
+    if use_kohaku_model:
+        model_id_or_path = KOHAKU_MODEL_ID
+    if device is None:
+        device = resolve_device()
+    if cpu_precision is None:
+        cpu_precision = config.cpu_precision
+    # 重みはfloat32のまま（half precisionはCPUで未サポート）。CPU では cpu_precision のモードをキーにする
+    use_cpu_precision = device.type == "cpu" and cpu_precision != "fp32"
+    return ModelKey(
+        model_id=model_id_or_path,
+        t_index_list=(8,),
+        cfg_type="none" if optimize_for_speed else ("self" if guidance_scale > 1.0 else "none"),
+        dtype=cpu_precision if use_cpu_precision else "float32",
+        tiny_vae=use_tiny_vae,
+    )
+
 
 class StreamDiffusion:
     def __init__(
@@ -24,6 +78,16 @@ class StreamDiffusion:
         # ref版の設定を追加（互換性オプション）
         optimize_for_speed: bool = None,
         use_kohaku_model: bool = None,
+        frame_buffer_size: int = None,
+        output_type: Literal["pil", "pt", "np"] = None,
+        # 指定した場合はモデル・t_index_list・cfg_type・dtype・TinyVAE をこのキーに合わせる（ModelRegistry 用）
+        model_key: Optional[ModelKey] = None,
+        # "mps" / "cuda" / "cpu"（使えなければ CPU）と、CPU での精度（app/cpu_precision.py）
+        device: str = None,
+        cpu_precision: str = None,
+        seed: int = None,
+        # int8_static で量子化パラメータを決めるのに使うフレーム数
+        calibration_frames: int = None,
     ) -> None:
         self.prompt = prompt
         
@@ -40,25 +104,35 @@ class StreamDiffusion:
             optimize_for_speed = config.get('streamdiffusion.optimize_for_speed', True)
         if use_kohaku_model is None:
             use_kohaku_model = config.get('streamdiffusion.use_kohaku_model', False)
+        if frame_buffer_size is None:
+            frame_buffer_size = config.frame_buffer_size
+        if output_type is None:
+            output_type = config.output_type
+        if seed is None:
+            seed = -1 if config.use_random_seed else 2  # 設定ファイルからランダムシード設定
+        if calibration_frames is None:
+            calibration_frames = config.calibration_frames
         
-        # デバイス設定（StreamDiffusionのCUDAイベント問題を回避するためCPUを使用）
-        # TODO: MPSサポートのためにStreamDiffusionライブラリの修正が必要
-        self.device = torch.device("mps")
-        print("🖥️ Using CPU (MPS has compatibility issues with StreamDiffusion)")
+        # デバイス設定（streamdiffusion.device。MPS / CUDA が使えなければCPU）
+        self.device = resolve_device(device)
+        print(f"🖥️ Using {self.device.type.upper()}")
         
-        # モデル選択（ref版の芸術特化モデルをオプションで）
-        if use_kohaku_model:
-            model_id_or_path = "KBlueLeaf/kohaku-v2.1"
+        # モデル選択（ref版の芸術特化モデルをオプションで）と、t_index_list・cfg_type・dtype
+        if model_key is None:
+            model_key = model_key_for(
+                model_id_or_path, use_tiny_vae, guidance_scale, optimize_for_speed, use_kohaku_model,
+                self.device, cpu_precision,
+            )
+        self.model_key = model_key
+        if model_key.model_id == KOHAKU_MODEL_ID:
             print("🎨 Using Kohaku artistic model")
         
         # 速度最適化設定
         if optimize_for_speed:
-            t_index_list = [8]
             warmup = 1
             num_inference_steps = 16
             print("⚡ Speed optimization enabled")
         else:
-            t_index_list = [8]
             warmup = 10
             num_inference_steps = 16
         
@@ -71,30 +145,56 @@ class StreamDiffusion:
             else:
                 device_str = "cpu"
             
+            # dtype がCPUの精度モードなら、重みはfloat32のままモードで推論する
+            if model_key.dtype in PRECISION_MODES:
+                dtype, cpu_precision = torch.float32, model_key.dtype
+            else:
+                dtype, cpu_precision = getattr(torch, model_key.dtype), "fp32"
+            
             self.stream = StreamDiffusionWrapper(
-                model_id_or_path=model_id_or_path,
-                t_index_list=t_index_list,
+                model_id_or_path=model_key.model_id,
+                t_index_list=list(model_key.t_index_list),
                 warmup=warmup,
                 device=device_str,
                 acceleration=acceleration,
                 mode="img2img",
+                output_type=output_type,
+                frame_buffer_size=frame_buffer_size,
                 use_denoising_batch=use_denoising_batch,
-                use_tiny_vae=use_tiny_vae,
-                cfg_type="none" if optimize_for_speed else ("self" if guidance_scale > 1.0 else "none"),
-                seed=-1 if config.use_random_seed else 2,  # 設定ファイルからランダムシード設定
+                use_tiny_vae=model_key.tiny_vae,
+                cfg_type=model_key.cfg_type,
+                dtype=dtype,
+                seed=seed,
                 local_cache_dir=local_cache_dir,
+                fast_load=config.fast_load,
+                offline=config.offline_models,
+                cpu_precision=cpu_precision,
             )
             
-            # CPU使用時はfloat32のまま（half precisionはCPUで未サポート）
-            print("🔧 Using float32 precision for CPU compatibility")
+            # プロンプト変更時は埋め込みを補間して切り替える
+            self.stream.transition_method = config.prompt_transition
+            self.stream.transition_frames = config.prompt_transition_frames
+
+            print(f"🔧 Using {model_key.dtype} precision")
             
-            self.stream.prepare(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                delta=delta,
-            )
+            with self.stream.startup_profile.phase("prepare:prompt"):
+                self.stream.prepare(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    delta=delta,
+                )
+            frames = None
+            if not self.stream.calibrated:
+                # int8_static: 録画（なければ合成画像）のフレームで活性化の範囲を記録する
+                frames = load_frames(calibration_frames, config.sd_side_length, config.calibration_recording or None)
+                self.stream.calibrate(frames)
+            # 最初のフレームだけにかかるコスト（メモリ確保・カーネル選択など）を起動時に払い、レポートに含める
+            if frames is None:
+                frames = load_frames(frame_buffer_size, config.sd_side_length, config.calibration_recording or None)
+            self.stream.run_warmup(frames)
+            print(self.stream.startup_profile.format_report())
             
         except Exception as e:
             print(f"❌ モデル初期化エラー: {e}")
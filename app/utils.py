@@ -1,11 +1,17 @@
 # https://github.com/cumulo-autumn/StreamDiffusion/blob/main/utils/wrapper.py
 import gc
 import os
+import threading
+import time
 import traceback
+from collections import deque
 from pathlib import Path
-from typing import Dict, List, Literal, Optional, Union
+from typing import Dict, List, Literal, Optional, Sequence, Union
 
 import numpy as np
+
+# diffusers / streamdiffusion の import にかかった時間（起動時間の計測に含める）
+_import_started = time.perf_counter()
 import torch
 from diffusers.models.autoencoder_tiny import AutoencoderTiny
 from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import (
@@ -15,6 +21,23 @@ from PIL import Image
 from streamdiffusion import StreamDiffusion
 from streamdiffusion.image_utils import postprocess_image
 
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+from .latency import FrameProvenance
+from .cpu_precision import apply_precision, autocast_context, convert_static_int8, resolve_mode
+from .model_cache import (
+    DEFAULT_LCM_LORA_ID,
+    DEFAULT_TINY_VAE_ID,
+    FEATURE_EXTRACTOR_ID,
+    SAFETY_CHECKER_ID,
+    ModelCache,
+)
+from .model_loader import StartupProfile, load_snapshot, save_snapshot, snapshot_path
+from .model_registry import shared_component
+from .preprocess import ArrayPreprocessor
+from .prompt_cache import PromptEmbeddingCache, get_prompt_cache
+from .prompt_transition import transition_steps
+
 torch.set_grad_enabled(False)
 torch.backends.cuda.matmul.allow_tf32 = True
 torch.backends.cudnn.allow_tf32 = True
@@ -50,6 +73,10 @@ class StreamDiffusionWrapper:
         use_safety_checker: bool = False,
         engine_dir: Optional[Union[str, Path]] = "engines",
         local_cache_dir: str = "./models",
+        prompt_cache: Optional[PromptEmbeddingCache] = None,
+        fast_load: bool = True,
+        offline: bool = False,
+        cpu_precision: str = "fp32",
     ):
         """
         Initializes the StreamDiffusionWrapper.
@@ -87,7 +114,8 @@ class StreamDiffusionWrapper:
         height : int, optional
             The height of the image, by default 512.
         warmup : int, optional
-            The number of warmup steps to perform, by default 10.
+            The number of warmup inference calls run by run_warmup(),
+            by default 10.
         acceleration : Literal["none", "xformers", "tensorrt"], optional
             The acceleration method, by default "tensorrt".
         do_add_noise : bool, optional
@@ -116,7 +144,31 @@ class StreamDiffusionWrapper:
             The seed, by default 2.
         use_safety_checker : bool, optional
             Whether to use safety checker or not, by default False.
+        prompt_cache : Optional[PromptEmbeddingCache], optional
+            The cache of prompt embeddings consulted before running the
+            text encoder, by default the process-wide shared cache.
+        fast_load : bool, optional
+            Whether to load from (and write) a single-file safetensors
+            snapshot of the pipeline next to the local cache, with
+            low_cpu_mem_usage and parallel component loads,
+            by default True.
+        offline : bool, optional
+            Whether to load every component (pipeline, TinyVAE, LCM-LoRA,
+            safety checker) strictly from local_cache_dir without accessing
+            the Hugging Face Hub, by default False.
+        cpu_precision : str, optional
+            The reduced-precision mode on CPU: "fp32", "bf16" (autocast of
+            the UNet and VAE), "int8_dynamic" (int8 UNet Linear layers) or
+            "int8_static" (int8 UNet Linear and Conv2d layers; needs
+            calibrate() before use), by default "fp32". Ignored on other
+            devices.
         """
+        # 起動のフェーズごとの所要時間（startup_profile.format_report() で表示）
+        self.startup_profile = StartupProfile()
+        self.startup_profile.add("import", IMPORT_SECONDS)
+        self.fast_load = fast_load
+        # すべてのコンポーネントは local_cache_dir のキャッシュを通して読み込む
+        self.model_cache = ModelCache(local_cache_dir, offline=offline)
         self.sd_turbo = "turbo" in model_id_or_path
 
         if mode == "txt2img":
@@ -138,16 +190,25 @@ class StreamDiffusionWrapper:
         else:
             self.device = torch.device("cpu")
         self.dtype = dtype
+        self.cpu_precision = resolve_mode(cpu_precision, self.device)
         self.width = width
         self.height = height
         self.mode = mode
         self.output_type = output_type
         self.frame_buffer_size = frame_buffer_size
+        # run_warmup() で起動時に行う推論の回数
+        self.warmup_steps = warmup
         self.batch_size = len(t_index_list) * frame_buffer_size if use_denoising_batch else frame_buffer_size
 
         self.use_denoising_batch = use_denoising_batch
         self.use_safety_checker = use_safety_checker
 
+        # preprocess_array の出力バッファ（前処理済み・バッチ待ち・推論中のフレームが同時に残るため 2K+2 個）
+        self._array_preprocessor = (
+            ArrayPreprocessor(width, height, self.device, dtype, buffers=2 * frame_buffer_size + 2)
+            if width == height else None
+        )
+
         self.stream: StreamDiffusion = self._load_model(
             model_id_or_path=model_id_or_path,
             lora_dict=lora_dict,
@@ -155,7 +216,6 @@ class StreamDiffusionWrapper:
             vae_id=vae_id,
             t_index_list=t_index_list,
             acceleration=acceleration,
-            warmup=warmup,
             do_add_noise=do_add_noise,
             use_lcm_lora=use_lcm_lora,
             use_tiny_vae=use_tiny_vae,
@@ -165,12 +225,37 @@ class StreamDiffusionWrapper:
             local_cache_dir=local_cache_dir,
         )
 
+        with self.startup_profile.phase("precision"):
+            apply_precision(self.stream.unet, self.cpu_precision)
+        # int8_static は calibrate() で活性化の範囲を記録するまで float のまま
+        self.calibrated = self.cpu_precision != "int8_static"
+
         if device_ids is not None:
             self.stream.unet = torch.nn.DataParallel(self.stream.unet, device_ids=device_ids)
 
         if enable_similar_image_filter:
             self.stream.enable_similar_image_filter(similar_image_filter_threshold, similar_image_filter_max_skip_frame)
 
+        # prepare() / update_prompt() のテキストエンコードをキャッシュ経由にする
+        # （LoRA がテキストエンコーダに効く場合があるため、キーのモデルIDに含める）
+        self.prompt_cache = prompt_cache if prompt_cache is not None else get_prompt_cache()
+        cache_model_id = model_id_or_path
+        if lora_dict:
+            cache_model_id += "+" + ",".join(f"{name}:{scale}" for name, scale in sorted(lora_dict.items()))
+        self.stream.pipe.encode_prompt = self.prompt_cache.wrap(self.stream.pipe.encode_prompt, cache_model_id)
+
+        # 推論中に条件付け（プロンプト埋め込み・guidance_scale・delta）が入れ替わらないようにする
+        self._conditioning_lock = threading.Lock()
+        self.prompt = None
+        self.negative_prompt = ""
+        # reset_state() で prepare() をやり直すための引数
+        self._prepare_kwargs = None
+        # update_conditioning で埋め込みを補間しながら切り替えるフレーム数と方法（prompt_transition）
+        self.transition_frames = 0
+        self.transition_method = "slerp"
+        # 次の推論から1つずつ使う埋め込み
+        self._transition = deque()
+
     def prepare(
         self,
         prompt: str,
@@ -194,18 +279,150 @@ class StreamDiffusionWrapper:
             The delta multiplier of virtual residual noise,
             by default 1.0.
         """
-        self.stream.prepare(
-            prompt,
-            negative_prompt,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            delta=delta,
+        with self._conditioning_lock:
+            self.stream.prepare(
+                prompt,
+                negative_prompt,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                delta=delta,
+            )
+            self._transition.clear()
+            self.prompt = prompt
+            self.negative_prompt = negative_prompt
+            self._prepare_kwargs = dict(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                delta=delta,
+            )
+
+    def reset_state(self) -> None:
+        """
+        Re-runs prepare() with the arguments of the last call.
+
+        The generator is re-seeded with the seed the model was loaded
+        with and the noise and latent buffers are rebuilt, so runs that
+        have already inferred (e.g. calibrate()) can be compared from
+        the same starting state.
+        """
+        if self._prepare_kwargs is None:
+            raise RuntimeError("prepare() has not been called")
+        kwargs = dict(self._prepare_kwargs)
+        with self._conditioning_lock:
+            self.stream.prepare(
+                kwargs.pop("prompt"),
+                kwargs.pop("negative_prompt"),
+                generator=torch.manual_seed(self.seed),
+                seed=self.seed,
+                **kwargs,
+            )
+            self._transition.clear()
+
+    def update_conditioning(self, prompt: str, negative_prompt: Optional[str] = None) -> None:
+        """
+        Swaps the prompt conditioning without re-running prepare().
+
+        Only the text is encoded (or taken from the prompt cache); the
+        timesteps, scheduler coefficients, noise buffers and generator
+        are left untouched, so the next frame continues smoothly. The
+        embeddings are swapped between frames.
+
+        With transition_frames > 1 the embeddings morph from the current
+        ones to the new ones over that many inference calls, using steps
+        interpolated once here (see prompt_transition).
+
+        Parameters
+        ----------
+        prompt : str
+            The prompt to generate images from.
+        negative_prompt : Optional[str], optional
+            The negative prompt, by default the current one.
+        """
+        if negative_prompt is None:
+            negative_prompt = self.negative_prompt
+        prompt_embeds = self._encode_conditioning(prompt, negative_prompt, self.stream.guidance_scale)
+        with self._conditioning_lock:
+            # 遷移の途中で切り替えた場合も、今使っている埋め込みから続けて補間する
+            steps = transition_steps(
+                self.stream.prompt_embeds, prompt_embeds, self.transition_frames, self.transition_method
+            )
+            self._transition = deque(steps)
+            self.prompt = prompt
+            self.negative_prompt = negative_prompt
+
+    def update_guidance(self, guidance_scale: Optional[float] = None, delta: Optional[float] = None) -> None:
+        """
+        Changes guidance_scale and/or delta without re-running prepare().
+
+        Both are read by the stream on every step, so this is a plain
+        attribute swap between frames. The prompt is re-encoded only when
+        guidance_scale crosses 1.0 with cfg_type "full" or "initialize",
+        because that changes whether the negative prompt embeddings are
+        part of the batch.
+
+        Parameters
+        ----------
+        guidance_scale : Optional[float], optional
+            The new guidance scale (ignored with cfg_type "none").
+        delta : Optional[float], optional
+            The new delta multiplier of virtual residual noise.
+        """
+        stream = self.stream
+        prompt_embeds = None
+        if guidance_scale is not None:
+            if stream.cfg_type == "none":
+                guidance_scale = 1.0
+            uses_negative = stream.cfg_type in ("full", "initialize")
+            if uses_negative and (guidance_scale > 1.0) != (stream.guidance_scale > 1.0) and self.prompt is not None:
+                prompt_embeds = self._encode_conditioning(self.prompt, self.negative_prompt, guidance_scale)
+        with self._conditioning_lock:
+            if guidance_scale is not None:
+                stream.guidance_scale = guidance_scale
+            if delta is not None:
+                stream.delta = delta
+            if prompt_embeds is not None:
+                self._transition.clear()
+                stream.prompt_embeds = prompt_embeds
+
+    def _advance_transition(self) -> None:
+        """
+        Moves a pending prompt transition one frame forward.
+
+        Must be called with the conditioning lock held.
+        """
+        if self._transition:
+            self.stream.prompt_embeds = self._transition.popleft()
+
+    def _encode_conditioning(self, prompt: str, negative_prompt: str, guidance_scale: float) -> torch.Tensor:
+        """
+        Builds the prompt_embeds batch the same way StreamDiffusion.prepare does.
+        """
+        stream = self.stream
+        # prepare() と同じく cfg_type "none" ではネガティブプロンプトをエンコードしない
+        do_classifier_free_guidance = guidance_scale > 1.0 and stream.cfg_type != "none"
+        encoder_output = stream.pipe.encode_prompt(
+            prompt=prompt,
+            device=self.device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=do_classifier_free_guidance,
+            negative_prompt=negative_prompt,
         )
+        prompt_embeds = encoder_output[0].repeat(stream.batch_size, 1, 1)
+        if do_classifier_free_guidance and stream.cfg_type in ("full", "initialize"):
+            if stream.use_denoising_batch and stream.cfg_type == "full":
+                uncond_prompt_embeds = encoder_output[1].repeat(stream.batch_size, 1, 1)
+            else:
+                uncond_prompt_embeds = encoder_output[1].repeat(stream.frame_bff_size, 1, 1)
+            prompt_embeds = torch.cat([uncond_prompt_embeds, prompt_embeds], dim=0)
+        return prompt_embeds.to(device=self.device, dtype=self.dtype)
 
     def __call__(
         self,
         image: Optional[Union[str, Image.Image, torch.Tensor]] = None,
         prompt: Optional[str] = None,
+        provenance: Optional[FrameProvenance] = None,
     ) -> Union[Image.Image, List[Image.Image]]:
         """
         Performs img2img or txt2img based on the mode.
@@ -216,6 +433,9 @@ class StreamDiffusionWrapper:
             The image to generate from.
         prompt : Optional[str]
             The prompt to generate images from.
+        provenance : Optional[FrameProvenance]
+            If given, the inference and postprocess stages of img2img
+            are marked on it.
 
         Returns
         -------
@@ -223,7 +443,7 @@ class StreamDiffusionWrapper:
             The generated image.
         """
         if self.mode == "img2img":
-            return self.img2img(image, prompt)
+            return self.img2img(image, prompt, provenance)
         else:
             return self.txt2img(prompt)
 
@@ -244,10 +464,14 @@ class StreamDiffusionWrapper:
         if prompt is not None:
             self.stream.update_prompt(prompt)
 
-        if self.sd_turbo:
-            image_tensor = self.stream.txt2img_sd_turbo(self.batch_size)
-        else:
-            image_tensor = self.stream.txt2img(self.frame_buffer_size)
+        with self._conditioning_lock, autocast_context(self.cpu_precision):
+            self._advance_transition()
+            if self.sd_turbo:
+                image_tensor = self.stream.txt2img_sd_turbo(self.batch_size)
+            else:
+                image_tensor = self.stream.txt2img(self.frame_buffer_size)
+        # autocast の出力（bfloat16）をモデルの dtype に戻す
+        image_tensor = image_tensor.to(self.dtype)
         image = self.postprocess_image(image_tensor, output_type=self.output_type)
 
         if self.use_safety_checker:
@@ -261,7 +485,10 @@ class StreamDiffusionWrapper:
         return image
 
     def img2img(
-        self, image: Union[str, Image.Image, torch.Tensor], prompt: Optional[str] = None
+        self,
+        image: Union[str, Image.Image, torch.Tensor],
+        prompt: Optional[str] = None,
+        provenance: Optional[FrameProvenance] = None,
     ) -> Union[Image.Image, List[Image.Image], torch.Tensor, np.ndarray]:
         """
         Performs img2img.
@@ -270,6 +497,9 @@ class StreamDiffusionWrapper:
         ----------
         image : Union[str, Image.Image, torch.Tensor]
             The image to generate from.
+        provenance : Optional[FrameProvenance]
+            If given, the preprocess (when the image is not a tensor),
+            inference and postprocess stages are marked on it.
 
         Returns
         -------
@@ -279,10 +509,123 @@ class StreamDiffusionWrapper:
         if prompt is not None:
             self.stream.update_prompt(prompt)
 
+        image_tensor = self.infer(image, provenance)
+        return self.postprocess_output(image_tensor, provenance)
+
+    def infer(
+        self,
+        image: Union[str, Image.Image, torch.Tensor, Sequence[torch.Tensor]],
+        provenance: Optional[Union[FrameProvenance, Sequence[FrameProvenance]]] = None,
+    ) -> torch.Tensor:
+        """
+        Runs the img2img denoising step without postprocessing.
+
+        Together with postprocess_output this splits img2img so that
+        the two halves can run on different pipeline stages.
+
+        Parameters
+        ----------
+        image : Union[str, Image.Image, torch.Tensor, Sequence[torch.Tensor]]
+            The image to generate from. With frame_buffer_size > 1, a
+            sequence of frame_buffer_size preprocessed tensors is
+            concatenated into one batch.
+        provenance : Optional[Union[FrameProvenance, Sequence[FrameProvenance]]]
+            If given, the preprocess (when the image is not a tensor)
+            and inference stages are marked on it (on each one for a
+            batch).
+
+        Returns
+        -------
+        torch.Tensor
+            The generated image tensor on the device.
+        """
         if isinstance(image, str) or isinstance(image, Image.Image):
             image = self.preprocess_image(image)
+            self._mark(provenance, "preprocess")
+        elif isinstance(image, (list, tuple)):
+            image = torch.cat(image) if len(image) > 1 else image[0]
+
+        with self._conditioning_lock, autocast_context(self.cpu_precision):
+            self._advance_transition()
+            image_tensor = self.stream(image)
+        image_tensor = image_tensor.to(self.dtype)
+        if provenance is not None:
+            # 非同期に投入されたカーネルの完了を待ってから記録する
+            # （後処理の .cpu() でどのみち待つため、全体の時間は変わらない）
+            self._synchronize()
+            self._mark(provenance, "inference")
+        return image_tensor
+
+    def calibrate(self, frames: Sequence[np.ndarray]) -> None:
+        """
+        Records the UNet activation ranges over frames and converts the
+        int8_static layers to int8. Does nothing in other modes or once
+        calibrated.
+
+        Parameters
+        ----------
+        frames : Sequence[np.ndarray]
+            RGB uint8 frames (HxWx3) representative of the input, e.g.
+            from a frame recording. They are fed frame_buffer_size at a
+            time.
+        """
+        if self.calibrated:
+            return
+        started = time.perf_counter()
+        size = self.frame_buffer_size
+        for start in range(0, len(frames) - size + 1, size):
+            self.infer([self.preprocess_array(frame, "rgb") for frame in frames[start:start + size]])
+        convert_static_int8(self.stream.unet)
+        self.calibrated = True
+        self.startup_profile.add("calibrate", time.perf_counter() - started)
+        print(f"🔢 {len(frames)} フレームで int8 の量子化パラメータを決めました")
+
+    def run_warmup(self, frames: Sequence[np.ndarray]) -> None:
+        """
+        Runs warmup_steps inference calls so that the one-off cost of
+        the first frames (allocations, kernel selection, lazy
+        initialization) is paid at startup and reported as the
+        "warmup" phase. The stream state is reset afterwards, so the
+        first real frame starts from the prepared state.
+
+        Parameters
+        ----------
+        frames : Sequence[np.ndarray]
+            RGB uint8 frames (HxWx3) used as input, frame_buffer_size
+            at a time and cycled as needed.
+        """
+        if not self.warmup_steps or not len(frames):
+            return
+        size = self.frame_buffer_size
+        with self.startup_profile.phase("warmup"):
+            for step in range(self.warmup_steps):
+                batch = [frames[(step * size + i) % len(frames)] for i in range(size)]
+                self.infer([self.preprocess_array(frame, "rgb") for frame in batch])
+            self.reset_state()
+        print(f"🔥 {self.warmup_steps} 回のウォームアップ推論を行いました")
+
+    def postprocess_output(
+        self,
+        image_tensor: torch.Tensor,
+        provenance: Optional[Union[FrameProvenance, Sequence[FrameProvenance]]] = None,
+    ) -> Union[Image.Image, List[Image.Image], torch.Tensor, np.ndarray]:
+        """
+        Converts the output of infer to output_type and applies the
+        safety checker.
+
+        Parameters
+        ----------
+        image_tensor : torch.Tensor
+            The tensor returned by infer.
+        provenance : Optional[Union[FrameProvenance, Sequence[FrameProvenance]]]
+            If given, the postprocess stage is marked on it.
 
-        image_tensor = self.stream(image)
+        Returns
+        -------
+        Union[Image.Image, List[Image.Image], torch.Tensor, np.ndarray]
+            The generated image, or a list of frame_buffer_size images
+            when frame_buffer_size > 1.
+        """
         image = self.postprocess_image(image_tensor, output_type=self.output_type)
 
         if self.use_safety_checker:
@@ -293,16 +636,42 @@ class StreamDiffusionWrapper:
             )
             image = self.nsfw_fallback_img if has_nsfw_concept[0] else image
 
+        self._mark(provenance, "postprocess")
         return image
 
-    def preprocess_image(self, image: Union[str, Image.Image]) -> torch.Tensor:
+    @staticmethod
+    def _mark(provenance, stage: str) -> None:
+        """
+        Marks a stage on a provenance or on each provenance of a batch.
+        """
+        if provenance is None:
+            return
+        if isinstance(provenance, FrameProvenance):
+            provenance.mark(stage)
+            return
+        timestamp = time.time()
+        for item in provenance:
+            item.mark(stage, timestamp)
+
+    def _synchronize(self) -> None:
+        """
+        Waits for all queued work on the device to finish.
+        """
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+        elif self.device.type == "mps":
+            torch.mps.synchronize()
+
+    def preprocess_image(self, image: Union[str, Image.Image, np.ndarray]) -> torch.Tensor:
         """
         Preprocesses the image.
 
         Parameters
         ----------
-        image : Union[str, Image.Image, torch.Tensor]
-            The image to preprocess.
+        image : Union[str, Image.Image, np.ndarray]
+            The image to preprocess. A numpy array must be an RGB
+            float32 HWC array already scaled to [0, 1] and sized
+            (height, width).
 
         Returns
         -------
@@ -320,6 +689,47 @@ class StreamDiffusionWrapper:
         preprocessed = (preprocessed + 1.0) / 2.0
         return preprocessed.to(device=self.device, dtype=self.dtype)
 
+    def preprocess_array(
+        self, frame: np.ndarray, channels: Literal["rgb", "bgr"] = "rgb", crop_size: Optional[int] = None
+    ) -> torch.Tensor:
+        """
+        Preprocesses an HWC frame without going through PIL.
+
+        The result is bit-identical to preprocess_image on the PIL image
+        obtained by converting the frame to RGB, cropping its center to
+        crop_size (padding with black) and resizing it with NEAREST.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            A uint8 HWC frame, or a float32 one already scaled to [0, 1].
+        channels : Literal["rgb", "bgr"], optional
+            The channel order of the frame, by default "rgb".
+        crop_size : Optional[int], optional
+            The side length of the center crop, by default None
+            (no crop).
+
+        Returns
+        -------
+        torch.Tensor
+            The preprocessed image. It is written into a reused buffer
+            and stays valid for the next 2 * frame_buffer_size + 1 calls.
+        """
+        if self._array_preprocessor is not None:
+            return self._array_preprocessor(frame, channels, crop_size)
+
+        # 正方形でない出力は PIL の経路で処理する
+        if channels == "bgr":
+            frame = frame[:, :, ::-1]
+        if frame.dtype != np.uint8:
+            frame = (frame * 255.0).round().astype(np.uint8)
+        image = Image.fromarray(np.ascontiguousarray(frame))
+        if crop_size is not None:
+            left = (image.width - crop_size) // 2
+            top = (image.height - crop_size) // 2
+            image = image.crop((left, top, left + crop_size, top + crop_size))
+        return self.preprocess_image(image.resize((self.width, self.height), Image.NEAREST))
+
     def postprocess_image(
         self, image_tensor: torch.Tensor, output_type: str = "pil"
     ) -> Union[Image.Image, List[Image.Image], torch.Tensor, np.ndarray]:
@@ -331,15 +741,25 @@ class StreamDiffusionWrapper:
         image_tensor : torch.Tensor
             The image tensor to postprocess.
 
+        output_type : str, optional
+            "pil", "np" (float32 NHWC in [0, 1]), "pt" (CPU NCHW in
+            [0, 1], in the model dtype) or "latent", by default "pil".
+
         Returns
         -------
-        Union[Image.Image, List[Image.Image]]
-            The postprocessed image.
+        Union[Image.Image, List[Image.Image], torch.Tensor, np.ndarray]
+            The postprocessed image, or the whole batch when
+            frame_buffer_size > 1.
         """
-        if self.frame_buffer_size > 1:
-            return postprocess_image(image_tensor.cpu(), output_type=output_type)
+        if output_type in ("pt", "np"):
+            # 正規化の解除はデバイス上でバッチごとに行い、CPU への転送は1回だけ
+            # （値は streamdiffusion の postprocess_image と同じ）
+            image = (image_tensor / 2 + 0.5).clamp_(0, 1).cpu()
+            if output_type == "np":
+                image = image.permute(0, 2, 3, 1).float().numpy()
         else:
-            return postprocess_image(image_tensor.cpu(), output_type=output_type)[0]
+            image = postprocess_image(image_tensor.cpu(), output_type=output_type)
+        return image if self.frame_buffer_size > 1 else image[0]
 
     def _load_model(
         self,
@@ -349,7 +769,6 @@ class StreamDiffusionWrapper:
         lcm_lora_id: Optional[str] = None,
         vae_id: Optional[str] = None,
         acceleration: Literal["none", "xformers", "tensorrt"] = "tensorrt",
-        warmup: int = 10,
         do_add_noise: bool = True,
         use_lcm_lora: bool = True,
         use_tiny_vae: bool = True,
@@ -386,8 +805,6 @@ class StreamDiffusionWrapper:
             The vae_id to load, by default None.
         acceleration : Literal["none", "xfomers", "sfast", "tensorrt"], optional
             The acceleration method, by default "tensorrt".
-        warmup : int, optional
-            The number of warmup steps to perform, by default 10.
         do_add_noise : bool, optional
             Whether to add noise for following denoising steps or not,
             by default True.
@@ -408,59 +825,71 @@ class StreamDiffusionWrapper:
             The loaded model.
         """
 
-        # ローカルキャッシュディレクトリのパス
-        local_model_path = os.path.join(local_cache_dir, model_id_or_path.replace("/", "--"))
-        
-        # ローカルキャッシュから読み込みを試行
-        if os.path.exists(local_model_path):
-            print(f"📁 ローカルキャッシュから読み込み: {local_model_path}")
+        profile = self.startup_profile
+        cache = self.model_cache
+        # ローカルキャッシュディレクトリのパス（fast_load ではその隣の1ファイルのスナップショットも使う）
+        local_model_path = cache.local_path(model_id_or_path)
+        local_snapshot_path = snapshot_path(local_model_path)
+        pipe = None
+
+        if self.fast_load and os.path.exists(local_snapshot_path):
+            print(f"📁 スナップショットから読み込み: {local_snapshot_path}")
             try:
-                pipe: StableDiffusionPipeline = StableDiffusionPipeline.from_pretrained(
-                    local_model_path,
-                    low_cpu_mem_usage=False,
-                ).to(device=self.device, dtype=self.dtype)
+                # 読み込み・デバイスへの転送はコンポーネントごとに並行して行われる
+                pipe = load_snapshot(local_snapshot_path, self.device, self.dtype, profile)
             except Exception as e:
-                print(f"❌ ローカルキャッシュからの読み込みに失敗: {e}")
-                print("🔄 Hugging Faceから再ダウンロードします...")
+                print(f"❌ スナップショットからの読み込みに失敗: {e}")
                 pipe = None
-        else:
-            pipe = None
-        
-        # ローカルから読み込めなかった場合、Hugging Faceからダウンロード
+
+        def read_pipeline(path: str) -> StableDiffusionPipeline:
+            with profile.phase("read"):
+                return StableDiffusionPipeline.from_pretrained(
+                    path,
+                    low_cpu_mem_usage=self.fast_load,
+                    local_files_only=True,
+                )
+
         if pipe is None:
             try:
-                print(f"🌐 Hugging Faceから読み込み: {model_id_or_path}")
-                pipe: StableDiffusionPipeline = StableDiffusionPipeline.from_pretrained(
-                    model_id_or_path,
-                    low_cpu_mem_usage=False,
-                ).to(device=self.device, dtype=self.dtype)
-                
-                # ローカルキャッシュに保存
-                print(f"💾 ローカルキャッシュに保存: {local_model_path}")
-                os.makedirs(local_cache_dir, exist_ok=True)
-                pipe.save_pretrained(local_model_path)
-
-            except ValueError:  # Load from single file
-                try:
-                    pipe: StableDiffusionPipeline = StableDiffusionPipeline.from_single_file(
-                        model_id_or_path,
-                    ).to(device=self.device, dtype=self.dtype)
-                    
-                    # ローカルキャッシュに保存
-                    print(f"💾 ローカルキャッシュに保存: {local_model_path}")
-                    os.makedirs(local_cache_dir, exist_ok=True)
-                    pipe.save_pretrained(local_model_path)
-                    
-                except Exception as e:
-                    traceback.print_exc()
-                    print(f"❌ モデル読み込みに失敗: {e}")
-                    exit()
-                    
+                if model_id_or_path.endswith((".safetensors", ".ckpt")):  # Load from single file
+                    with profile.phase("read"):
+                        pipe: StableDiffusionPipeline = StableDiffusionPipeline.from_single_file(
+                            model_id_or_path,
+                        )
+                else:
+                    # キャッシュになければ Hugging Face から取得する（offline では取得しない）
+                    with profile.phase("resolve"):
+                        model_path = cache.resolve(model_id_or_path, "pipeline")
+                    print(f"📁 ローカルキャッシュから読み込み: {model_path}")
+                    try:
+                        pipe = read_pipeline(model_path)
+                    except Exception as e:
+                        if cache.offline or model_path != local_model_path:
+                            raise
+                        print(f"❌ ローカルキャッシュからの読み込みに失敗: {e}")
+                        print("🔄 Hugging Faceから再ダウンロードします...")
+                        with profile.phase("download"):
+                            model_path = cache.fetch(model_id_or_path, "pipeline")
+                        pipe = read_pipeline(model_path)
+
             except Exception as e:  # No model found
                 traceback.print_exc()
                 print(f"❌ モデル読み込みに失敗: {e}")
                 exit()
 
+            # スナップショットを保存（デバイス・dtype を変える前の重みを保存する）
+            if self.fast_load:
+                print(f"💾 スナップショットを保存: {local_snapshot_path}")
+                with profile.phase("save_snapshot"):
+                    try:
+                        save_snapshot(pipe, local_snapshot_path)
+                    except Exception as e:
+                        print(f"⚠️ スナップショットの保存に失敗: {e}")
+
+        if pipe.device != self.device or pipe.dtype != self.dtype:
+            with profile.phase("to_device"):
+                pipe = pipe.to(device=self.device, dtype=self.dtype)
+
         stream = StreamDiffusion(
             pipe=pipe,
             t_index_list=t_index_list,
@@ -472,28 +901,32 @@ class StreamDiffusionWrapper:
             use_denoising_batch=self.use_denoising_batch,
             cfg_type=cfg_type,
         )
-        if not self.sd_turbo:
-            if use_lcm_lora:
-                if lcm_lora_id is not None:
-                    stream.load_lcm_lora(pretrained_model_name_or_path_or_dict=lcm_lora_id)
-                else:
-                    stream.load_lcm_lora()
-                stream.fuse_lora()
-
-            if lora_dict is not None:
-                for lora_name, lora_scale in lora_dict.items():
-                    stream.load_lora(lora_name)
-                    stream.fuse_lora(lora_scale=lora_scale)
-                    print(f"Use LoRA: {lora_name} in weights {lora_scale}")
-
-        if use_tiny_vae:
-            if vae_id is not None:
-                stream.vae = AutoencoderTiny.from_pretrained(vae_id).to(device=pipe.device, dtype=pipe.dtype)
-            else:
-                stream.vae = AutoencoderTiny.from_pretrained("madebyollin/taesd").to(
-                    device=pipe.device, dtype=pipe.dtype
+        with profile.phase("lora_fuse"):
+            if not self.sd_turbo:
+                if use_lcm_lora:
+                    stream.load_lcm_lora(
+                        pretrained_model_name_or_path_or_dict=cache.resolve(lcm_lora_id or DEFAULT_LCM_LORA_ID, "lora")
+                    )
+                    stream.fuse_lora()
+
+                if lora_dict is not None:
+                    for lora_name, lora_scale in lora_dict.items():
+                        stream.load_lora(cache.resolve(lora_name, "lora"))
+                        stream.fuse_lora(lora_scale=lora_scale)
+                        print(f"Use LoRA: {lora_name} in weights {lora_scale}")
+
+        with profile.phase("tiny_vae"):
+            if use_tiny_vae:
+                vae_path = cache.resolve(vae_id or DEFAULT_TINY_VAE_ID, "vae")
+                # TinyVAE はモデルによらないので、同じデバイス・dtype のものは常駐モデル間で共有する
+                stream.vae = shared_component(
+                    ("tiny_vae", vae_path, str(pipe.device), pipe.dtype),
+                    lambda: AutoencoderTiny.from_pretrained(vae_path, local_files_only=True).to(
+                        device=pipe.device, dtype=pipe.dtype
+                    ),
                 )
 
+        acceleration_started = time.perf_counter()
         try:
             if acceleration == "xformers":
                 stream.pipe.enable_xformers_memory_efficient_attention()
@@ -639,18 +1072,22 @@ class StreamDiffusionWrapper:
         except Exception:
             traceback.print_exc()
             print("Acceleration has failed. Falling back to normal mode.")
+        if acceleration != "none":
+            profile.add("acceleration", time.perf_counter() - acceleration_started)
 
         if seed < 0:  # Random seed
             seed = np.random.randint(0, 1000000)
-
-        stream.prepare(
-            "",
-            "",
-            num_inference_steps=50,
-            guidance_scale=1.1 if stream.cfg_type in ["full", "self", "initialize"] else 1.0,
-            generator=torch.manual_seed(seed),
-            seed=seed,
-        )
+        self.seed = seed
+
+        with profile.phase("prepare"):
+            stream.prepare(
+                "",
+                "",
+                num_inference_steps=50,
+                guidance_scale=1.1 if stream.cfg_type in ["full", "self", "initialize"] else 1.0,
+                generator=torch.manual_seed(seed),
+                seed=seed,
+            )
 
         if self.use_safety_checker:
             from diffusers.pipelines.stable_diffusion.safety_checker import (
@@ -658,12 +1095,13 @@ class StreamDiffusionWrapper:
             )
             from transformers import CLIPFeatureExtractor
 
-            self.safety_checker = StableDiffusionSafetyChecker.from_pretrained(
-                "CompVis/stable-diffusion-safety-checker"
-            ).to(pipe.device)
-            self.feature_extractor = CLIPFeatureExtractor.from_pretrained("openai/clip-vit-base-patch32")
+            with profile.phase("safety_checker"):
+                self.safety_checker = StableDiffusionSafetyChecker.from_pretrained(
+                    self.model_cache.resolve(SAFETY_CHECKER_ID, "safety_checker"), local_files_only=True
+                ).to(pipe.device)
+                self.feature_extractor = CLIPFeatureExtractor.from_pretrained(
+                    self.model_cache.resolve(FEATURE_EXTRACTOR_ID, "feature_extractor"), local_files_only=True
+                )
             self.nsfw_fallback_img = Image.new("RGB", (512, 512), (0, 0, 0))
 
         return stream
-
-        return stream
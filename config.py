@@ -52,6 +52,14 @@ class Config:
     def display_height(self) -> int:
         return self.get('display.display_height', 2048)
     
+    @property
+    def display_scaler(self) -> str:
+        return self.get('display.display_scaler', 'linear')
+    
+    @property
+    def display_fps(self) -> float:
+        return self.get('display.display_fps', 30)
+    
     # Audio settings
     @property
     def audio_chunk(self) -> int:
@@ -94,6 +102,92 @@ class Config:
     def tcp_port(self) -> int:
         return self.get('network.tcp_port', 65432)
     
+    @property
+    def frame_protocol(self) -> str:
+        return self.get('network.frame_protocol', 'raw')
+    
+    @property
+    def frame_transport(self) -> str:
+        return self.get('network.frame_transport', 'tcp')
+    
+    @property
+    def shm_name(self) -> str:
+        return self.get('network.shm_name', 'sd_frames')
+    
+    @property
+    def shm_slots(self) -> int:
+        return self.get('network.shm_slots', 4)
+    
+    @property
+    def client_queue_size(self) -> int:
+        return self.get('network.client_queue_size', 2)
+    
+    @property
+    def frame_encoding(self) -> str:
+        return self.get('network.frame_encoding', 'raw')
+    
+    @property
+    def frame_quality(self) -> int:
+        return self.get('network.frame_quality', 85)
+    
+    @property
+    def encode_workers(self) -> int:
+        return self.get('network.encode_workers', 2)
+    
+    @property
+    def frame_layout(self) -> str:
+        return self.get('network.frame_layout', 'sd')
+    
+    @property
+    def frame_dtype(self) -> str:
+        return self.get('network.frame_dtype', 'uint8')
+    
+    @property
+    def heartbeat_interval(self) -> float:
+        return self.get('network.heartbeat_interval', 0.05)
+    
+    @property
+    def heartbeat_timeout(self) -> float:
+        return self.get('network.heartbeat_timeout', 0.5)
+    
+    @property
+    def socket_buffer_size(self) -> int:
+        return self.get('network.socket_buffer_size', 4194304)
+    
+    @property
+    def reconnect_max_delay(self) -> float:
+        return self.get('network.reconnect_max_delay', 2.0)
+    
+    @property
+    def reuse_stalled_frame(self) -> bool:
+        return self.get('network.reuse_stalled_frame', False)
+    
+    @property
+    def flow_control(self) -> bool:
+        return self.get('network.flow_control', True)
+    
+    # Visualizer settings
+    @property
+    def send_mode(self) -> str:
+        return self.get('visualizer.send_mode', 'on_request')
+    
+    @property
+    def preview(self) -> bool:
+        return self.get('visualizer.preview', True)
+    
+    @property
+    def record_path(self) -> str:
+        return self.get('visualizer.record_path', '')
+    
+    # Latency settings
+    @property
+    def latency_window(self) -> int:
+        return self.get('latency.window', 300)
+    
+    @property
+    def latency_report_interval(self) -> float:
+        return self.get('latency.report_interval', 10.0)
+    
     # StreamDiffusion settings
     @property
     def sd_side_length(self) -> int:
@@ -127,11 +221,75 @@ class Config:
     def use_kohaku_model(self) -> bool:
         return self.get('streamdiffusion.use_kohaku_model', False)
     
+    @property
+    def frame_buffer_size(self) -> int:
+        return self.get('streamdiffusion.frame_buffer_size', 1)
+    
+    @property
+    def output_type(self) -> str:
+        return self.get('streamdiffusion.output_type', 'pt')
+    
+    @property
+    def fast_load(self) -> bool:
+        return self.get('streamdiffusion.fast_load', True)
+    
+    @property
+    def change_threshold(self) -> float:
+        return self.get('streamdiffusion.change_threshold', 1.5)
+    
+    @property
+    def change_max_skip(self) -> int:
+        return self.get('streamdiffusion.change_max_skip', 30)
+    
+    @property
+    def prompt_cache_entries(self) -> int:
+        return self.get('streamdiffusion.prompt_cache_entries', 64)
+    
+    @property
+    def prompt_cache_mb(self) -> float:
+        return self.get('streamdiffusion.prompt_cache_mb', 64)
+    
+    @property
+    def resident_models(self) -> int:
+        return self.get('streamdiffusion.resident_models', 2)
+    
+    @property
+    def resident_memory_mb(self) -> float:
+        return self.get('streamdiffusion.resident_memory_mb', 12288)
+    
+    @property
+    def switch_models(self) -> List[str]:
+        return self.get('streamdiffusion.switch_models', ["stabilityai/sd-turbo", "KBlueLeaf/kohaku-v2.1"])
+    
+    @property
+    def device(self) -> str:
+        return self.get('streamdiffusion.device', 'mps')
+    
+    @property
+    def cpu_precision(self) -> str:
+        return self.get('streamdiffusion.cpu_precision', 'fp32')
+    
+    @property
+    def calibration_frames(self) -> int:
+        return self.get('streamdiffusion.calibration_frames', 16)
+    
+    @property
+    def calibration_recording(self) -> str:
+        return self.get('streamdiffusion.calibration_recording', '')
+    
     # Creativity settings
     @property
     def frame_blend_alpha(self) -> float:
         return self.get('creativity.frame_blend_alpha', 0.3)
     
+    @property
+    def frame_blend_mode(self) -> str:
+        return self.get('creativity.frame_blend_mode', 'box')
+    
+    @property
+    def frame_blend_decay(self) -> float:
+        return self.get('creativity.frame_blend_decay', 0.5)
+    
     @property
     def max_frame_history(self) -> int:
         return self.get('creativity.max_frame_history', 3)
@@ -140,6 +298,18 @@ class Config:
     def creativity_update_interval(self) -> int:
         return self.get('creativity.creativity_update_interval', 30)
     
+    @property
+    def prompt_transition(self) -> str:
+        return self.get('creativity.prompt_transition', 'slerp')
+    
+    @property
+    def prompt_transition_frames(self) -> int:
+        return self.get('creativity.prompt_transition_frames', 8)
+    
+    @property
+    def pixel_blend(self) -> bool:
+        return self.get('creativity.pixel_blend', True)
+    
     @property
     def themes(self) -> List[str]:
         return self.get('creativity.themes', [
@@ -177,6 +347,10 @@ class Config:
     def models_dir(self) -> str:
         return self.get('paths.models_dir', './models')
     
+    @property
+    def offline_models(self) -> bool:
+        return self.get('paths.offline_models', False)
+    
     @property
     def moon_image(self) -> str:
         return self.get('paths.moon_image', 'moon.png')
@@ -2,16 +2,18 @@ import pygame
 import pyaudio
 import numpy as np
 import math
-import socket
-import threading
-import pickle
 import time
 from config import config
+from app.frame_transport import FramePacer, FrameSender
 
 # --- 設定項目（config.jsonから読み込み） ---
 # スクリーン設定
 WIDTH, HEIGHT = config.width, config.height
 FPS = config.fps
+# 送らないフレームもウィンドウに描画するか
+PREVIEW = config.preview
+# 送信するフレームと音声特徴量を録画するファイル（空なら録画しない、app/frame_recorder.py を参照）
+RECORD_PATH = config.record_path
 
 # オーディオ設定
 CHUNK = config.audio_chunk
@@ -19,10 +21,6 @@ RATE = config.audio_rate
 FORMAT = pyaudio.paInt16  # pyaudioの定数なのでそのまま
 CHANNELS = config.audio_channels
 
-# TCP設定
-FRAME_HOST = config.host
-FRAME_PORT = config.frame_port
-
 # 色
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -597,100 +595,6 @@ class WaveMandala:
         
         screen.blit(temp_surface, (0, 0))
 
-# フレーム送信クラス（再接続対応）
-class FrameSender:
-    def __init__(self, host=FRAME_HOST, port=FRAME_PORT):
-        self.host = host
-        self.port = port
-        self.server_socket = None
-        self.client_conn = None
-        self.running = False
-        
-    def start_server(self):
-        """フレーム送信サーバーを開始"""
-        self.running = True
-        self.server_thread = threading.Thread(target=self._server_loop, daemon=True)
-        self.server_thread.start()
-        print(f"🖼️  フレーム送信サーバー開始: {self.host}:{self.port}")
-        
-    def _server_loop(self):
-        """サーバーループ（再接続対応）"""
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(1)
-            
-            print(f"🔗 フレーム受信待機中: {self.host}:{self.port}")
-            
-            # 再接続ループ
-            while self.running:
-                try:
-                    print("🔄 新しい接続を待機中...")
-                    self.client_conn, addr = self.server_socket.accept()
-                    print(f"✨ web_camera.py接続: {addr}")
-                    
-                    # 接続が有効な間はループ維持
-                    self._handle_client_connection()
-                    
-                except Exception as e:
-                    if self.running:
-                        print(f"❌ 接続エラー: {e}")
-                        self.client_conn = None
-                        time.sleep(2)  # 少し待ってから再試行
-        except Exception as e:
-            print(f"❌ サーバー初期化エラー: {e}")
-    
-    def _handle_client_connection(self):
-        """クライアント接続を処理（切断まで継続）"""
-        while self.running and self.client_conn:
-            try:
-                # 接続が生きているかチェック
-                self.client_conn.send(b'')  # キープアライブテスト
-                time.sleep(0.1)
-            except:
-                print("🔌 接続が切断されました。再接続を待機します...")
-                self.client_conn = None
-                break
-    
-    def send_frame(self, frame_array):
-        """フレームを送信（エラー時は接続をリセット）"""
-        if not self.client_conn:
-            return
-            
-        try:
-            # numpy配列をpickleでシリアライズ
-            frame_data = pickle.dumps(frame_array)
-            frame_size = len(frame_data)
-            
-            # サイズを先に送信（4バイト）
-            self.client_conn.sendall(frame_size.to_bytes(4, byteorder='big'))
-            # フレームデータを送信
-            self.client_conn.sendall(frame_data)
-        except Exception as e:
-            print(f"❌ フレーム送信エラー: {e}")
-            print("🔄 接続をリセットして再接続を待機します")
-            if self.client_conn:
-                try:
-                    self.client_conn.close()
-                except:
-                    pass
-            self.client_conn = None
-    
-    def stop_server(self):
-        """サーバー停止"""
-        self.running = False
-        if self.client_conn:
-            try:
-                self.client_conn.close()
-            except:
-                pass
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-
 # --- メイン処理 ---
 def main():
     pygame.init()
@@ -699,8 +603,11 @@ def main():
     clock = pygame.time.Clock()
     
     # フレーム送信サーバー開始
-    frame_sender = FrameSender()
+    frame_sender = FrameSender(source_channels="rgb")
     frame_sender.start_server()
+    frame_pacer = FramePacer(frame_sender)
+    if RECORD_PATH:
+        frame_sender.start_recording(RECORD_PATH)
 
     p = pyaudio.PyAudio()
     stream = p.open(
@@ -723,6 +630,8 @@ def main():
         # --- オーディオデータの取得と解析 ---
         try:
             raw_data = stream.read(CHUNK, exception_on_overflow=False)
+            # このチャンクを取得した時刻（表示までのレイテンシ計測の起点）
+            capture_time = time.time()
             np_data = np.frombuffer(raw_data, dtype=np.int16)
             
             if np_data.size == 0:
@@ -762,25 +671,34 @@ def main():
 
         except (IOError, ValueError):
             volume, bass_norm, mid_norm, high_norm = 0, 0, 0, 0
+            capture_time = None
 
-        # --- 描画処理 ---
-        screen.fill(BLACK)
-
-        # 曼荼羅システム更新・描画
+        # 曼荼羅システム更新（送らない・描画しないフレームでも毎フレーム進める）
         mandala.update(bass_norm, mid_norm, high_norm)
-        mandala.draw(screen, bass_norm, mid_norm, high_norm, volume)
 
-        pygame.display.flip()
-        
-        # Pygameサーフェスをnumpy配列として取得
-        frame_array = pygame.surfarray.array3d(screen)
-        # Pygameの座標系(x,y,rgb) -> OpenCVの座標系(y,x,bgr)に変換
-        frame_array = np.transpose(frame_array, (1, 0, 2))
-        # RGB -> BGR変換
-        frame_array = frame_array[:, :, ::-1]
-        
-        # フレームを送信
-        frame_sender.send_frame(frame_array)
+        # web_camera が要求している分だけ送る（プレビューを表示しないなら描画も省く）
+        send_this_frame = frame_pacer.should_send()
+        if PREVIEW or send_this_frame:
+            # --- 描画処理 ---
+            screen.fill(BLACK)
+
+            # 曼荼羅描画
+            mandala.draw(screen, bass_norm, mid_norm, high_norm, volume)
+
+            if PREVIEW:
+                pygame.display.flip()
+
+        if send_this_frame:
+            # Pygameサーフェスをnumpy配列として取得
+            frame_array = pygame.surfarray.array3d(screen)
+            # Pygameの座標系(x,y,rgb) -> (y,x,rgb)に変換（ビューのみ）
+            # 受信側が必要とする切り抜き・解像度・チャンネル順への変換は FrameSender が行う
+            frame_array = np.transpose(frame_array, (1, 0, 2))
+
+            # フレームを送信
+            audio_features = {'volume': volume, 'bass': bass_norm, 'mid': mid_norm, 'high': high_norm}
+            frame_sender.send_frame(frame_array, capture_time, audio_features)
+            frame_pacer.mark_sent()
         
         clock.tick(FPS)
 
@@ -2,16 +2,18 @@ import pygame
 import pyaudio
 import numpy as np
 import math
-import socket
-import threading
-import pickle
 import time
 from config import config
+from app.frame_transport import FramePacer, FrameSender
 
 # --- 設定項目（config.jsonから読み込み） ---
 # スクリーン設定
 WIDTH, HEIGHT = config.width, config.height
 FPS = config.fps
+# 送らないフレームもウィンドウに描画するか
+PREVIEW = config.preview
+# 送信するフレームと音声特徴量を録画するファイル（空なら録画しない、app/frame_recorder.py を参照）
+RECORD_PATH = config.record_path
 
 # オーディオ設定
 CHUNK = config.audio_chunk
@@ -19,10 +21,6 @@ RATE = config.audio_rate
 FORMAT = pyaudio.paInt16  # pyaudioの定数なのでそのまま
 CHANNELS = config.audio_channels
 
-# TCP設定
-FRAME_HOST = config.host
-FRAME_PORT = config.frame_port
-
 # 色
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -72,100 +70,6 @@ class Particle:
         pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), int(self.size), 1)
         pygame.draw.circle(screen, self.color, (int(self.x+self.size*0.2), int(self.y-self.size*0.2)), int(self.size*0.7), 1)
 
-# フレーム送信クラス（再接続対応）
-class FrameSender:
-    def __init__(self, host=FRAME_HOST, port=FRAME_PORT):
-        self.host = host
-        self.port = port
-        self.server_socket = None
-        self.client_conn = None
-        self.running = False
-        
-    def start_server(self):
-        """フレーム送信サーバーを開始"""
-        self.running = True
-        self.server_thread = threading.Thread(target=self._server_loop, daemon=True)
-        self.server_thread.start()
-        print(f"🖼️  フレーム送信サーバー開始: {self.host}:{self.port}")
-        
-    def _server_loop(self):
-        """サーバーループ（再接続対応）"""
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(1)
-            
-            print(f"🔗 フレーム受信待機中: {self.host}:{self.port}")
-            
-            # 再接続ループ
-            while self.running:
-                try:
-                    print("🔄 新しい接続を待機中...")
-                    self.client_conn, addr = self.server_socket.accept()
-                    print(f"✨ web_camera.py接続: {addr}")
-                    
-                    # 接続が有効な間はループ維持
-                    self._handle_client_connection()
-                    
-                except Exception as e:
-                    if self.running:
-                        print(f"❌ 接続エラー: {e}")
-                        self.client_conn = None
-                        time.sleep(2)  # 少し待ってから再試行
-        except Exception as e:
-            print(f"❌ サーバー初期化エラー: {e}")
-    
-    def _handle_client_connection(self):
-        """クライアント接続を処理（切断まで継続）"""
-        while self.running and self.client_conn:
-            try:
-                # 接続が生きているかチェック
-                self.client_conn.send(b'')  # キープアライブテスト
-                time.sleep(0.1)
-            except:
-                print("🔌 接続が切断されました。再接続を待機します...")
-                self.client_conn = None
-                break
-    
-    def send_frame(self, frame_array):
-        """フレームを送信（エラー時は接続をリセット）"""
-        if not self.client_conn:
-            return
-            
-        try:
-            # numpy配列をpickleでシリアライズ
-            frame_data = pickle.dumps(frame_array)
-            frame_size = len(frame_data)
-            
-            # サイズを先に送信（4バイト）
-            self.client_conn.sendall(frame_size.to_bytes(4, byteorder='big'))
-            # フレームデータを送信
-            self.client_conn.sendall(frame_data)
-        except Exception as e:
-            print(f"❌ フレーム送信エラー: {e}")
-            print("🔄 接続をリセットして再接続を待機します")
-            if self.client_conn:
-                try:
-                    self.client_conn.close()
-                except:
-                    pass
-            self.client_conn = None
-    
-    def stop_server(self):
-        """サーバー停止"""
-        self.running = False
-        if self.client_conn:
-            try:
-                self.client_conn.close()
-            except:
-                pass
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-
 # 波紋クラス（余韻効果強化版）
 class Ripple:
     def __init__(self, x, y, intensity=1.0):
@@ -205,8 +109,11 @@ def main():
     clock = pygame.time.Clock()
     
     # フレーム送信サーバー開始
-    frame_sender = FrameSender()
+    frame_sender = FrameSender(source_channels="rgb")
     frame_sender.start_server()
+    frame_pacer = FramePacer(frame_sender)
+    if RECORD_PATH:
+        frame_sender.start_recording(RECORD_PATH)
 
     try:
         moon_img = pygame.image.load("moon.png").convert_alpha()
@@ -237,6 +144,8 @@ def main():
         # --- オーディオデータの取得と解析 ---
         try:
             raw_data = stream.read(CHUNK, exception_on_overflow=False)
+            # このチャンクを取得した時刻（表示までのレイテンシ計測の起点）
+            capture_time = time.time()
             np_data = np.frombuffer(raw_data, dtype=np.int16)
             
             # --- <<< 修正ここから ---
@@ -279,10 +188,9 @@ def main():
 
         except (IOError, ValueError):
             volume, bass_norm, mid_norm, high_norm = 0, 0, 0, 0
+            capture_time = None
 
-        # --- 描画処理 ---
-        screen.fill(BLACK)
-
+        # --- 状態の更新（送らない・描画しないフレームでも毎フレーム進める） ---
         global last_bass_max
         # 波紋発生条件を緩和し、強度に応じて複数生成
         if bass_norm > RIPPLE_THRESHOLD:
@@ -295,106 +203,119 @@ def main():
                 else:
                     ripples.append(Ripple(WIDTH // 2, HEIGHT // 2, bass_norm))
         last_bass_max = bass_norm * 0.95  # 減衰を緩やか
-        
+
         for ripple in ripples[:]:
             ripple.update()
             if ripple.alpha <= 0:
                 ripples.remove(ripple)
-            else:
-                ripple.draw(screen)
 
         for particle in particles:
             particle.update(mid_norm, high_norm)
-            particle.draw(screen)
 
-        center = (WIDTH // 2, HEIGHT // 2)
-        
-        # --- <<< 修正: volumeがNaNでないことを確認 ---
         # 月をゆったりと軌道運動させながら音楽に反応させる
         global moon_orbit_angle, moon_base_x, moon_base_y
-        
+
         # ゆっくりとした軌道運動（大きな円を描く）
         moon_orbit_angle += 0.002 + bass_norm * 0.004  # 速度を調整
-        orbit_radius = 80 + mid_norm * 40  # 音楽に応じて軌道半径変化
-        
-        moon_x = moon_base_x + orbit_radius * math.cos(moon_orbit_angle)
-        moon_y = moon_base_y + orbit_radius * math.sin(moon_orbit_angle * 0.7)  # 楕円軌道
-        
-        # 微細な振動（とても控えめ）
-        gentle_vibration_x = bass_norm * 3 * math.sin(pygame.time.get_ticks() * 0.002)
-        gentle_vibration_y = high_norm * 2 * math.cos(pygame.time.get_ticks() * 0.0015)
-        
-        final_moon_x = moon_x + gentle_vibration_x
-        final_moon_y = moon_y + gentle_vibration_y
-        
-        # サイズも控えめに変化
-        scale_factor = 1.0 + volume * 0.1
-        
-        # 黄色のリングを月の周りに描画
-        ring_radius = int(70 * scale_factor)
-        ring_thickness = max(2, int(4 + mid_norm * 3))
-        yellow_color = (255, 255, 100)  # 黄色
-        ring_alpha = min(180, int(100 + volume * 80))
-        
-        # リング用のサーフェス
-        ring_surface = pygame.Surface((ring_radius * 2 + 20, ring_radius * 2 + 20), pygame.SRCALPHA)
-        pygame.draw.circle(ring_surface, (*yellow_color, ring_alpha), 
-                          (ring_radius + 10, ring_radius + 10), ring_radius, ring_thickness)
-        screen.blit(ring_surface, (int(final_moon_x - ring_radius - 10), 
-                                  int(final_moon_y - ring_radius - 10)))
-        
-        # 月を描画
-        if moon_img:
-            scaled_moon = pygame.transform.scale(moon_img, 
-                (int(100 * scale_factor), int(100 * scale_factor)))
-            vibrated_rect = scaled_moon.get_rect(center=(int(final_moon_x), int(final_moon_y)))
-            screen.blit(scaled_moon, vibrated_rect)
-        else:
-            size = int(50 * scale_factor)
-            pygame.draw.circle(screen, WHITE, (int(final_moon_x), int(final_moon_y)), size)
-        
-        # 音響エフェクトを月の周りに描画（月の部分を除外）
-        if not np.isnan(volume):
-            glow_radius = int(60 + volume * 8)  # 感度を大幅アップ（3 -> 8）
-            glow_alpha = min(200, int(50 + volume * 10))  # アルファも強化（3 -> 10）
-            if glow_radius > 60:
-                # グロー効果用のサーフェス
-                s = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
-                
-                # 多層のグローで柔らかい効果
-                for i in range(4):  # 層を増やして更に柔らかく
-                    layer_radius = glow_radius - i * 8
-                    layer_alpha = glow_alpha // (i + 1)
-                    if layer_radius > 0 and layer_alpha > 0:
-                        # 色も音の強さに応じて変化
-                        color_intensity = min(255, int(200 + volume * 2))
-                        
-                        # 月の範囲を除外するためのマスクを作成
-                        mask_surface = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
-                        
-                        # 外側の円（グロー）
-                        pygame.draw.circle(mask_surface, (color_intensity, color_intensity, 150, layer_alpha), 
-                                         (glow_radius, glow_radius), layer_radius)
-                        
-                        # 月の部分（中心から50ピクセル）を黒で塗りつぶして除外
-                        pygame.draw.circle(mask_surface, (0, 0, 0, 0), 
-                                         (glow_radius, glow_radius), 55)  # 月より少し大きめ
-                        
-                        s.blit(mask_surface, (0, 0))
-                
-                screen.blit(s, (int(final_moon_x - glow_radius), int(final_moon_y - glow_radius)), special_flags=pygame.BLEND_RGBA_ADD)
 
-        pygame.display.flip()
-        
-        # Pygameサーフェスをnumpy配列として取得
-        frame_array = pygame.surfarray.array3d(screen)
-        # Pygameの座標系(x,y,rgb) -> OpenCVの座標系(y,x,bgr)に変換
-        frame_array = np.transpose(frame_array, (1, 0, 2))
-        # RGB -> BGR変換
-        frame_array = frame_array[:, :, ::-1]
-        
-        # フレームを送信
-        frame_sender.send_frame(frame_array)
+        # web_camera が要求している分だけ送る（プレビューを表示しないなら描画も省く）
+        send_this_frame = frame_pacer.should_send()
+        if PREVIEW or send_this_frame:
+            # --- 描画処理 ---
+            screen.fill(BLACK)
+
+            for ripple in ripples:
+                ripple.draw(screen)
+
+            for particle in particles:
+                particle.draw(screen)
+
+            center = (WIDTH // 2, HEIGHT // 2)
+
+            # --- <<< 修正: volumeがNaNでないことを確認 ---
+            orbit_radius = 80 + mid_norm * 40  # 音楽に応じて軌道半径変化
+
+            moon_x = moon_base_x + orbit_radius * math.cos(moon_orbit_angle)
+            moon_y = moon_base_y + orbit_radius * math.sin(moon_orbit_angle * 0.7)  # 楕円軌道
+
+            # 微細な振動（とても控えめ）
+            gentle_vibration_x = bass_norm * 3 * math.sin(pygame.time.get_ticks() * 0.002)
+            gentle_vibration_y = high_norm * 2 * math.cos(pygame.time.get_ticks() * 0.0015)
+
+            final_moon_x = moon_x + gentle_vibration_x
+            final_moon_y = moon_y + gentle_vibration_y
+
+            # サイズも控えめに変化
+            scale_factor = 1.0 + volume * 0.1
+
+            # 黄色のリングを月の周りに描画
+            ring_radius = int(70 * scale_factor)
+            ring_thickness = max(2, int(4 + mid_norm * 3))
+            yellow_color = (255, 255, 100)  # 黄色
+            ring_alpha = min(180, int(100 + volume * 80))
+
+            # リング用のサーフェス
+            ring_surface = pygame.Surface((ring_radius * 2 + 20, ring_radius * 2 + 20), pygame.SRCALPHA)
+            pygame.draw.circle(ring_surface, (*yellow_color, ring_alpha), 
+                              (ring_radius + 10, ring_radius + 10), ring_radius, ring_thickness)
+            screen.blit(ring_surface, (int(final_moon_x - ring_radius - 10), 
+                                      int(final_moon_y - ring_radius - 10)))
+
+            # 月を描画
+            if moon_img:
+                scaled_moon = pygame.transform.scale(moon_img, 
+                    (int(100 * scale_factor), int(100 * scale_factor)))
+                vibrated_rect = scaled_moon.get_rect(center=(int(final_moon_x), int(final_moon_y)))
+                screen.blit(scaled_moon, vibrated_rect)
+            else:
+                size = int(50 * scale_factor)
+                pygame.draw.circle(screen, WHITE, (int(final_moon_x), int(final_moon_y)), size)
+
+            # 音響エフェクトを月の周りに描画（月の部分を除外）
+            if not np.isnan(volume):
+                glow_radius = int(60 + volume * 8)  # 感度を大幅アップ（3 -> 8）
+                glow_alpha = min(200, int(50 + volume * 10))  # アルファも強化（3 -> 10）
+                if glow_radius > 60:
+                    # グロー効果用のサーフェス
+                    s = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
+
+                    # 多層のグローで柔らかい効果
+                    for i in range(4):  # 層を増やして更に柔らかく
+                        layer_radius = glow_radius - i * 8
+                        layer_alpha = glow_alpha // (i + 1)
+                        if layer_radius > 0 and layer_alpha > 0:
+                            # 色も音の強さに応じて変化
+                            color_intensity = min(255, int(200 + volume * 2))
+
+                            # 月の範囲を除外するためのマスクを作成
+                            mask_surface = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
+
+                            # 外側の円（グロー）
+                            pygame.draw.circle(mask_surface, (color_intensity, color_intensity, 150, layer_alpha), 
+                                             (glow_radius, glow_radius), layer_radius)
+
+                            # 月の部分（中心から50ピクセル）を黒で塗りつぶして除外
+                            pygame.draw.circle(mask_surface, (0, 0, 0, 0), 
+                                             (glow_radius, glow_radius), 55)  # 月より少し大きめ
+
+                            s.blit(mask_surface, (0, 0))
+
+                    screen.blit(s, (int(final_moon_x - glow_radius), int(final_moon_y - glow_radius)), special_flags=pygame.BLEND_RGBA_ADD)
+
+            if PREVIEW:
+                pygame.display.flip()
+
+        if send_this_frame:
+            # Pygameサーフェスをnumpy配列として取得
+            frame_array = pygame.surfarray.array3d(screen)
+            # Pygameの座標系(x,y,rgb) -> (y,x,rgb)に変換（ビューのみ）
+            # 受信側が必要とする切り抜き・解像度・チャンネル順への変換は FrameSender が行う
+            frame_array = np.transpose(frame_array, (1, 0, 2))
+
+            # フレームを送信
+            audio_features = {'volume': volume, 'bass': bass_norm, 'mid': mid_norm, 'high': high_norm}
+            frame_sender.send_frame(frame_array, capture_time, audio_features)
+            frame_pacer.mark_sent()
         
         clock.tick(FPS)
 
@@ -3,8 +3,6 @@ import threading
 import socket
 import json
 from typing import Any, Callable, List
-from queue import Queue
-import random
 import sys, os
 
 import cv2
@@ -17,21 +15,21 @@ from PyQt5.QtGui import QImage, QPixmap
 import speech_recognition as sr
 
 from ..stream_diffusion import StreamDiffusion
-from ..data.dictionaries import GOJUON_WORDS
+from ..prompt_controller import PromptController
 
 SD_SIDE_LENGTH = 512
+DEFAULT_PROMPT = "moon, Cubism painting style, no humans, no people"
 
 class PromptServer:
-    def __init__(self, port=5000):
+    def __init__(self, stream, port=5000):
+        """stream は常駐させる StreamDiffusionWrapper（プロンプトの変更はすべて PromptController 経由で反映する）"""
         self.port = port
-        self.default_prompt = "moon, Cubism painting style, no humans, no people"
-        self.current_prompt = self.default_prompt
+        self.default_prompt = DEFAULT_PROMPT
         self.running = True
-        self.prompt_queue = Queue()
         self.voice_recognition_active = True
-        
-        # 音韻処理用の変数を初期化
-        self.last_used_phoneme = None
+        # 音声・TCP のスレッドより先に作り、起動直後の入力も反映する。
+        # 音声の音韻から語を選ぶ処理もここで行う（直近 MAX_PHONEME_WORDS 語をプロンプトに残す）
+        self.prompt_controller = PromptController(stream, base_prompt=self.default_prompt)
         
         # サーバーソケットの設定
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -52,77 +50,19 @@ class PromptServer:
         # 音声認識の初期化
         self.initialize_voice_recognition()
         
-        # プロンプト管理の設定
-        self.active_prompts = []          
-        self.max_prompts = 6              # 最大プロンプト数を減らす
-        self.prompt_update_interval = 30   # 更新間隔を30秒に延長
-        self.last_prompt_update = time.time()
-        self.stream_diffusion_lock = threading.Lock()
-        
         print(f"Prompt server started on port {self.port}")
         print("Voice recognition is active. Say your prompt out loud.")
 
-    def get_first_phoneme(self, text: str) -> str:
-        """音声認識結果から最初の音韻を取得"""
-        if not text:
-            return ''
-        return text[0]
-
-    def get_random_words_from_phoneme(self, phoneme: str) -> list:
-        """音韻から3つの単語と英語表現をランダムに選択"""
-        if phoneme in GOJUON_WORDS:
-            word_list = GOJUON_WORDS[phoneme]
-            # リストから重複なしで3つをランダムに選択
-            selected_pairs = random.sample(word_list, min(3, len(word_list)))
-            return [pair[1] for pair in selected_pairs]  # 英語表現のリストを返す
-        return []
-
     def process_voice_input(self, text: str):
-        """音声入力を処理（改良版）"""
+        """音声入力の最初の音韻から選んだ語をプロンプトに加える（app/prompt_controller.py）"""
+        if not text:
+            return
         try:
-            if not text:
-                return
-            
-            # テキストから最初の2文字分の音韻を取得
-            first_two_phonemes = [char for char in text[:2] if char in GOJUON_WORDS]
-            if not first_two_phonemes:
-                return
-            
-            # 音韻の選択
-            selected_phoneme = first_two_phonemes[0]  # デフォルトは最初の音韻
-            
-            # 最初の音韻が前回と同じ場合、2文字目があればそちらを使用
-            if hasattr(self, 'last_used_phoneme') and selected_phoneme == self.last_used_phoneme and len(first_two_phonemes) > 1:
-                selected_phoneme = first_two_phonemes[1]
-            
-            # 選択した音韻を記録
-            self.last_used_phoneme = selected_phoneme
-            
-            # 単語の選択と処理
-            english_words = self.get_random_words_from_phoneme(selected_phoneme)
-            if english_words:
-                print(f"音韻「{selected_phoneme}」から選択: → {', '.join(english_words)}")
-                self.add_prompts(english_words)
-                
+            prompt = self.prompt_controller.add_speech(text)
+            if prompt is not None:
+                print(f"現在のプロンプト: {prompt}")
         except Exception as e:
             print(f"音声処理中にエラーが発生しました: {e}")
-            self.last_used_phoneme = None  # エラー時は前回の音韻をリセット
-
-    def add_prompts(self, prompts: list):
-        """複数のプロンプトを一度に追加（上限管理付き）"""
-        # 重複を除去しながら新しいプロンプトを追加
-        new_prompts = [p for p in prompts if p not in self.active_prompts]
-        self.active_prompts.extend(new_prompts)
-        
-        # 上限を超えた場合、古いものから削除
-        if len(self.active_prompts) > self.max_prompts:
-            excess = len(self.active_prompts) - self.max_prompts
-            self.active_prompts = self.active_prompts[excess:]
-        
-        # 更新されたプロンプトを生成
-        combined_prompt = f"{self.default_prompt}, {', '.join(self.active_prompts)}"
-        self.prompt_queue.put(combined_prompt)
-        print(f"現在のプロンプト: {combined_prompt}")
 
     def listen_for_voice_commands(self):
         """音声認識処理（シンプル版）"""
@@ -168,7 +108,8 @@ class PromptServer:
                         break
                     
                     print(f"Received prompt: {data}")
-                    self.prompt_queue.put(data)
+                    # 反映は PromptController のスレッドが行う（溜まった場合は最新のものだけ）
+                    self.prompt_controller.submit(data)
                     client.send(b"Prompt updated\n")
                 
                 client.close()
@@ -189,39 +130,10 @@ class PromptServer:
             print("音声認識を無効化します")
             self.voice_recognition_active = False
 
-    def update_stream_diffusion(self, current_stream_diffusion):
-        """StreamDiffusionインスタンスを更新"""
-        current_time = time.time()
-        
-        # 前回の更新から30秒経過していない場合は更新しない
-        if current_time - self.last_prompt_update < self.prompt_update_interval:
-            # キューにプロンプトが溜まっていても、時間が経過していなければ更新しない
-            while not self.prompt_queue.empty():
-                _ = self.prompt_queue.get()  # キューをクリア
-            return current_stream_diffusion, current_stream_diffusion.stream
-        
-        # 新しいプロンプトがキューにある場合は更新
-        if not self.prompt_queue.empty():
-            new_prompt = self.prompt_queue.get()
-            # キューに残っているプロンプトをクリア
-            while not self.prompt_queue.empty():
-                _ = self.prompt_queue.get()
-                
-            if new_prompt != current_stream_diffusion.prompt:
-                with self.stream_diffusion_lock:
-                    try:
-                        new_stream_diffusion = StreamDiffusion(prompt=new_prompt)
-                        self.last_prompt_update = current_time
-                        print(f"プロンプトを更新しました: {new_prompt} (次回更新まで {self.prompt_update_interval} 秒)")
-                        return new_stream_diffusion, new_stream_diffusion.stream
-                    except Exception as e:
-                        print(f"新しいStreamDiffusionの作成に失敗: {e}")
-        
-        return current_stream_diffusion, current_stream_diffusion.stream
-
     def stop(self):
         """サーバーを停止"""
         self.running = False
+        self.prompt_controller.close()
         self.server.close()
 
 def list_cameras():
@@ -256,9 +168,9 @@ def main():
     try:
         camera_index = list_cameras()
         
-        prompt_server = PromptServer()
-        stream_diffusion = StreamDiffusion(prompt=prompt_server.current_prompt)
+        stream_diffusion = StreamDiffusion(prompt=DEFAULT_PROMPT)
         stream = stream_diffusion.stream
+        prompt_server = PromptServer(stream)
         
         cap = cv2.VideoCapture(camera_index)
         if not cap.isOpened():
@@ -290,9 +202,6 @@ def main():
         while True:
             _, frame = cap.read()
 
-            # プロンプト更新の処理
-            stream_diffusion, stream = prompt_server.update_stream_diffusion(stream_diffusion)
-            
             init_img = crop_center(Image.fromarray(frame), SD_SIDE_LENGTH * 2, SD_SIDE_LENGTH * 2).resize(
                 (SD_SIDE_LENGTH, SD_SIDE_LENGTH), Image.NEAREST
             )
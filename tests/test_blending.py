@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from app.blending import DECAY_RESYNC_INTERVAL, FrameBlender
+
+
+def _frames(count, shape=(4, 6, 3), seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(count)]
+
+
+def _reference(frames, mode, alpha, max_history, decay):
+    """履歴を出力のリストで持ち、毎フレーム平均し直す素朴な実装"""
+    outputs = []
+    state = None
+    for frame in frames:
+        current = frame.astype(np.float64)
+        history = outputs[-(max_history - 1):] if max_history > 1 else []
+        if mode == "ema":
+            state = current if state is None else state * (1 - alpha) + current * alpha
+            blended = state
+        elif mode == "none" or not history:
+            blended = current
+        elif mode == "box":
+            blended = np.mean(history, axis=0) * (1 - alpha) + current * alpha
+        else:
+            weights = [decay ** age for age in range(len(history))]
+            weighted = sum(w * h.astype(np.float64) for w, h in zip(weights, reversed(history)))
+            blended = weighted / sum(weights) * (1 - alpha) + current * alpha
+        outputs.append(np.rint(blended).astype(np.uint8))
+    return outputs
+
+
+@pytest.mark.parametrize("mode", ["none", "box", "decay", "ema"])
+@pytest.mark.parametrize("max_history", [1, 2, 4])
+def test_push_matches_reference(mode, max_history):
+    frames = _frames(12)
+    blender = FrameBlender(mode=mode, alpha=0.3, max_history=max_history, decay=0.5)
+    expected = _reference(frames, mode, 0.3, max_history, 0.5)
+
+    for frame, want in zip(frames, expected):
+        got = blender.push(frame)
+        # float32 のアキュムレータと float64 の参照で丸めが 1 ずれることはある
+        assert np.abs(got.astype(int) - want.astype(int)).max() <= 1
+
+    assert len(blender) == max_history
+    np.testing.assert_array_equal(blender.latest(), got)
+
+
+def test_decay_stays_accurate_across_resync():
+    frames = _frames(DECAY_RESYNC_INTERVAL + 20, shape=(2, 3, 3), seed=1)
+    blender = FrameBlender(mode="decay", alpha=0.3, max_history=3, decay=0.5)
+    expected = _reference(frames, "decay", 0.3, 3, 0.5)
+
+    for frame in frames:
+        got = blender.push(frame)
+    assert np.abs(got.astype(int) - expected[-1].astype(int)).max() <= 1
+
+
+def test_resolution_change_resets_history():
+    blender = FrameBlender(mode="box", alpha=0.3, max_history=3)
+    for frame in _frames(3):
+        blender.push(frame)
+
+    frame = _frames(1, shape=(8, 8, 3), seed=2)[0]
+    out = blender.push(frame)
+
+    assert len(blender) == 1
+    np.testing.assert_array_equal(out, frame)
+
+
+def test_accepts_float_frames():
+    blender = FrameBlender(mode="none", max_history=2)
+    out = blender.push(np.full((2, 2, 3), 0.5, dtype=np.float32))
+
+    assert out.dtype == np.uint8
+    assert (out == 128).all()
+
+
+def test_reset_and_latest():
+    blender = FrameBlender(mode="box", max_history=2)
+    assert blender.latest() is None
+    blender.push(_frames(1)[0])
+    blender.reset()
+    assert len(blender) == 0
+    assert blender.latest() is None
+
+
+@pytest.mark.parametrize("kwargs", [{"mode": "median"}, {"max_history": 0}])
+def test_rejects_bad_arguments(kwargs):
+    with pytest.raises(ValueError):
+        FrameBlender(**kwargs)
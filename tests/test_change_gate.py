@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from app.change_gate import ChangeGate, downsampled_luma
+
+
+def _frame(value, shape=(128, 128, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_first_frame_is_always_processed():
+    gate = ChangeGate(threshold=1.5, max_skip=10)
+    assert gate.should_process(_frame(0))
+
+
+def test_unchanged_frames_are_skipped_up_to_max_skip():
+    gate = ChangeGate(threshold=1.5, max_skip=3)
+    results = [gate.should_process(_frame(100)) for _ in range(6)]
+    # 1枚目は推論、3回省いたら変化がなくても1回推論する
+    assert results == [True, False, False, False, True, False]
+    stats = gate.stats()
+    assert (stats["checked"], stats["skipped"], stats["forced"]) == (6, 4, 1)
+
+
+def test_slow_changes_accumulate_against_last_processed_frame():
+    gate = ChangeGate(threshold=2.0, max_skip=100)
+    assert gate.should_process(_frame(100))
+    # 1ずつの変化は直前のフレームとの差では常にしきい値未満だが、最後に推論したフレームとの差は積み重なる
+    assert not gate.should_process(_frame(101))
+    assert gate.should_process(_frame(102))
+    assert not gate.should_process(_frame(103))
+
+
+def test_reset_and_disabled_gate():
+    gate = ChangeGate(threshold=1.5, max_skip=10)
+    gate.should_process(_frame(0))
+    gate.reset()
+    assert gate.should_process(_frame(0))
+    disabled = ChangeGate(threshold=0)
+    assert all(disabled.should_process(_frame(0)) for _ in range(3))
+
+
+def test_luma_respects_channel_order_and_float_frames():
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    frame[..., 0] = 255  # BGR の青 / RGB の赤
+    assert downsampled_luma(frame, "bgr")[0, 0] == pytest.approx(0.114 * 255)
+    assert downsampled_luma(frame, "rgb")[0, 0] == pytest.approx(0.299 * 255)
+    np.testing.assert_allclose(downsampled_luma(frame.astype(np.float32) / 255.0, "rgb"),
+                               downsampled_luma(frame, "rgb"), rtol=1e-5)
+    assert downsampled_luma(np.zeros((1000, 500, 3), np.uint8), grid_size=64).shape == (63, 63)
@@ -0,0 +1,88 @@
+import threading
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+pytest.importorskip("diffusers")
+pytest.importorskip("streamdiffusion")
+
+from app.utils import StreamDiffusionWrapper  # noqa: E402
+
+
+def _wrapper(cfg_type="none", guidance_scale=1.0, batch_size=2):
+    """モデルを読み込まずに条件付けの差し替えだけを試すラッパー（テキストエンコーダは呼び出しを記録する）"""
+    calls = []
+
+    def encode_prompt(prompt, device, num_images_per_prompt, do_classifier_free_guidance, negative_prompt=None):
+        calls.append((prompt, negative_prompt, do_classifier_free_guidance))
+        cond = torch.full((1, 3, 4), float(len(prompt)))
+        uncond = torch.full((1, 3, 4), -1.0) if do_classifier_free_guidance else None
+        return cond, uncond
+
+    stream = SimpleNamespace(
+        pipe=SimpleNamespace(encode_prompt=encode_prompt),
+        cfg_type=cfg_type,
+        guidance_scale=guidance_scale,
+        delta=1.0,
+        batch_size=batch_size,
+        frame_bff_size=1,
+        use_denoising_batch=True,
+        prompt_embeds=torch.zeros((batch_size, 3, 4)),
+    )
+    wrapper = StreamDiffusionWrapper.__new__(StreamDiffusionWrapper)
+    wrapper.stream = stream
+    wrapper.device = torch.device("cpu")
+    wrapper.dtype = torch.float32
+    wrapper._conditioning_lock = threading.Lock()
+    wrapper._transition = deque()
+    wrapper.transition_frames = 0
+    wrapper.transition_method = "lerp"
+    wrapper.prompt = "moon"
+    wrapper.negative_prompt = "human"
+    return wrapper, calls
+
+
+def test_update_conditioning_swaps_embeddings_on_next_frame():
+    wrapper, calls = _wrapper()
+    wrapper.update_conditioning("stars")
+    assert calls == [("stars", "human", False)]
+    assert wrapper.prompt == "stars"
+    # 推論の直前に差し替わる
+    assert (wrapper.stream.prompt_embeds == 0).all()
+    wrapper._advance_transition()
+    assert wrapper.stream.prompt_embeds.shape == (2, 3, 4)
+    assert (wrapper.stream.prompt_embeds == 5).all()
+
+
+def test_update_conditioning_morphs_over_transition_frames():
+    wrapper, _ = _wrapper()
+    wrapper.transition_frames = 4
+    wrapper.update_conditioning("moon")
+    values = []
+    for _ in range(5):
+        wrapper._advance_transition()
+        values.append(float(wrapper.stream.prompt_embeds[0, 0, 0]))
+    assert values == pytest.approx([1.0, 2.0, 3.0, 4.0, 4.0])
+
+
+def test_cfg_none_never_encodes_the_negative_prompt():
+    wrapper, calls = _wrapper(cfg_type="none")
+    wrapper.update_guidance(guidance_scale=3.0)
+    assert wrapper.stream.guidance_scale == 1.0
+    wrapper.update_conditioning("stars")
+    assert calls == [("stars", "human", False)]
+
+
+def test_guidance_crossing_one_re_encodes_with_full_cfg():
+    wrapper, calls = _wrapper(cfg_type="full", guidance_scale=1.0)
+    wrapper.update_guidance(delta=0.5)
+    assert calls == [] and wrapper.stream.delta == 0.5
+    wrapper.update_guidance(guidance_scale=1.5)
+    assert calls == [("moon", "human", True)]
+    # 否定側（-1）と肯定側をバッチで連結する
+    assert wrapper.stream.prompt_embeds.shape == (4, 3, 4)
+    assert (wrapper.stream.prompt_embeds[:2] == -1).all()
+    wrapper.update_guidance(guidance_scale=2.0)
+    assert len(calls) == 1
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from app.cpu_precision import (
+    Int8Layer,
+    autocast_context,
+    compare_images,
+    convert_static_int8,
+    prepare_static_int8,
+    psnr,
+    quantize_dynamic_int8,
+    resolve_mode,
+    ssim,
+    wrap_layers,
+)
+
+
+class _ScaledLinear(nn.Linear):
+    """diffusers の LoRACompatibleLinear と同じく forward に scale を取る Linear"""
+
+    def forward(self, x, scale=1.0):
+        return super().forward(x)
+
+
+class _TinyUNet(nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv_in = nn.Conv2d(3, 8, 3, padding=1)
+        self.time_embedding = nn.Sequential(nn.Linear(8, 8))
+        self.block = nn.Conv2d(8, 8, 3, padding=1)
+        self.proj = _ScaledLinear(8, 8)
+        self.conv_out = nn.Conv2d(8, 3, 3, padding=1)
+
+    def forward(self, x):
+        h = self.conv_in(x)
+        h = h + self.time_embedding(h.mean(dim=(2, 3)))[:, :, None, None]
+        h = torch.relu(self.block(h))
+        h = self.proj(h.permute(0, 2, 3, 1), scale=0.5).permute(0, 3, 1, 2)
+        return self.conv_out(h)
+
+
+def test_resolve_mode():
+    assert resolve_mode("int8_dynamic", torch.device("cpu")) == "int8_dynamic"
+    assert resolve_mode("bf16", torch.device("cuda")) == "fp32"
+    with pytest.raises(ValueError):
+        resolve_mode("fp8", torch.device("cpu"))
+
+
+def test_autocast_context_only_for_bf16():
+    with autocast_context("bf16"):
+        assert (torch.ones(2, 2) @ torch.ones(2, 2)).dtype == torch.bfloat16
+    with autocast_context("fp32"):
+        assert (torch.ones(2, 2) @ torch.ones(2, 2)).dtype == torch.float32
+
+
+def test_wrap_layers_keeps_float_layers_and_drops_extra_arguments():
+    model = _TinyUNet()
+    x = torch.rand(1, 3, 6, 6)
+    with torch.no_grad():
+        expected = model(x)
+
+    assert wrap_layers(model, static=False) == 2
+
+    assert isinstance(model.block, Int8Layer) and isinstance(model.proj, Int8Layer)
+    assert type(model.proj.layer) is nn.Linear
+    assert type(model.conv_in) is nn.Conv2d
+    assert type(model.time_embedding[0]) is nn.Linear
+    with torch.no_grad():
+        torch.testing.assert_close(model(x), expected)
+
+
+def test_quantize_dynamic_int8_only_touches_wrapped_linears():
+    model = _TinyUNet().eval()
+    x = torch.rand(1, 3, 6, 6)
+    with torch.no_grad():
+        expected = model(x)
+
+    assert quantize_dynamic_int8(model) == 1
+
+    assert type(model.proj.layer) is not nn.Linear
+    assert type(model.time_embedding[0]) is nn.Linear
+    assert type(model.block) is nn.Conv2d
+    with torch.no_grad():
+        torch.testing.assert_close(model(x), expected, atol=0.05, rtol=0.05)
+
+
+def test_static_int8_after_calibration():
+    model = _TinyUNet().eval()
+    frames = [torch.rand(1, 3, 6, 6) for _ in range(4)]
+    with torch.no_grad():
+        expected = model(frames[0])
+
+    assert prepare_static_int8(model) == 2
+    with torch.no_grad():
+        for frame in frames:
+            model(frame)
+    convert_static_int8(model)
+
+    assert type(model.block.layer) is not nn.Conv2d
+    assert type(model.conv_in) is nn.Conv2d
+    with torch.no_grad():
+        torch.testing.assert_close(model(frames[0]), expected, atol=0.1, rtol=0.1)
+
+
+def test_identical_images_compare_as_equal():
+    image = np.random.default_rng(0).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+
+    scores = compare_images([image], [image.copy()])
+
+    assert scores["psnr_db"] == float("inf")
+    assert scores["ssim"] == pytest.approx(1.0)
+
+
+def test_psnr_and_ssim_fall_with_noise():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    light = np.clip(image.astype(int) + rng.integers(-4, 5, image.shape), 0, 255).astype(np.uint8)
+    heavy = np.clip(image.astype(int) + rng.integers(-64, 65, image.shape), 0, 255).astype(np.uint8)
+
+    assert psnr(1.0) == pytest.approx(10 * np.log10(255.0 ** 2))
+    assert ssim(image, heavy) < ssim(image, light) < 1.0
+    assert compare_images([image], [heavy])["psnr_db"] < compare_images([image], [light])["psnr_db"]
@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from app.display import DISPLAY_SCALERS, DisplayConverter, DisplayWindow, to_pil, to_uint8_rgb
+
+
+def _float_image(seed=0, size=(3, 16, 24)) -> torch.Tensor:
+    return torch.rand(size, generator=torch.Generator().manual_seed(seed))
+
+
+def _reference_uint8(image_chw: torch.Tensor) -> np.ndarray:
+    """diffusers の numpy_to_pil と同じ (x * 255).round() の HWC RGB"""
+    return (image_chw.permute(1, 2, 0).numpy() * 255).round().astype(np.uint8)
+
+
+def test_to_uint8_rgb_agrees_across_input_types():
+    image = _float_image()
+    expected = _reference_uint8(image)
+    np.testing.assert_array_equal(to_uint8_rgb(image), expected)
+    np.testing.assert_array_equal(to_uint8_rgb(image.permute(1, 2, 0).numpy()), expected)
+    np.testing.assert_array_equal(to_uint8_rgb(expected), expected)
+    np.testing.assert_array_equal(to_uint8_rgb(Image.fromarray(expected)), expected)
+    np.testing.assert_array_equal(np.asarray(to_pil(image)), expected)
+
+
+def test_out_of_range_values_are_clamped():
+    image = torch.tensor([-0.5, 0.5, 1.5]).reshape(3, 1, 1)
+    np.testing.assert_array_equal(to_uint8_rgb(image)[0, 0], [0, 128, 255])
+
+
+@pytest.mark.parametrize("kind", ["tensor", "array", "pil"])
+def test_to_bgr_reverses_channels_at_source_resolution(kind):
+    image = _float_image(1)
+    expected = _reference_uint8(image)[:, :, ::-1]
+    source = {"tensor": image, "array": image.permute(1, 2, 0).numpy(), "pil": to_pil(image)}[kind]
+    bgr = DisplayConverter(48, 32, scaler="window").to_bgr(source)
+    assert bgr.dtype == np.uint8 and bgr.flags.c_contiguous
+    np.testing.assert_array_equal(bgr, expected)
+
+
+@pytest.mark.parametrize("scaler", ["linear", "area", "cubic", "lanczos"])
+def test_scale_matches_cv2_resize(scaler):
+    converter = DisplayConverter(48, 32, scaler=scaler)
+    bgr = converter.to_bgr(_float_image(2))
+    scaled = converter.scale(bgr)
+    assert scaled.shape == (32, 48, 3)
+    np.testing.assert_array_equal(scaled, cv2.resize(bgr, (48, 32), interpolation=DISPLAY_SCALERS[scaler]))
+
+
+def test_scale_reuses_display_buffers_in_turn():
+    converter = DisplayConverter(48, 32, buffers=2, scaler="linear")
+    outputs = [converter(_float_image(seed)) for seed in range(3)]
+    assert outputs[0] is outputs[2] and outputs[0] is not outputs[1]
+    # 表示サイズと同じならコピーだけ
+    same_size = np.zeros((32, 48, 3), dtype=np.uint8)
+    assert converter.scale(same_size) is not same_size
+
+
+def test_window_scaler_leaves_scaling_to_the_window():
+    converter = DisplayConverter(2048, 2048, scaler="window")
+    bgr = converter.to_bgr(_float_image(3))
+    assert converter.scale(bgr) is bgr
+
+
+def test_unknown_scaler_is_rejected():
+    with pytest.raises(ValueError):
+        DisplayConverter(8, 8, scaler="nearest-ish")
+
+
+def test_display_window_keeps_only_the_latest_frame():
+    window = DisplayWindow("test", 8, 8, fps=0)
+    for value in range(3):
+        window.submit(np.full((8, 8, 3), value, np.uint8), provenance=value)
+    assert window.skipped == 2
+    assert window.interval == 0.0
+    window.close()
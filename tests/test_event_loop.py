@@ -0,0 +1,71 @@
+import socket
+import threading
+
+import pytest
+
+from app.event_loop import EVENT_READ, EventLoop
+
+
+@pytest.fixture
+def loop():
+    loop = EventLoop(name="test-loop")
+    loop.start()
+    yield loop
+    loop.stop()
+
+
+def test_call_soon_runs_in_order_on_the_loop_thread(loop):
+    calls = []
+    done = threading.Event()
+    for i in range(5):
+        loop.call_soon(lambda i=i: calls.append((i, loop.in_loop_thread())))
+    loop.call_soon(done.set)
+    assert done.wait(2)
+    assert calls == [(i, True) for i in range(5)]
+    assert not loop.in_loop_thread()
+
+
+def test_run_sync_returns_result(loop):
+    assert loop.run_sync(lambda a, b: a + b, 2, 3) == 5
+
+
+def test_run_sync_without_thread_runs_inline():
+    assert EventLoop().run_sync(threading.current_thread) is threading.current_thread()
+
+
+def test_timers_fire_in_deadline_order_and_can_be_cancelled(loop):
+    fired = []
+    done = threading.Event()
+
+    def schedule():
+        loop.call_later(0.03, fired.append, "late")
+        loop.call_later(0.01, fired.append, "early")
+        loop.call_later(0.02, fired.append, "cancelled").cancel()
+        loop.call_later(0.05, done.set)
+
+    loop.call_soon(schedule)
+    assert done.wait(2)
+    assert fired == ["early", "late"]
+
+
+def test_socket_callback_and_error_isolation(loop):
+    reader, writer = socket.socketpair()
+    reader.setblocking(False)
+    received = []
+    done = threading.Event()
+
+    def on_read(mask):
+        received.append(reader.recv(16))
+        done.set()
+
+    try:
+        # 例外を投げるコールバックがあってもループは止まらない
+        loop.call_soon(lambda: 1 / 0)
+        loop.run_sync(loop.register, reader, EVENT_READ, on_read)
+        writer.send(b"ping")
+        assert done.wait(2)
+        assert received == [b"ping"]
+    finally:
+        loop.run_sync(loop.unregister, reader)
+        reader.close()
+        writer.close()
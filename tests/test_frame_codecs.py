@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.frame_codecs import (
+    ENCODING_JPEG,
+    ENCODING_PNG,
+    ENCODING_WEBP,
+    ENCODING_NAMES,
+    available_encodings,
+    can_encode,
+    decode_frame,
+    encode_frame,
+)
+from app.frame_protocol import FrameParser, encoded_frame_buffers
+
+
+def _frame(shape, seed=0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def _gradient(shape) -> np.ndarray:
+    """非可逆圧縮でも誤差が小さい滑らかな画像"""
+    height, width = shape[:2]
+    image = (np.add.outer(np.arange(height), np.arange(width)) * 4).astype(np.uint8)
+    if len(shape) == 3:
+        image = np.repeat(image[:, :, None], shape[2], axis=2)
+    return image
+
+
+def _supported(*encodings):
+    return [encoding for encoding in encodings if ENCODING_NAMES[encoding] in available_encodings()]
+
+
+@pytest.mark.parametrize("shape", [(24, 32, 3), (24, 32, 4), (24, 32, 1), (24, 32)])
+def test_png_round_trip_is_lossless(shape):
+    frame = _frame(shape)
+    payload, _ = encode_frame(frame, ENCODING_PNG, quality=0)
+    decoded = decode_frame(payload, ENCODING_PNG, frame.shape)
+    assert decoded.shape == frame.shape
+    np.testing.assert_array_equal(decoded, frame)
+
+
+@pytest.mark.parametrize("encoding", _supported(ENCODING_JPEG, ENCODING_WEBP))
+@pytest.mark.parametrize("shape", [(32, 32, 3), (32, 32, 1), (32, 32)])
+def test_lossy_round_trip_keeps_shape(encoding, shape):
+    frame = _gradient(shape)
+    payload, _ = encode_frame(frame, encoding, quality=95)
+    decoded = decode_frame(payload, encoding, frame.shape)
+    assert decoded.shape == frame.shape
+    assert np.abs(decoded.astype(np.int16) - frame).mean() < 4
+
+
+def test_single_channel_frame_passes_parser_shape_check():
+    frame = _frame((16, 16, 1))
+    assert can_encode(frame)
+    payload, _ = encode_frame(frame, ENCODING_PNG, quality=0)
+    data = b"".join(bytes(buffer) for buffer in encoded_frame_buffers(frame, payload, ENCODING_PNG, 1))
+    parser = FrameParser()
+    position = 0
+    message = None
+    while message is None:
+        target = parser.next_buffer()
+        count = len(target)
+        target[:] = data[position:position + count]
+        position += count
+        message = parser.advance(count)
+    np.testing.assert_array_equal(message[1][0], frame)
+
+
+def test_can_encode_rejects_non_image_frames():
+    assert not can_encode(np.zeros((4, 4, 3), dtype=np.float32))
+    assert not can_encode(np.zeros((4, 4, 2), dtype=np.uint8))
+    assert not can_encode(np.zeros((2, 4, 4, 3), dtype=np.uint8))
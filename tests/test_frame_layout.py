@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.frame_layout import FrameLayout
+
+
+def _camera_frame(height, width, seed=0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def _pil_reference(frame_rgb: np.ndarray, crop: int, size: int) -> np.ndarray:
+    """web_camera.py の従来の経路: PIL で中央切り抜き（範囲外は黒）+ NEAREST 縮小"""
+    image = Image.fromarray(frame_rgb)
+    left, top = (image.width - crop) // 2, (image.height - crop) // 2
+    image = image.crop((left, top, left + crop, top + crop)).resize((size, size), Image.NEAREST)
+    return np.asarray(image)
+
+
+# 縮小率が整数（スライス）・非整数（インデックス参照）、切り抜きが画像より大きい（黒で埋める）場合
+@pytest.mark.parametrize("height, width, crop, size", [
+    (480, 640, 256, 128),
+    (480, 640, 300, 128),
+    (120, 160, 256, 128),
+    (97, 131, 64, 48),
+])
+def test_frame_layout_matches_pil(height, width, crop, size):
+    frame = _camera_frame(height, width)
+    expected = _pil_reference(frame[:, :, ::-1], crop, size)
+    layout = FrameLayout(crop_size=crop, size=size, channels="rgb")
+    np.testing.assert_array_equal(layout.apply(frame, "bgr"), expected)
+    np.testing.assert_array_equal(layout.apply(frame[:, :, ::-1].copy(), "rgb"), expected)
+
+
+def test_frame_layout_float32_and_dict_round_trip():
+    layout = FrameLayout(crop_size=64, size=32, channels="rgb", dtype="float32")
+    assert FrameLayout.from_dict(layout.to_dict()).key == layout.key
+    frame = _camera_frame(80, 80)
+    converted = layout.apply(frame, "rgb")
+    assert converted.dtype == np.float32
+    np.testing.assert_allclose(converted * 255.0, _pil_reference(frame, 64, 32), atol=1e-3)
+
+
+def test_passthrough_layout_is_a_view():
+    frame = _camera_frame(8, 8)
+    converted = FrameLayout(channels="rgb").apply(frame, "bgr")
+    assert np.shares_memory(converted, frame)
+    np.testing.assert_array_equal(converted, frame[:, :, ::-1])
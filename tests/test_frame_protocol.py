@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from app.frame_codecs import ENCODING_PNG, encode_frame
+from app.frame_protocol import (
+    MSG_CONTROL,
+    MSG_FRAME,
+    MSG_HEARTBEAT,
+    FrameParser,
+    ProtocolError,
+    control_buffers,
+    encoded_frame_buffers,
+    frame_buffers,
+    heartbeat_buffers,
+    pickled_frame_buffers,
+)
+
+
+def _stream(*messages) -> bytes:
+    return b"".join(bytes(buffer) for buffers in messages for buffer in buffers)
+
+
+def _feed(parser: FrameParser, data: bytes, chunk_size: int):
+    """data を chunk_size バイトずつ受信したように parser に渡し、完成したメッセージを返す"""
+    messages = []
+    position = 0
+    while position < len(data):
+        target = parser.next_buffer()
+        count = min(chunk_size, len(target), len(data) - position)
+        target[:count] = data[position:position + count]
+        position += count
+        message = parser.advance(count)
+        if message is not None:
+            messages.append(message)
+    return messages
+
+
+def _frame(shape=(48, 64, 3), seed=0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def test_frame_round_trip():
+    frame = _frame()
+    parser = FrameParser()
+    (message,) = _feed(parser, _stream(frame_buffers(frame, 7, timestamp=1.5, capture_time=1.25)), 1 << 20)
+    msg_type, (received, header) = message
+    assert msg_type == MSG_FRAME
+    np.testing.assert_array_equal(received, frame)
+    assert header.sequence == 7
+    assert header.timestamp == 1.5
+    assert header.capture_time == 1.25
+    assert header.payload_size == frame.nbytes
+
+
+def test_non_contiguous_frame_keeps_layout():
+    # pygame の画面のような転置ビュー・チャンネルを逆順にしたビュー
+    base = _frame((64, 48, 3))
+    for frame in (base.transpose(1, 0, 2), base[:, :, ::-1], base[8:40, 4:44]):
+        (message,) = _feed(FrameParser(), _stream(frame_buffers(frame, 1)), 1 << 20)
+        np.testing.assert_array_equal(message[1][0], frame)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 100, 4096])
+def test_incremental_parse_of_split_buffers(chunk_size):
+    frames = [_frame(seed=i) for i in range(3)]
+    data = _stream(
+        control_buffers({"type": "hello", "credits": 1}),
+        frame_buffers(frames[0], 1),
+        heartbeat_buffers(),
+        frame_buffers(frames[1], 2),
+        frame_buffers(frames[2], 3),
+    )
+    # バッファは buffer_count - 1 フレーム後に上書きされるので、フレーム数より多くしておく
+    messages = _feed(FrameParser(buffer_count=4), data, chunk_size)
+    assert [msg_type for msg_type, _ in messages] == [MSG_CONTROL, MSG_FRAME, MSG_HEARTBEAT, MSG_FRAME, MSG_FRAME]
+    assert messages[0][1] == {"type": "hello", "credits": 1}
+    received = [value for msg_type, value in messages if msg_type == MSG_FRAME]
+    for frame, (array, header) in zip(frames, received):
+        np.testing.assert_array_equal(array, frame)
+    assert [header.sequence for _, header in received] == [1, 2, 3]
+
+
+def test_encoded_frame_round_trip():
+    frame = _frame()
+    payload, _ = encode_frame(frame, ENCODING_PNG, quality=0)
+    (message,) = _feed(FrameParser(), _stream(encoded_frame_buffers(frame, payload, ENCODING_PNG, 5)), 997)
+    array, header = message[1]
+    # PNG は可逆
+    np.testing.assert_array_equal(array, frame)
+    assert header.encoding == ENCODING_PNG
+
+
+def test_legacy_pickle_requires_opt_in():
+    frame = _frame((4, 4, 3))
+    data = _stream(pickled_frame_buffers(frame))
+    (message,) = _feed(FrameParser(allow_pickle=True), data, 5)
+    np.testing.assert_array_equal(message[1][0], frame)
+    with pytest.raises(ProtocolError):
+        _feed(FrameParser(), data, 1 << 20)
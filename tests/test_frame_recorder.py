@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from app.frame_recorder import FrameRecorder, FrameRecording, load_frames
+
+
+def _record(path, frames, **kwargs):
+    recorder = FrameRecorder(str(path), channels="rgb", **kwargs)
+    for i, frame in enumerate(frames):
+        capture_time = None if i == 0 else 100.0 + i
+        recorder.append(frame, sequence=i + 1, timestamp=10.0 + i * 0.5, capture_time=capture_time,
+                        features={"volume": i * 0.25, "bass": 1.0})
+    recorder.close()
+    return recorder
+
+
+def _frames(count, shape=(12, 20, 3)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(count)]
+
+
+def test_recording_round_trip(tmp_path):
+    frames = _frames(4)
+    recorder = _record(tmp_path / "capture.sdrec", frames)
+    assert recorder.recorded == 4
+
+    recording = FrameRecording(str(tmp_path / "capture.sdrec"))
+    try:
+        assert len(recording) == 4
+        assert recording.shape == (12, 20, 3)
+        assert recording.channels == "rgb"
+        assert recording.duration == pytest.approx(1.5)
+        for i, frame in enumerate(frames):
+            np.testing.assert_array_equal(recording.frame(i), frame)
+        record = recording[-1]
+        assert record.sequence == 4
+        assert record.timestamp == pytest.approx(11.5)
+        assert record.capture_time == pytest.approx(103.0)
+        assert record.features["volume"] == pytest.approx(0.75)
+        assert np.isnan(record.features["mid"])
+        assert recording[0].capture_time is None
+        with pytest.raises(IndexError):
+            recording.frame(4)
+    finally:
+        recording.close()
+
+
+def test_transposed_frames_are_recorded_contiguously(tmp_path):
+    frames = [frame.transpose(1, 0, 2) for frame in _frames(2, (20, 12, 3))]
+    _record(tmp_path / "capture.sdrec", frames)
+    recording = FrameRecording(str(tmp_path / "capture.sdrec"))
+    try:
+        np.testing.assert_array_equal(recording.frame(1), frames[1])
+    finally:
+        recording.close()
+
+
+def test_frames_with_another_shape_are_dropped(tmp_path):
+    frames = _frames(2) + _frames(1, (6, 6, 3))
+    recorder = _record(tmp_path / "capture.sdrec", frames)
+    assert (recorder.recorded, recorder.dropped) == (2, 1)
+
+
+def test_truncated_last_record_is_ignored(tmp_path):
+    path = tmp_path / "capture.sdrec"
+    _record(path, _frames(3))
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 10)
+    recording = FrameRecording(str(path))
+    try:
+        assert len(recording) == 2
+    finally:
+        recording.close()
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 8192)
+    with pytest.raises(ValueError):
+        FrameRecording(str(path))
+
+
+def test_load_frames_from_recording_and_synthetic(tmp_path):
+    _record(tmp_path / "capture.sdrec", _frames(2, (32, 32, 3)))
+    frames = load_frames(5, 8, str(tmp_path / "capture.sdrec"))
+    assert len(frames) == 5
+    assert all(frame.shape == (8, 8, 3) and frame.dtype == np.uint8 for frame in frames)
+    # 録画が短ければ繰り返す
+    np.testing.assert_array_equal(frames[0], frames[2])
+
+    synthetic = load_frames(3, 16)
+    assert [frame.shape for frame in synthetic] == [(16, 16, 3)] * 3
+    assert not np.array_equal(synthetic[0], synthetic[1])
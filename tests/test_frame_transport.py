@@ -0,0 +1,202 @@
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import frame_transport
+from app.frame_layout import FrameLayout
+from app.frame_protocol import FrameHeader, FrameParser, frame_buffers
+from app.frame_transport import FramePacer, FrameReceiver, FrameSender
+
+
+def _parse(parser: FrameParser, frame: np.ndarray, sequence: int):
+    data = b"".join(bytes(buffer) for buffer in frame_buffers(frame, sequence))
+    message = None
+    position = 0
+    while message is None:
+        target = parser.next_buffer()
+        count = min(len(target), len(data) - position)
+        target[:count] = data[position:position + count]
+        position += count
+        message = parser.advance(count)
+    return message
+
+
+def test_published_frame_outlives_parser_buffers():
+    receiver = FrameReceiver(protocol="raw", transport="tcp", flow_control=False)
+    parser = FrameParser(buffer_count=2)
+    receiver._on_message(*_parse(parser, np.full((8, 8, 3), 1, dtype=np.uint8), 1))
+    received = receiver.wait_for_frame(timeout=0)
+    # 同じ受信バッファが再利用されるまでフレームを受信する
+    for sequence in range(2, 5):
+        receiver._on_message(*_parse(parser, np.full((8, 8, 3), sequence, dtype=np.uint8), sequence))
+    assert received.frame_id == 1
+    assert (received.frame == 1).all()
+    assert (receiver.get_latest_frame() == 4).all()
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def sender():
+    sender = FrameSender(host="127.0.0.1", port=0, protocol="raw", transport="tcp", client_queue_size=2)
+    sender.start_server()
+    yield sender
+    sender.stop_server()
+
+
+def _connect(sender, flow_control=False):
+    """sender に接続したフル解像度・raw の受信側"""
+    port = sender.server_socket.getsockname()[1]
+    receiver = FrameReceiver(host="127.0.0.1", port=port, protocol="raw", transport="tcp", encoding="raw",
+                             layout=FrameLayout(), flow_control=flow_control)
+    assert receiver.connect_to_sender()
+    receiver.start_receiving()
+    return receiver
+
+
+def _negotiated(sender, count):
+    return lambda: len(sender.clients) == count and all(client.negotiated for client in sender.clients)
+
+
+def test_every_client_receives_the_frames(sender):
+    receivers = [_connect(sender) for _ in range(3)]
+    try:
+        assert _wait_until(_negotiated(sender, 3))
+        frame = np.random.default_rng(0).integers(0, 256, (24, 32, 3), dtype=np.uint8)
+        sender.send_frame(frame, capture_time=time.time())
+        for receiver in receivers:
+            received = receiver.wait_for_frame(timeout=5)
+            assert received is not None
+            np.testing.assert_array_equal(received.frame, frame)
+            assert received.provenance.sequence == 1
+    finally:
+        for receiver in receivers:
+            receiver.stop_receiving()
+
+
+def test_stalled_client_drops_oldest_without_blocking_send(sender):
+    # 何も読まない（ハンドシェイクもしない）クライアント
+    port = sender.server_socket.getsockname()[1]
+    stalled = socket.create_connection(("127.0.0.1", port))
+    try:
+        assert _wait_until(lambda: len(sender.clients) == 1)
+        frame = np.zeros((256, 256, 3), dtype=np.uint8)
+        started = time.perf_counter()
+        for _ in range(50):
+            sender.send_frame(frame)
+        assert time.perf_counter() - started < 1.0
+        (stats,) = sender.get_client_stats()
+        assert stats["queued"] <= 2
+        assert stats["dropped"] >= 48
+    finally:
+        stalled.close()
+
+
+def _header(sequence):
+    return FrameHeader(sequence, timestamp=time.time(), payload_size=0)
+
+
+def test_wait_for_frame_returns_only_newer_frames():
+    receiver = FrameReceiver(protocol="raw", transport="tcp", flow_control=False)
+    receiver.running = True
+    assert receiver.wait_for_frame(timeout=0.01) is None
+    receiver._set_latest(np.zeros((2, 2, 3), np.uint8), _header(10))
+    first = receiver.wait_for_frame(timeout=0.01)
+    assert first.frame_id == 1 and first.provenance.sequence == 10
+    # 処理済みの frame_id を渡すと同じフレームは返らない
+    assert receiver.wait_for_frame(first.frame_id, timeout=0.01) is None
+
+    threading.Timer(0.05, receiver._set_latest, (np.ones((2, 2, 3), np.uint8), _header(11))).start()
+    second = receiver.wait_for_frame(first.frame_id, timeout=5)
+    assert second.frame_id == 2 and (second.frame == 1).all()
+
+
+def test_stop_receiving_wakes_waiters():
+    receiver = FrameReceiver(protocol="raw", transport="tcp", flow_control=False)
+    receiver.running = True
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(receiver.wait_for_frame(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    receiver.stop_receiving()
+    waiter.join(5)
+    assert results == [None]
+    assert time.monotonic() - started < 1.0
+
+
+class _FakeSender:
+    def __init__(self, wants=True, rate=None):
+        self.wants = wants
+        self.rate = rate
+
+    def wants_frame(self):
+        return self.wants
+
+    def demand_rate(self):
+        return self.rate
+
+
+def test_frame_pacer_modes(monkeypatch):
+    assert FramePacer(_FakeSender(wants=False), "always").should_send()
+
+    sender = _FakeSender(wants=False)
+    pacer = FramePacer(sender, "on_request")
+    assert not pacer.should_send() and pacer.skipped == 1
+    sender.wants = True
+    assert pacer.should_send()
+
+    now = [100.0]
+    monkeypatch.setattr(frame_transport, "time", SimpleNamespace(time=time.time, monotonic=lambda: now[0]))
+    sender = _FakeSender(rate=10.0)
+    pacer = FramePacer(sender, "throttle")
+    assert pacer.should_send()
+    pacer.mark_sent()
+    now[0] += 0.06
+    assert not pacer.should_send()
+    now[0] += 0.06
+    assert pacer.should_send()
+    # 受信側がいなければ送らず、レート未通知なら制限しない
+    sender.rate = 0.0
+    assert not pacer.should_send()
+    sender.rate = None
+    assert pacer.should_send()
+
+    with pytest.raises(ValueError):
+        FramePacer(sender, "sometimes")
+
+
+def test_credits_limit_frames_sent(sender):
+    receiver = _connect(sender, flow_control=True)
+    try:
+        assert _wait_until(_negotiated(sender, 1))
+        assert sender.wants_frame()
+        # 接続時のクレジット（1）の分だけ届く
+        sender.send_frame(np.full((8, 8, 3), 1, dtype=np.uint8))
+        first = receiver.wait_for_frame(timeout=5)
+        assert first is not None and (first.frame == 1).all()
+        assert _wait_until(lambda: sender.get_client_stats()[0]["credits"] == 0)
+        assert not sender.wants_frame()
+
+        # クレジットがなければ送らずにキューに残す
+        sender.send_frame(np.full((8, 8, 3), 2, dtype=np.uint8))
+        assert receiver.wait_for_frame(first.frame_id, timeout=0.2) is None
+
+        # 要求するとキューのフレームが届き、処理レートが伝わる
+        receiver.request_frames(1, rate=12.5)
+        second = receiver.wait_for_frame(first.frame_id, timeout=5)
+        assert second is not None and (second.frame == 2).all()
+        assert _wait_until(lambda: sender.demand_rate() == 12.5)
+    finally:
+        receiver.stop_receiving()
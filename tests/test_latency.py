@@ -0,0 +1,72 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import latency
+from app.frame_protocol import FrameHeader
+from app.latency import FrameProvenance, LatencyTracker, RollingHistogram
+
+
+def _provenance(sequence: int, stage_ms) -> FrameProvenance:
+    """音声取得から stage_ms のミリ秒ずつ各ステージが進んだ来歴"""
+    provenance = FrameProvenance(sequence, capture_time=100.0)
+    now = 100.0
+    for stage, milliseconds in stage_ms:
+        now += milliseconds / 1000
+        provenance.mark(stage, now)
+    return provenance
+
+
+def test_provenance_from_header_orders_stages():
+    header = FrameHeader(7, timestamp=10.02, payload_size=0, capture_time=10.0, send_time=10.03)
+    provenance = FrameProvenance.from_header(header, received_at=10.05)
+    provenance.mark("display", 10.1)
+    assert [stage for stage, _ in provenance.stages] == ["capture", "render", "send", "receive", "display"]
+    assert [stage for stage, _ in provenance.durations()] == ["render", "send", "receive", "display"]
+    assert provenance.end_to_end() == pytest.approx(0.1)
+
+
+def test_provenance_without_capture_time():
+    header = FrameHeader(1, timestamp=5.0, payload_size=0)
+    provenance = FrameProvenance.from_header(header, received_at=5.5)
+    assert provenance.capture_time is None
+    assert provenance.durations() == [("receive", 0.5)]
+    assert FrameProvenance(2).end_to_end() is None
+
+
+def test_rolling_histogram_keeps_last_window():
+    histogram = RollingHistogram(window=100)
+    assert histogram.percentiles() == {}
+    for value in range(1000):
+        histogram.add(float(value))
+    assert len(histogram) == 100 and histogram.count == 1000
+    percentiles = histogram.percentiles()
+    assert percentiles["p50"] == pytest.approx(949.5)
+    assert percentiles["p99"] == pytest.approx(998.01)
+
+
+def test_tracker_summarizes_stages_and_end_to_end():
+    tracker = LatencyTracker(window=10, report_interval=0)
+    for i in range(10):
+        tracker.record(_provenance(i, [("render", 5), ("receive", 2 + i), ("display", 10)]))
+    summary = tracker.summary()
+    assert list(summary) == ["render", "receive", "display", LatencyTracker.END_TO_END]
+    assert summary["render"]["p50"] == pytest.approx(5.0)
+    assert summary["receive"]["p50"] == pytest.approx(6.5)
+    assert summary["end_to_end"]["p95"] == pytest.approx(17 + 0.95 * 9)
+    assert summary["display"]["count"] == 10
+    assert "end_to_end" in tracker.format_report()
+    assert not tracker.maybe_report()
+
+
+def test_tracker_fps_over_recorded_frames(monkeypatch):
+    clock = iter([0.0, 0.1, 0.2, 0.3, 0.4])
+    # time モジュール自体は他のスレッドも使うので、latency から見える time だけを差し替える
+    monkeypatch.setattr(latency, "time", SimpleNamespace(time=time.time, monotonic=lambda: next(clock)))
+    tracker = LatencyTracker(window=3, report_interval=0)
+    assert tracker.fps() == 0.0
+    for i in range(4):
+        tracker.record(_provenance(i, [("display", 1)]))
+    # 直近3フレーム（0.2, 0.3, 0.4 秒）で 2 間隔
+    assert tracker.fps() == pytest.approx(10.0)
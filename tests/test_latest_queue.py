@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+
+from app.latest_queue import LatestQueue
+
+
+def test_full_queue_drops_oldest():
+    queue = LatestQueue(2)
+    for item in range(5):
+        queue.put(item)
+    assert len(queue) == 2
+    assert queue.dropped == 3
+    assert queue.get(timeout=0) == 3
+    assert queue.get(timeout=0) == 4
+    assert queue.get(timeout=0) is None
+
+
+def test_take_latest_discards_older_items():
+    queue = LatestQueue(3)
+    assert queue.take_latest() is None
+    for item in range(3):
+        queue.put(item)
+    assert queue.take_latest() == 2
+    assert len(queue) == 0
+    assert queue.dropped == 2
+
+
+def test_get_waits_for_put():
+    queue = LatestQueue()
+    threading.Timer(0.05, queue.put, args=("frame",)).start()
+    assert queue.get(timeout=2.0) == "frame"
+
+
+def test_close_wakes_waiting_get():
+    queue = LatestQueue()
+    threading.Timer(0.05, queue.close).start()
+    started = time.monotonic()
+    assert queue.get(timeout=2.0) is None
+    assert time.monotonic() - started < 1.0
+    queue.put("ignored")
+    assert len(queue) == 0
+
+
+def test_maxsize_must_be_positive():
+    with pytest.raises(ValueError):
+        LatestQueue(0)
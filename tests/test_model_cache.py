@@ -0,0 +1,144 @@
+import json
+import os
+
+import pytest
+
+from app.model_cache import (
+    DEFAULT_LCM_LORA_ID,
+    DEFAULT_TINY_VAE_ID,
+    FEATURE_EXTRACTOR_ID,
+    SAFETY_CHECKER_ID,
+    ModelCache,
+    ModelCacheError,
+    required_components,
+    select_files,
+)
+
+PIPELINE_FILES = [
+    "model_index.json",
+    "README.md",
+    "v1-5-pruned.safetensors",
+    "unet/config.json",
+    "unet/diffusion_pytorch_model.safetensors",
+    "unet/diffusion_pytorch_model.bin",
+    "unet/diffusion_pytorch_model.fp16.safetensors",
+    "vae/config.json",
+    "vae/diffusion_pytorch_model.bin",
+    "tokenizer/vocab.json",
+    "tokenizer/merges.txt",
+    "safety_checker/nested/extra.json",
+]
+
+
+def _write_pipeline(root, files=("model_index.json", "unet/config.json", "unet/model.safetensors")):
+    for filename in files:
+        path = os.path.join(root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(filename)
+
+
+def test_select_files_for_pipeline_prefers_safetensors():
+    assert select_files(PIPELINE_FILES, "pipeline") == [
+        "model_index.json",
+        "tokenizer/merges.txt",
+        "tokenizer/vocab.json",
+        "unet/config.json",
+        "unet/diffusion_pytorch_model.safetensors",
+        "vae/config.json",
+        "vae/diffusion_pytorch_model.bin",
+    ]
+
+
+def test_select_files_for_root_components():
+    files = ["config.json", "diffusion_pytorch_model.safetensors", "diffusion_pytorch_model.bin",
+             "preprocessor_config.json", "sub/config.json"]
+
+    assert select_files(files, "vae") == [
+        "config.json", "diffusion_pytorch_model.safetensors", "preprocessor_config.json"]
+    assert select_files(files, "feature_extractor") == ["config.json", "preprocessor_config.json"]
+    with pytest.raises(ValueError):
+        select_files(files, "controlnet")
+
+
+def test_required_components():
+    assert required_components("runwayml/stable-diffusion-v1-5") == [
+        ("runwayml/stable-diffusion-v1-5", "pipeline"),
+        (DEFAULT_LCM_LORA_ID, "lora"),
+        (DEFAULT_TINY_VAE_ID, "vae"),
+    ]
+    # sd-turbo には LCM-LoRA を使わない
+    assert required_components("stabilityai/sd-turbo", use_tiny_vae=False, use_safety_checker=True) == [
+        ("stabilityai/sd-turbo", "pipeline"),
+        (SAFETY_CHECKER_ID, "safety_checker"),
+        (FEATURE_EXTRACTOR_ID, "feature_extractor"),
+    ]
+
+
+def test_offline_resolve_without_cache_raises(tmp_path):
+    cache = ModelCache(str(tmp_path), offline=True)
+
+    with pytest.raises(ModelCacheError):
+        cache.resolve("madebyollin/taesd", "vae")
+    with pytest.raises(ModelCacheError):
+        cache.fetch("madebyollin/taesd", "vae")
+
+
+def test_resolve_returns_local_paths_unchanged(tmp_path):
+    cache = ModelCache(str(tmp_path / "models"), offline=True)
+
+    assert cache.resolve(str(tmp_path), "pipeline") == str(tmp_path)
+
+
+def test_existing_pipeline_cache_is_registered_offline(tmp_path):
+    cache = ModelCache(str(tmp_path), offline=True)
+    path = cache.local_path("stabilityai/sd-turbo")
+    _write_pipeline(path)
+
+    assert cache.resolve("stabilityai/sd-turbo", "pipeline") == path
+
+    entry = cache.entries()["stabilityai/sd-turbo"]
+    assert entry["kind"] == "pipeline"
+    assert entry["path"] == "stabilityai--sd-turbo"
+    assert entry["revision"] is None
+    assert sorted(entry["files"]) == ["model_index.json", "unet/config.json", "unet/model.safetensors"]
+    assert entry["files"]["model_index.json"]["size"] == len("model_index.json")
+    # 登録後はマニフェストから解決する
+    assert cache.resolve("stabilityai/sd-turbo", "pipeline") == os.path.join(str(tmp_path), entry["path"])
+    assert cache.verify() == {}
+
+
+def test_missing_or_resized_files_make_the_entry_incomplete(tmp_path):
+    cache = ModelCache(str(tmp_path), offline=True)
+    path = cache.local_path("stabilityai/sd-turbo")
+    _write_pipeline(path)
+    cache.resolve("stabilityai/sd-turbo", "pipeline")
+
+    with open(os.path.join(path, "unet/config.json"), "a", encoding="utf-8") as f:
+        f.write("!")
+    entry = cache.entries()["stabilityai/sd-turbo"]
+    assert cache.missing_files("stabilityai/sd-turbo", entry) == ["unet/config.json"]
+
+    with pytest.raises(ModelCacheError, match="incomplete"):
+        cache.resolve("stabilityai/sd-turbo", "pipeline")
+
+
+def test_verify_detects_same_size_corruption(tmp_path):
+    cache = ModelCache(str(tmp_path), offline=True)
+    path = cache.local_path("stabilityai/sd-turbo")
+    _write_pipeline(path)
+    cache.resolve("stabilityai/sd-turbo", "pipeline")
+
+    with open(os.path.join(path, "model_index.json"), "w", encoding="utf-8") as f:
+        f.write("X" * len("model_index.json"))
+
+    assert cache.verify() == {"stabilityai/sd-turbo": ["model_index.json"]}
+    assert cache.verify(["madebyollin/taesd"]) == {"madebyollin/taesd": ["(not in manifest)"]}
+
+
+def test_unsupported_manifest_version_is_rejected(tmp_path):
+    with open(tmp_path / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump({"version": 999, "components": {}}, f)
+
+    with pytest.raises(ModelCacheError):
+        ModelCache(str(tmp_path)).entries()
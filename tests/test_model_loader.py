@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+import torch
+
+from app.model_loader import StartupProfile, _load_component, snapshot_path
+
+
+def test_phases_are_recorded_in_order():
+    profile = StartupProfile()
+    with profile.phase("import"):
+        time.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        with profile.phase("prepare"):
+            raise RuntimeError("boom")
+
+    names = [name for name, _ in profile.phases]
+    assert names == ["import", "prepare"]
+    assert profile.phases[0][1] >= 0.01
+    assert profile.elapsed() >= profile.phases[0][1]
+
+
+def test_concurrent_phases_are_all_recorded():
+    profile = StartupProfile()
+
+    def load(name):
+        with profile.phase(name):
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=load, args=(f"read:{i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(name for name, _ in profile.phases) == ["read:0", "read:1", "read:2"]
+
+
+def test_format_report_lists_phases_and_total():
+    profile = StartupProfile()
+    profile.add("warmup", 0.25)
+
+    lines = profile.format_report().splitlines()
+
+    assert lines[0] == "=== Startup ==="
+    assert lines[1].startswith("warmup") and lines[1].endswith("250ms")
+    assert lines[-1].startswith("total (wall)")
+
+
+@pytest.mark.parametrize("path", ["models/sd-turbo", "models/sd-turbo/", "models\\sd-turbo\\"])
+def test_snapshot_path_strips_trailing_separator(path):
+    assert snapshot_path(path) == path.rstrip("/\\") + ".safetensors"
+
+
+def test_load_component_assigns_snapshot_weights(tmp_path):
+    pytest.importorskip("safetensors")
+    from safetensors.torch import save_file
+
+    source = torch.nn.Linear(4, 2)
+    path = str(tmp_path / "snapshot.safetensors")
+    save_file({f"unet.{key}": value.contiguous() for key, value in source.state_dict().items()}, path)
+    with torch.device("meta"):
+        empty = torch.nn.Linear(4, 2)
+
+    profile = StartupProfile()
+    model = _load_component(path, "unet", empty, "cpu", torch.float32, profile)
+
+    torch.testing.assert_close(model.weight, source.weight)
+    assert not model.training
+    assert [name for name, _ in profile.phases] == ["read:unet", "to_device:unet"]
+
+
+def test_load_component_rejects_missing_weights(tmp_path):
+    pytest.importorskip("safetensors")
+    from safetensors.torch import save_file
+
+    path = str(tmp_path / "snapshot.safetensors")
+    save_file({"vae.weight": torch.zeros(2, 4)}, path)
+    with torch.device("meta"):
+        empty = torch.nn.Linear(4, 2)
+
+    with pytest.raises(ValueError):
+        _load_component(path, "unet", empty, "cpu", torch.float32, StartupProfile())
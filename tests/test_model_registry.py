@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import torch
+
+from app.model_registry import ModelKey, ModelRegistry, shared_component, tensor_bytes, wrapper_modules
+
+
+def _key(name: str) -> ModelKey:
+    return ModelKey(name, (32, 45), "none", "float32", True)
+
+
+def _fake_model(parameters: int, vae=None):
+    """wrapper_modules が辿る形だけを持つ StreamDiffusion の代わり（float32 の重み parameters 個）"""
+    unet = torch.nn.Linear(parameters - 1, 1, bias=True)
+    pipe = SimpleNamespace(components={"unet": unet, "scheduler": object()})
+    inner = SimpleNamespace(pipe=pipe, unet=unet, vae=vae, text_encoder=None)
+    return SimpleNamespace(stream=SimpleNamespace(stream=inner))
+
+
+def test_wrapper_bytes_count_shared_storage_once():
+    model = _fake_model(100)
+    assert tensor_bytes(wrapper_modules(model)) == 400
+    vae = shared_component("test-vae", lambda: torch.nn.Linear(9, 1))
+    assert shared_component("test-vae", lambda: torch.nn.Linear(99, 1)) is vae
+    first, second = _fake_model(100, vae), _fake_model(100, vae)
+    seen = set()
+    assert tensor_bytes(wrapper_modules(first), seen) + tensor_bytes(wrapper_modules(second), seen) == 800 + 40
+
+
+def test_lru_eviction_by_count_keeps_active_model():
+    loaded = []
+
+    def factory(key):
+        loaded.append(key.model_id)
+        return _fake_model(10)
+
+    registry = ModelRegistry(factory, max_models=2, max_bytes=1 << 30)
+    registry.add(_key("a"), _fake_model(10))
+    registry.get(_key("b"))
+    registry.get(_key("a"))  # a を最近使ったことにする
+    registry.get(_key("c"))
+    assert registry.keys() == [_key("a"), _key("c")]
+    assert (registry.hits, registry.loads, registry.evictions) == (1, 2, 1)
+    assert loaded == ["b", "c"]
+
+    # 使用中のモデルは古くても捨てない
+    registry.get(_key("d"))
+    assert registry.active_key == _key("a")
+    assert registry.keys() == [_key("a"), _key("d")]
+
+
+def test_eviction_makes_room_for_the_estimated_bytes_before_loading():
+    resident_at_load = []
+
+    def factory(key):
+        resident_at_load.append(registry.keys())
+        return _fake_model(100)
+
+    # 400 バイトのモデルが2つまで入る
+    registry = ModelRegistry(factory, max_models=4, max_bytes=800)
+    registry.add(_key("a"), _fake_model(100))
+    registry.get(_key("b"))
+    registry.get(_key("c"))
+    # 数には余裕があるが、c を読み込む前に b を捨てて重みの上限を守る
+    assert resident_at_load[-1] == [_key("a")]
+    assert registry.keys() == [_key("a"), _key("c")]
+    assert registry.total_bytes() <= registry.max_bytes
+
+
+def test_activate_resident_model_calls_back_immediately():
+    registry = ModelRegistry(lambda key: _fake_model(10), max_models=2, max_bytes=1 << 30)
+    registry.add(_key("a"), _fake_model(10))
+    registry.add(_key("b"), _fake_model(10), activate=False)
+    ready = []
+    assert registry.activate(_key("b"), lambda key, model: ready.append(key))
+    assert ready == [_key("b")]
+    assert registry.active_key == _key("b")
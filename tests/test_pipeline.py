@@ -0,0 +1,128 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app import pipeline as pipeline_module
+from app.latest_queue import LatestQueue
+from app.pipeline import PacedQueue, Pipeline, PipelineStage
+
+
+def _source(items):
+    iterator = iter(items)
+    return lambda: next(iterator, None)
+
+
+def test_stages_pass_results_and_skip_none():
+    pipeline = Pipeline()
+    capture = pipeline.add_stage("capture", lambda x: x, source=_source([1, 2, 3]))
+    # 偶数は次のステージへ渡さない
+    infer = pipeline.add_stage("inference", lambda x: x * 10 if x % 2 else None, queue_size=4)
+    shown = []
+    display = pipeline.add_stage("display", shown.append, queue_size=4)
+    while capture.poll():
+        infer.poll(timeout=0)
+    while display.poll(timeout=0):
+        pass
+    assert shown == [10, 30]
+    assert [stage.processed for stage in pipeline.stages] == [3, 3, 2]
+    assert display.input_queue.dropped == 0
+
+
+def test_latest_first_queue_drops_stale_frames():
+    pipeline = Pipeline()
+    capture = pipeline.add_stage("capture", lambda x: x, source=_source(range(5)))
+    infer = pipeline.add_stage("inference", lambda x: x)
+    while capture.poll():
+        pass
+    # 推論が追いつかない間のフレームは捨て、最新だけを処理する
+    assert infer.input_queue.get(timeout=0) == 4
+    assert infer.stats()["dropped"] == 4
+
+
+def test_stage_errors_are_counted_and_do_not_stop_the_stage():
+    def process(x):
+        if x == 2:
+            raise RuntimeError("boom")
+        return x
+
+    output = LatestQueue(4)
+    stage = PipelineStage("postprocess", process, source=_source([1, 2, 3]), output_queue=output)
+    while stage.poll():
+        pass
+    assert stage.errors == 1
+    assert [output.get(timeout=0), output.get(timeout=0)] == [1, 3]
+    stats = stage.stats()
+    assert stats["processed"] == 3 and stats["errors"] == 1
+
+
+def test_threaded_stages_run_until_stopped():
+    pipeline = Pipeline()
+    pipeline.add_stage("capture", lambda x: x, source=_source(range(100)))
+    done = threading.Event()
+    received = []
+
+    def consume(x):
+        received.append(x)
+        if x == 99:
+            done.set()
+
+    display = pipeline.add_stage("display", consume, queue_size=100)
+    pipeline.start(exclude=[display])
+    try:
+        while not done.is_set():
+            display.poll()
+    finally:
+        pipeline.stop()
+    assert received == sorted(received) and received[-1] == 99
+    assert "capture" in pipeline.format_report()
+
+
+def test_stage_needs_exactly_one_input():
+    with pytest.raises(ValueError):
+        PipelineStage("bad", lambda x: x)
+    with pytest.raises(ValueError):
+        PipelineStage("bad", lambda x: x, input_queue=LatestQueue(1), source=lambda: None)
+
+
+def test_paced_queue_spreads_a_batch_over_the_batch_interval(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(pipeline_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    queue = PacedQueue()
+    queue.put(["a0", "a1"])
+    assert queue.get(timeout=0) == "a0"
+    # 間隔がまだわからないので残りもすぐに出す
+    assert queue.get(timeout=0) == "a1"
+
+    now[0] = 0.4
+    queue.put(["b0", "b1", "b2", "b3"])
+    assert queue.interval == pytest.approx(0.1)
+    assert queue.get(timeout=0) == "b0"
+    assert queue.get(timeout=0) is None
+    now[0] = 0.5
+    assert queue.get(timeout=0) == "b1"
+    assert len(queue) == 2
+
+    # 出し切る前に次のまとまりが届いたら残りは捨てる
+    now[0] = 0.8
+    queue.put(["c0", "c1", "c2", "c3"])
+    assert queue.dropped == 2
+    assert queue.get(timeout=0) == "c0"
+    assert queue.put_count == 3
+
+
+def test_paced_queue_keeps_order_and_close_wakes_getters():
+    queue = PacedQueue()
+    queue.put(range(4))
+    assert [queue.get(timeout=1) for _ in range(4)] == [0, 1, 2, 3]
+    queue.put([])
+    assert len(queue) == 0
+
+    results = []
+    getter = threading.Thread(target=lambda: results.append(queue.get()))
+    getter.start()
+    queue.close()
+    getter.join(2)
+    assert results == [None]
+    queue.put([1])
+    assert len(queue) == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from app.preprocess import ArrayPreprocessor
+
+
+def _camera_frame(height, width, seed=0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def _pil_reference(frame_rgb: np.ndarray, crop: int, size: int) -> np.ndarray:
+    """web_camera.py の従来の経路: PIL で中央切り抜き（範囲外は黒）+ NEAREST 縮小"""
+    image = Image.fromarray(frame_rgb)
+    left, top = (image.width - crop) // 2, (image.height - crop) // 2
+    image = image.crop((left, top, left + crop, top + crop)).resize((size, size), Image.NEAREST)
+    return np.asarray(image)
+
+
+@pytest.mark.parametrize("height, width, crop", [(480, 640, 256), (480, 640, 300), (120, 160, 256)])
+def test_array_preprocessor_matches_pil_path(height, width, crop):
+    size = 128
+    frame = _camera_frame(height, width)
+    # 従来の経路: PIL → /255 → 2x-1 → (x+1)/2 の NCHW テンソル
+    reference = torch.from_numpy(_pil_reference(frame[:, :, ::-1], crop, size).astype(np.float32) / 255.0)
+    reference = ((2.0 * reference - 1.0) + 1.0) / 2.0
+    reference = reference.permute(2, 0, 1)[None]
+
+    preprocessor = ArrayPreprocessor(size, size)
+    output = preprocessor(frame, "bgr", crop_size=crop)
+    assert output.shape == (1, 3, size, size)
+    assert torch.equal(output, reference)
+
+
+def test_array_preprocessor_reuses_buffers():
+    preprocessor = ArrayPreprocessor(16, 16, buffers=2)
+    first = preprocessor(_camera_frame(16, 16, seed=1))
+    second = preprocessor(_camera_frame(16, 16, seed=2))
+    third = preprocessor(_camera_frame(16, 16, seed=3))
+    assert first.data_ptr() != second.data_ptr()
+    assert first.data_ptr() == third.data_ptr()
+
+
+def test_array_preprocessor_rejects_non_square():
+    with pytest.raises(ValueError):
+        ArrayPreprocessor(16, 8)
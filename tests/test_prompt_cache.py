@@ -0,0 +1,69 @@
+import torch
+
+from app.prompt_cache import PromptEmbeddingCache
+
+
+def _embedding(value: float, tokens: int = 4) -> torch.Tensor:
+    return torch.full((1, tokens, 8), value)  # float32 で tokens * 32 バイト
+
+
+def test_get_put_hit_and_miss():
+    cache = PromptEmbeddingCache(max_entries=4, max_bytes=1 << 20)
+    assert cache.get("moon") is None
+    cache.put("moon", _embedding(1.0))
+    assert torch.equal(cache.get("moon"), _embedding(1.0))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 1, 1, 128)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = PromptEmbeddingCache(max_entries=2, max_bytes=1 << 20)
+    cache.put("a", _embedding(1.0))
+    cache.put("b", _embedding(2.0))
+    cache.get("a")
+    cache.put("c", _embedding(3.0))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+    cache = PromptEmbeddingCache(max_entries=10, max_bytes=400)
+    cache.put("a", _embedding(1.0))
+    cache.put("b", (_embedding(2.0), _embedding(2.0)))
+    assert cache.bytes == 128 + 256
+    # 1つで上限を超えるものは保持しない（他のエントリも捨てない）
+    cache.put("huge", _embedding(0.0, tokens=16))
+    assert cache.get("huge") is None and cache.stats()["evictions"] == 0
+    cache.put("c", _embedding(3.0))
+    assert cache.stats()["evictions"] == 1 and cache.bytes == 384
+    assert cache.get("a") is None and cache.get("b") is not None
+
+
+def test_put_replaces_existing_entry_size():
+    cache = PromptEmbeddingCache(max_entries=4, max_bytes=1 << 20)
+    cache.put("a", _embedding(1.0, tokens=8))
+    cache.put("a", _embedding(1.0, tokens=2))
+    assert cache.bytes == 64
+    cache.clear()
+    assert cache.bytes == 0 and cache.get("a") is None
+
+
+def test_wrap_encodes_each_key_once():
+    calls = []
+
+    def encode_prompt(prompt, device, num_images_per_prompt, do_classifier_free_guidance, negative_prompt=None,
+                      **kwargs):
+        calls.append((prompt, negative_prompt, do_classifier_free_guidance))
+        return _embedding(len(calls)), None
+
+    cache = PromptEmbeddingCache(max_entries=8, max_bytes=1 << 20)
+    encode = cache.wrap(encode_prompt, "sd-turbo")
+    first = encode("moon", "cpu", 1, False)
+    assert encode("moon", "cpu", 1, False)[0] is first[0]
+    encode("moon", "cpu", 1, True, negative_prompt="human")
+    # 別のモデルのキャッシュとは区別する
+    cache.wrap(encode_prompt, "kohaku")("moon", "cpu", 1, False)
+    # 埋め込みを直接渡す呼び出しはキャッシュしない
+    encode("moon", "cpu", 1, False, prompt_embeds=_embedding(9.0))
+    encode("moon", "cpu", 1, False, prompt_embeds=_embedding(9.0))
+    assert len(calls) == 5
+    assert encode.__wrapped__ is encode_prompt
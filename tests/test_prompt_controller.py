@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from app.phoneme_dictionary import GOJUON_WORDS
+from app.prompt_controller import PromptController, phoneme_words, select_phoneme
+
+
+class _FakeStream:
+    """update_conditioning() を記録し、gate が開くまで止められるラッパー"""
+
+    def __init__(self, prompt="base"):
+        self.prompt = prompt
+        self.calls = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def update_conditioning(self, prompt, negative_prompt=None):
+        self.started.set()
+        self.gate.wait(5)
+        if prompt == "broken":
+            raise RuntimeError("encode failed")
+        self.calls.append((prompt, negative_prompt))
+        self.prompt = prompt
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def controller():
+    controllers = []
+
+    def make(stream, **kwargs):
+        controllers.append(PromptController(stream, **kwargs))
+        return controllers[-1]
+
+    yield make
+    for item in controllers:
+        item.close()
+
+
+def test_submit_applies_through_update_conditioning(controller):
+    stream = _FakeStream()
+    prompts = controller(stream, negative_prompt="blurry")
+
+    prompts.submit("a cat")
+    _wait_until(lambda: prompts.applied == 1)
+
+    assert stream.calls == [("a cat", "blurry")]
+    assert prompts.prompt == "a cat"
+
+
+def test_prompts_arriving_during_an_update_are_coalesced(controller):
+    stream = _FakeStream()
+    prompts = controller(stream)
+    stream.gate.clear()
+
+    prompts.submit("first")
+    assert stream.started.wait(2)
+    for prompt in ("second", "third", "fourth"):
+        prompts.submit(prompt)
+    stream.gate.set()
+    _wait_until(lambda: prompts.applied == 2)
+
+    assert [prompt for prompt, _ in stream.calls] == ["first", "fourth"]
+    assert prompts.coalesced == 2
+    assert prompts.latest == "fourth"
+
+
+def test_failed_update_keeps_the_previous_prompt(controller):
+    stream = _FakeStream()
+    prompts = controller(stream)
+
+    prompts.submit("broken")
+    _wait_until(lambda: prompts.failed == 1)
+
+    assert prompts.prompt == "base"
+    assert "失敗 1" in prompts.format_stats()
+
+
+def test_attach_resubmits_the_latest_prompt(controller):
+    first = _FakeStream()
+    prompts = controller(first)
+    prompts.submit("a cat")
+    _wait_until(lambda: prompts.applied == 1)
+
+    second = _FakeStream(prompt="base")
+    prompts.attach(second)
+    _wait_until(lambda: prompts.applied == 2)
+    assert second.calls == [("a cat", None)]
+
+    # すでに同じプロンプトのラッパーには反映し直さない
+    third = _FakeStream(prompt="a cat")
+    prompts.attach(third)
+    time.sleep(0.05)
+    assert third.calls == []
+
+
+def test_add_words_keeps_the_most_recent_words(controller):
+    prompts = controller(_FakeStream(), base_prompt="watercolor", max_words=3)
+
+    assert prompts.add_words(["rain", "dog"]) == "watercolor, rain, dog"
+    assert prompts.add_words(["dog", "cow", "horse"]) == "watercolor, dog, cow, horse"
+    _wait_until(lambda: prompts.prompt == "watercolor, dog, cow, horse")
+
+
+def test_add_speech_uses_the_first_known_phoneme(controller):
+    prompts = controller(_FakeStream(), max_words=10)
+
+    assert prompts.add_speech("abc") is None
+    prompt = prompts.add_speech("あめ")
+
+    english = {word for _, word in GOJUON_WORDS["あ"]}
+    assert prompts.last_phoneme == "あ"
+    assert prompt == ", ".join(prompts.words)
+    assert set(prompts.words) <= english
+
+
+def test_select_phoneme_skips_a_repeated_phoneme():
+    assert select_phoneme("あい") == "あ"
+    assert select_phoneme("あい", last_phoneme="あ") == "い"
+    assert select_phoneme("あ", last_phoneme="あ") == "あ"
+    assert select_phoneme("xyz") is None
+
+
+def test_phoneme_words_are_distinct():
+    words = phoneme_words("あ", count=5)
+
+    assert len(words) == len(set(words)) == 5
+    assert len(phoneme_words("あ", count=100)) == len(GOJUON_WORDS["あ"])
+    assert phoneme_words("x") == []
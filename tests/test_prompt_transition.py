@@ -0,0 +1,61 @@
+import pytest
+import torch
+
+from app.prompt_transition import lerp, slerp, transition_steps
+
+
+def _embeddings(seed: int) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn((2, 77, 16), generator=generator)
+
+
+@pytest.mark.parametrize("method", ["lerp", "slerp"])
+def test_steps_end_exactly_at_the_new_embeddings(method):
+    start, end = _embeddings(0), _embeddings(1)
+    steps = transition_steps(start, end, 4, method)
+    assert len(steps) == 4
+    assert steps[-1] is end
+    assert all(step.shape == end.shape and step.dtype == end.dtype for step in steps)
+    # 最初の一歩は start から離れ、end に近づいていく
+    distances = [float((step - end).norm()) for step in steps]
+    assert distances == sorted(distances, reverse=True)
+
+
+@pytest.mark.parametrize("interpolate", [lerp, slerp])
+def test_interpolation_endpoints(interpolate):
+    start, end = _embeddings(2), _embeddings(3)
+    torch.testing.assert_close(interpolate(start, end, 0.0), start)
+    torch.testing.assert_close(interpolate(start, end, 1.0), end)
+
+
+def test_slerp_keeps_norm_between_endpoints():
+    start = torch.tensor([[1.0, 0.0]])
+    end = torch.tensor([[0.0, 3.0]])
+    middle = slerp(start, end, 0.5)
+    # 線形補間は途中で縮むが、slerp は大きさを線形に補間する
+    assert float(lerp(start, end, 0.5).norm()) < 2.0
+    assert float(middle.norm()) == pytest.approx(2.0)
+    torch.testing.assert_close(middle / middle.norm(), torch.tensor([[0.5 ** 0.5, 0.5 ** 0.5]]))
+
+
+def test_slerp_of_parallel_vectors_falls_back_to_lerp():
+    start = torch.tensor([[2.0, 0.0]])
+    torch.testing.assert_close(slerp(start, start * 2, 0.5), torch.tensor([[3.0, 0.0]]))
+
+
+def test_no_transition_cases_return_only_the_target():
+    start, end = _embeddings(4), _embeddings(5)
+    assert transition_steps(start, end, 1) == [end]
+    assert transition_steps(start, end, 8, "none") == [end]
+    assert transition_steps(None, end, 8) == [end]
+    # CFG の有無が変わって形が違う場合
+    assert transition_steps(start[:1], end, 8) == [end]
+    with pytest.raises(ValueError):
+        transition_steps(start, end, 4, "cubic")
+
+
+def test_half_precision_is_interpolated_in_float32():
+    start, end = _embeddings(6).half(), _embeddings(7).half()
+    steps = transition_steps(start, end, 3, "slerp")
+    assert all(step.dtype == torch.float16 for step in steps)
+    assert torch.isfinite(torch.stack(steps).float()).all()
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.shm_ring import SharedFrameRing
+
+
+@pytest.fixture
+def ring():
+    ring = SharedFrameRing.create(f"sdtest_{os.getpid()}", (16, 24, 3), np.uint8, slot_count=3)
+    yield ring
+    ring.close()
+
+
+def test_empty_ring_has_no_frame(ring):
+    reader = SharedFrameRing.attach(ring.shm.name)
+    try:
+        assert reader.read_latest() == (None, None)
+    finally:
+        reader.close()
+
+
+def test_reader_sees_latest_frame(ring):
+    reader = SharedFrameRing.attach(ring.shm.name)
+    try:
+        assert (reader.shape, reader.dtype, reader.slot_count) == ((16, 24, 3), np.dtype(np.uint8), 3)
+        frames = [np.full((16, 24, 3), i, dtype=np.uint8) for i in range(5)]
+        for i, frame in enumerate(frames):
+            sequence = ring.write(frame, timestamp=float(i), capture_time=0.5 + i)
+        frame, header = reader.read_latest(copy=True)
+        np.testing.assert_array_equal(frame, frames[-1])
+        assert header.sequence == sequence == 5
+        assert header.timestamp == 4.0
+        assert header.capture_time == 4.5
+    finally:
+        reader.close()
+
+
+def test_close_is_visible_to_reader():
+    ring = SharedFrameRing.create(f"sdtest_close_{os.getpid()}", (2, 2, 3), np.uint8)
+    reader = SharedFrameRing.attach(ring.shm.name)
+    try:
+        assert not reader.closed
+        ring.close()
+        assert reader.closed
+    finally:
+        reader.close()
+
+
+def test_create_replaces_stale_ring():
+    name = f"sdtest_stale_{os.getpid()}"
+    stale = SharedFrameRing.create(name, (2, 2, 3), np.uint8)
+    stale.write(np.ones((2, 2, 3), np.uint8), timestamp=0.0)
+    ring = SharedFrameRing.create(name, (4, 4, 3), np.uint8)
+    try:
+        assert ring.shape == (4, 4, 3)
+        assert ring.read_latest() == (None, None)
+    finally:
+        ring.close()
+        stale.owner = False
+        stale.close()
+
+
+def test_copied_frame_survives_slot_reuse(ring):
+    reader = SharedFrameRing.attach(ring.shm.name)
+    try:
+        ring.write(np.full((16, 24, 3), 1, dtype=np.uint8), timestamp=0.0)
+        frame, header = reader.read_latest(copy=True)
+        # 同じスロットが再利用されるまで書き込む
+        for i in range(ring.slot_count):
+            ring.write(np.full((16, 24, 3), 2 + i, dtype=np.uint8), timestamp=0.0)
+        assert header.sequence == 1
+        assert (frame == 1).all()
+    finally:
+        reader.close()